@@ -1,6 +1,7 @@
-from prisma import Prisma
-from .__main__ import app
-from . import auth, config, plants, utils, prisma
-
-
-prisma = Prisma()
+def __getattr__(name):
+    # The application is imported on first use, so modules like app.utils import
+    # without the whole application and its generated prisma client
+    if name == 'app':
+        from .__main__ import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
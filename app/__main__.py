@@ -5,8 +5,12 @@ from fastapi.responses import JSONResponse
 from fastapi_jwt_auth import AuthJWT
 from fastapi_jwt_auth.exceptions import AuthJWTException
 
-from . import config, auth, plants
-from .prisma import prisma
+from . import config, auth, plants, metrics, query_recorder, health
+from .prisma import prisma, read_router
+from .cluster import cluster
+from .utils.charts import chart_renderer
+from .utils.hasher import hashing_pool, HasherBusyError
+from .utils.send_email import mail_dispatcher, MailQueueFullError
 
 
 app = FastAPI(
@@ -22,6 +26,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if config.Settings().query_log:
+    app.add_middleware(query_recorder.QueryRecorderMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.on_event("startup")
@@ -32,11 +39,26 @@ async def startup():
 
     print("Prisma Connected")
     await prisma.connect()
+    read_router.start()
+    chart_renderer.start()
+    await plants.moisture_buffer.moisture_buffer.start()
+    # The leader runs the irrigation scheduler
+    cluster.start()
+    plants.push.start()
+    mail_dispatcher.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    health.draining = True
+    await mail_dispatcher.stop(config.Settings().mail_drain_seconds)
+    plants.push.stop()
+    cluster.stop()
+    await plants.moisture_buffer.moisture_buffer.stop()
     print("Prisma Disconnected")
+    await read_router.stop()
     await prisma.disconnect()
+    chart_renderer.shutdown()
+    hashing_pool.shutdown()
 
 
 @AuthJWT.load_config
@@ -50,6 +72,24 @@ def authjwt_exception_handler(request: Request, exc: AuthJWTException):
         content={"detail": exc.message}
     )
 
+@app.exception_handler(HasherBusyError)
+def hasher_busy_exception_handler(request: Request, exc: HasherBusyError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many authentication requests, try again later"},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(MailQueueFullError)
+def mail_queue_full_exception_handler(request: Request, exc: MailQueueFullError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many emails are being sent, request the verification email again later"},
+        headers={"Retry-After": "10"}
+    )
+
 
 app.include_router(auth.router, tags=["authentication"])
 app.include_router(plants.router, tags=["plants"])
+app.include_router(metrics.router, tags=["metrics"])
+app.include_router(health.router, tags=["health"])
@@ -2,6 +2,7 @@ from app.utils import hasher
 from app.utils.generate_random_code import generate_random_code
 from . import schemas
 from app.prisma import prisma
+from app.cache import forget_user_devices
 
 
 async def get_user(user_id: str):
@@ -30,7 +31,7 @@ async def get_user_by_email_password(email: str, password: str):
         'verification': True
     })
 
-    if user is None or not hasher.verify_password(password, user.password):
+    if user is None or not await hasher.verify_password_async(password, user.password):
         return None
     
     return user
@@ -46,7 +47,7 @@ async def create_user(user: schemas.UserSignup) -> dict | None:
         'email': user.email,
         'first_name': user.first_name,
         'last_name': user.last_name,
-        'password': hasher.get_password_hash(user.password)
+        'password': await hasher.get_password_hash_async(user.password)
     })
 
     verification = await prisma.verification.create(data={
@@ -88,9 +89,9 @@ async def verify_user(user_id: str, code: str):
 
 async def authenticate_user(user: schemas.UserLogin):
     db_user = await get_user_by_email(user.email)
-    if db_user is None or not hasher.verify_password(user.password, db_user.password):
-        return False
-    return True
+    if db_user is None or not await hasher.verify_password_async(user.password, db_user.password):
+        return None
+    return db_user
 
 
 async def update_user(user: schemas.UserUpdate):
@@ -115,7 +116,7 @@ async def update_user_password(user: schemas.UserUpdatePassword):
         return None
     updated_user = await prisma.user.update(data={
         'email': _user.email,
-        'password': hasher.get_password_hash(user.new_password)
+        'password': await hasher.get_password_hash_async(user.new_password)
     },
     where={
         'email': user.email
@@ -135,5 +136,6 @@ async def remove_user(user: schemas.UserRemove):
     deleted_user = await prisma.user.delete(where={
         'id': delete_user.id
     })
+    forget_user_devices(delete_user.id)
 
     return deleted_user is not None
@@ -1,33 +1,34 @@
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi_jwt_auth import AuthJWT
-from app.utils.send_email import send_email_async
+from app.utils.send_email import mail_dispatcher
 from . import crud, schemas
+from .tokens import create_user_access_token
+from app.query_recorder import query_budget
 
 
 router = APIRouter(prefix='/auth')
 
 
-@router.post('/login')
+@router.post('/login', dependencies=[query_budget(1)])
 async def login(user: schemas.UserLogin, Authorize: AuthJWT = Depends()):
-    auth_user = await crud.authenticate_user(user)
-    if not auth_user:
+    db_user = await crud.authenticate_user(user)
+    if db_user is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, 'Email does not correspond with the password')
     
-    db_user = await crud.get_user_by_email(user.email)
-    if not db_user or db_user.verification is None or not db_user.verification.verified:
+    if db_user.verification is None or not db_user.verification.verified:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, 'Account is not verified')
 
-    access_token = Authorize.create_access_token(subject=user.email, expires_time=user.expires_time)
+    access_token = create_user_access_token(Authorize, db_user, user.expires_time)
     return {'access_token': access_token}
 
 
 @router.post('/signup', status_code=status.HTTP_201_CREATED)
-async def signup(background_tasks: BackgroundTasks, user: schemas.UserSignup):
+async def signup(user: schemas.UserSignup):
     created_user = await crud.create_user(user)
     if created_user is None:
         raise HTTPException(status.HTTP_409_CONFLICT, f"User with email-address '{user.email}' already exists.")
 
-    background_tasks.add_task(send_email_async,
+    mail_dispatcher.enqueue(
         'Account Verification',
         user.email,
         {
@@ -57,12 +58,12 @@ async def verify_user(user_id: str, code: str, Authorize: AuthJWT = Depends()):
     if verification_added is None or verification_added.user is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, f"No account found with id '{user_id}'")
     
-    access_token = Authorize.create_access_token(subject=verification_added.user.email, expires_time=3600)
+    access_token = create_user_access_token(Authorize, verification_added.user)
     return {'access_token': access_token}
 
 
 @router.post("/user/resend_verification")
-async def resend_verification(background_tasks: BackgroundTasks, user: schemas.UserResendVerification):
+async def resend_verification(user: schemas.UserResendVerification):
     db_user = await crud.get_user_by_email(user.email)
     if db_user is None or db_user.verification is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, f"User with email-address '{user.email}' does not exist")
@@ -70,7 +71,7 @@ async def resend_verification(background_tasks: BackgroundTasks, user: schemas.U
     if db_user.verification is not None and db_user.verification.verified:
         raise HTTPException(status.HTTP_208_ALREADY_REPORTED, f"Account is already verified")
     
-    background_tasks.add_task(send_email_async,
+    mail_dispatcher.enqueue(
         'Account Verification',
         user.email,
         {
@@ -104,7 +105,7 @@ async def current_user(Authorize: AuthJWT = Depends()):
     return {'current_user': user}
 
 
-@router.get('/user', response_model=schemas.UserResponse)
+@router.get('/user', response_model=schemas.UserResponse, dependencies=[query_budget(1)])
 async def user(Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
 
@@ -132,7 +133,7 @@ async def update_user(user: schemas.UserUpdate, Authorize: AuthJWT = Depends()):
     
     return {
         "user": updated,
-        "access_token": Authorize.create_access_token(subject=updated.email, expires_time=3600)
+        "access_token": create_user_access_token(Authorize, updated)
     }
 
 
@@ -149,7 +150,7 @@ async def update_user_password(user: schemas.UserUpdatePassword, Authorize: Auth
     
     return {
         "user": updated,
-        "access_token": Authorize.create_access_token(subject=updated.email, expires_time=3600)
+        "access_token": create_user_access_token(Authorize, updated)
     }
 
 
@@ -0,0 +1,25 @@
+import datetime
+from fastapi import HTTPException, status
+from fastapi_jwt_auth import AuthJWT
+from . import crud
+
+
+def create_user_access_token(Authorize: AuthJWT, user, expires_time: int | datetime.timedelta | bool = 3600) -> str:
+    return Authorize.create_access_token(
+        subject=user.email,
+        expires_time=expires_time,
+        user_claims={'user_id': user.id}
+    )
+
+
+async def get_jwt_user_id(Authorize: AuthJWT) -> str:
+    user_id = (Authorize.get_raw_jwt() or {}).get('user_id')
+    if user_id is not None:
+        return user_id
+
+    # Tokens issued before the user_id claim only carry the email as subject
+    user = await crud.get_user_by_email(Authorize.get_jwt_subject())
+    if user is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, 'User does not exist')
+
+    return user.id
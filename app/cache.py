@@ -0,0 +1,29 @@
+import app.config as config
+from app.cluster import cluster
+from app.utils.lru_cache import LRUCache
+
+
+settings = config.Settings()
+
+# Plants resolved by (plant_id, chip_id) for the device endpoints, without relations
+device_identities = LRUCache(settings.device_cache_size, settings.device_cache_ttl)
+
+# Rendered graph SVGs, bounded by their total size in bytes
+rendered_graphs = LRUCache(settings.graph_cache_bytes, weigh=len)
+
+
+def forget_device(plant_id: str, chip_id: str):
+    '''
+    Drops the cached plant in every worker
+    '''
+    cluster.broadcast('device', [plant_id, chip_id])
+
+
+def forget_user_devices(user_id: str):
+    cluster.broadcast('user_devices', user_id)
+
+
+cluster.subscribe('device', lambda key: device_identities.pop(tuple(key)))
+cluster.subscribe('user_devices', lambda user_id: device_identities.remove_where(lambda plant: plant.user_id == user_id))
+# Changes of other workers may have been missed
+cluster.subscribe('reconnected', lambda _: device_identities.clear())
@@ -0,0 +1,213 @@
+'''
+Coordination of the workers through Postgres.
+
+Every worker keeps one connection of its own, outside the prisma pool, listening on the
+cluster channel. A message published by a worker runs the handlers subscribed to its kind
+in every other worker, the publishing worker applies its own changes directly.
+The worker holding the leader advisory lock on its connection runs the singleton loops,
+Postgres releases the lock when the connection of the leader is lost.
+'''
+import os
+import json
+import uuid
+import asyncio
+from typing import Any, Callable
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import psycopg2
+import psycopg2.extensions
+from app.prisma import prisma, request_queries
+import app.config as config
+
+
+settings = config.Settings()
+
+CHANNEL = 'plantpal'
+
+# Key of the advisory lock held by the leader
+LEADER_LOCK = 7_150_000_019
+
+# Query parameters of prisma urls libpq does not know
+PRISMA_PARAMETERS = {'schema', 'connection_limit', 'pool_timeout', 'pgbouncer', 'statement_cache_size', 'socket_timeout'}
+
+
+def libpq_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key not in PRISMA_PARAMETERS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class Cluster:
+    def __init__(self, url: str, check_interval: float, connect_timeout: int):
+        self.url = url
+        self.check_interval = check_interval
+        self.connect_timeout = connect_timeout
+        self.worker_id = uuid.uuid4().hex
+        self.leader = False
+        self.published = 0
+        self.received = 0
+        self._connection = None
+        self._handlers: dict[str, list[Callable[[Any], None]]] = {}
+        self._leadership_listeners: list[Callable[[bool], None]] = []
+        # Set while handling a received message, its handlers do not publish it again
+        self._receiving = False
+        self._task: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def subscribe(self, kind: str, handler: Callable[[Any], None]):
+        '''
+        Registers a handler called with the data of every message of this kind another worker published,
+        messages of kind 'reconnected' are handled after messages may have been missed
+        '''
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def on_leadership(self, listener: Callable[[bool], None]):
+        '''
+        Registers a listener called with True when this worker became the leader, with False when it lost it
+        '''
+        self._leadership_listeners.append(listener)
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def publish(self, kind: str, data: Any):
+        '''
+        Sends a message to the other workers
+        '''
+        if self._receiving:
+            return
+        self._spawn(self._notify(json.dumps({'worker': self.worker_id, 'kind': kind, 'data': data})))
+
+    def broadcast(self, kind: str, data: Any):
+        '''
+        Handles a message in this worker and sends it to the other workers
+        '''
+        self._handle(kind, data)
+        self.publish(kind, data)
+
+    async def _notify(self, payload: str):
+        # Not a query of the request that published the message
+        request_queries.set(None)
+        try:
+            await prisma.execute_raw('SELECT pg_notify($1, $2)', CHANNEL, payload)
+            self.published += 1
+        except Exception as e:
+            print(f"Publishing {payload} failed: {e!r}")
+
+    def _handle(self, kind: str, data: Any):
+        for handler in self._handlers.get(kind, []):
+            try:
+                handler(data)
+            except Exception as e:
+                print(f"Handling the cluster message {kind} {data!r} failed: {e!r}")
+
+    def _receive(self):
+        while self._connection is not None and self._connection.notifies:
+            message = json.loads(self._connection.notifies.pop(0).payload)
+            if message['worker'] == self.worker_id:
+                continue
+
+            self.received += 1
+            self._receiving = True
+            try:
+                self._handle(message['kind'], message['data'])
+            finally:
+                self._receiving = False
+
+    def _on_readable(self):
+        try:
+            self._connection.poll()
+        except psycopg2.Error as e:
+            self._lost(e)
+            return
+        self._receive()
+
+    def _connect(self):
+        connection = psycopg2.connect(
+            self.url,
+            connect_timeout=self.connect_timeout,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
+        )
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        return connection
+
+    def _check_leader(self) -> bool:
+        with self._connection.cursor() as cursor:
+            if self.leader:
+                # The lock lives as long as the connection, checking the connection is enough
+                cursor.execute('SELECT 1')
+                return True
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', (LEADER_LOCK,))
+            return cursor.fetchone()[0]
+
+    def _set_leader(self, leader: bool):
+        if leader == self.leader:
+            return
+        self.leader = leader
+        print(f"This worker {'became' if leader else 'is no longer'} the leader")
+        for listener in self._leadership_listeners:
+            listener(leader)
+
+    def _lost(self, error: Exception):
+        print(f"Cluster connection lost: {error!r}")
+        if self._connection is not None:
+            asyncio.get_running_loop().remove_reader(self._connection.fileno())
+            try:
+                self._connection.close()
+            except psycopg2.Error:
+                pass
+            self._connection = None
+        self._set_leader(False)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if self._connection is None:
+                    self._connection = await loop.run_in_executor(None, self._connect)
+                    loop.add_reader(self._connection.fileno(), self._on_readable)
+                    self._handle('reconnected', None)
+                leader = await loop.run_in_executor(None, self._check_leader)
+                # Notifications read by the query are not signalled to the reader again
+                self._receive()
+                self._set_leader(leader)
+            except psycopg2.Error as e:
+                self._lost(e)
+            await asyncio.sleep(self.check_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = self._spawn(self.run())
+
+    def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._task = None
+        if self._connection is not None:
+            asyncio.get_running_loop().remove_reader(self._connection.fileno())
+            # Closing the connection releases the leader lock
+            self._connection.close()
+            self._connection = None
+        self._set_leader(False)
+
+    def stats(self) -> dict:
+        return {
+            'leader': self.leader,
+            'connected': self._connection is not None,
+            'published': self.published,
+            'received': self.received
+        }
+
+
+cluster = Cluster(
+    libpq_url(settings.database_url or os.environ.get('DATABASE_URL', '')),
+    settings.cluster_check_interval,
+    settings.db_connect_timeout
+)
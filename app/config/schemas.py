@@ -10,6 +10,69 @@ class Settings(BaseSettings):
     mail_port: int = 587
     mail_server: str = 'smtp.office365.com'
     mail_from_name: str = 'PlantPal'
+    mail_starttls: bool = True
+    mail_use_credentials: bool = True
+    mail_timeout: float = 30.0
+    # Persistent SMTP sessions, each sends up to mail_batch_size emails per wake up
+    mail_connections: int = 2
+    mail_batch_size: int = 20
+    mail_queue_size: int = 1000
+    mail_max_attempts: int = 5
+    mail_retry_delay: float = 5.0
+    mail_idle_seconds: float = 60.0
+    mail_drain_seconds: float = 10.0
+
+    device_cache_size: int = 10_000
+    device_cache_ttl: int = 300
+    # Seconds a device has to identify itself on the websocket
+    device_identify_timeout: float = 10.0
+
+    graph_max_buckets: int = 200
+    graph_cache_bytes: int = 32 * 1024 * 1024
+    graph_render_workers: int = 2
+    graph_render_concurrency: int = 4
+    graph_render_timeout: float = 10.0
+
+    export_page_size: int = 5000
+
+    hash_workers: int = 4
+    hash_queue_size: int = 64
+
+    irrigation_due_minutes: int = 60
+
+    # Acknowledge moisture readings once they are logged, store them in batches
+    moisture_write_behind: bool = False
+    moisture_log_dir: str = 'moisture-log'
+    moisture_log_fsync: bool = False
+    moisture_flush_size: int = 1000
+    moisture_flush_seconds: float = 1.0
+    moisture_buffer_size: int = 100_000
+    # Plants whose latest moisture reading is kept in memory
+    latest_moisture_size: int = 100_000
+
+    query_log: bool = False
+    query_budget_strict: bool = False
+
+    database_url: str | None = None
+    # Connections of the whole host, split evenly over the workers,
+    # one connection of every worker is kept for the cluster channel
+    db_connection_limit: int | None = None
+    db_pool_timeout: int = 10
+    db_connect_timeout: int = 10
+
+    replica_database_url: str | None = None
+    replica_max_lag_seconds: float = 5.0
+    replica_check_interval: float = 5.0
+    # Reads of a user stay on the primary this long after they wrote
+    replica_pin_seconds: float = 10.0
+
+    host: str = '0.0.0.0'
+    port: int = 80
+    workers: int = 1
+    # Seconds between attempts to become the leader, which runs the irrigation scheduler
+    cluster_check_interval: float = 5.0
+    shutdown_drain_seconds: float = 5.0
+    health_check_timeout: float = 2.0
 
     class Config:
         env_file = '.env'
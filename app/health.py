@@ -0,0 +1,39 @@
+import asyncio
+from fastapi import APIRouter, Response, status
+from app.prisma import prisma, read_router
+import app.config as config
+
+
+settings = config.Settings()
+
+# Set once the server is shutting down, readiness fails so no new requests are routed here
+draining = False
+
+router = APIRouter(prefix='/health')
+
+
+@router.get('/live')
+async def live():
+    return {'status': 'ok'}
+
+
+@router.get('/ready')
+async def ready(response: Response):
+    database = prisma.is_connected()
+    if database:
+        try:
+            await asyncio.wait_for(prisma.query_raw('SELECT 1'), settings.health_check_timeout)
+        except Exception:
+            database = False
+
+    is_ready = database and not draining
+    if not is_ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+
+    # Reads fall back to the primary, an unavailable replica does not fail readiness
+    return {
+        'status': 'ok' if is_ready else 'unavailable',
+        'database': database,
+        'replica': read_router.available if read_router.replica is not None else None,
+        'draining': draining
+    }
@@ -0,0 +1,183 @@
+'''
+Request, database, cache and pool metrics, exposed at /metrics in the Prometheus text format
+'''
+import time
+from fastapi import APIRouter, Response
+from app.prisma import RequestQueries, request_queries, read_router
+from app.cluster import cluster
+from app.cache import device_identities, rendered_graphs
+from app.utils.charts import chart_renderer
+from app.utils.hasher import hashing_pool
+from app.utils.send_email import mail_dispatcher
+from app.utils.metrics import Counter, Gauge, Histogram, registry
+from app.plants.devices import device_hub
+from app.plants.scheduler import irrigation_scheduler
+from app.plants.moisture_buffer import moisture_buffer
+from app.plants.moisture_policy import latest_moisture
+
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21)
+
+requests_total = Counter('plantpal_http_requests_total', 'HTTP requests', ['method', 'route', 'status'])
+request_duration = Histogram('plantpal_http_request_duration_seconds', 'HTTP request duration', ['method', 'route'])
+requests_in_flight = Gauge('plantpal_http_requests_in_flight', 'HTTP requests being served', ['method'])
+request_db_queries = Histogram('plantpal_http_request_db_queries', 'Database queries per HTTP request', ['method', 'route'], QUERY_COUNT_BUCKETS)
+request_db_seconds = Histogram('plantpal_http_request_db_seconds', 'Database time per HTTP request', ['method', 'route'])
+registry.register(requests_total, request_duration, requests_in_flight, request_db_queries, request_db_seconds)
+
+cache_hits = Counter('plantpal_cache_hits_total', 'Cache hits', ['cache'])
+cache_misses = Counter('plantpal_cache_misses_total', 'Cache misses', ['cache'])
+cache_entries = Gauge('plantpal_cache_entries', 'Entries in the cache', ['cache'])
+cache_weight = Gauge('plantpal_cache_weight', 'Weight of the cache entries, the entries for unweighted caches', ['cache'])
+cache_maxsize = Gauge('plantpal_cache_maxsize', 'Maximum weight of the cache', ['cache'])
+registry.register(cache_hits, cache_misses, cache_entries, cache_weight, cache_maxsize)
+
+pool_workers = Gauge('plantpal_pool_workers', 'Workers of the pool', ['pool'])
+pool_in_flight = Gauge('plantpal_pool_in_flight', 'Calls waiting for or running on the pool', ['pool'])
+pool_calls = Counter('plantpal_pool_calls_total', 'Calls completed by the pool', ['pool'])
+pool_rejected = Counter('plantpal_pool_rejected_total', 'Calls rejected or timed out by the pool', ['pool'])
+pool_call_seconds = Counter('plantpal_pool_call_seconds_total', 'Time spent running the calls completed by the pool', ['pool'])
+pool_call_max_seconds = Gauge('plantpal_pool_call_max_seconds', 'Longest call completed by the pool', ['pool'])
+devices_connected = Gauge('plantpal_devices_connected', 'Devices connected over WebSocket')
+scheduled_plants = Gauge('plantpal_scheduled_plants', 'Plants in the irrigation scheduler timer wheel')
+replica_available = Gauge('plantpal_replica_available', 'Whether reads are sent to the replica')
+replica_lag = Gauge('plantpal_replica_lag_seconds', 'Replay lag of the replica at the last check')
+registry.register(pool_workers, pool_in_flight, pool_calls, pool_rejected, pool_call_seconds, pool_call_max_seconds, devices_connected, scheduled_plants, replica_available, replica_lag)
+
+moisture_buffered = Gauge('plantpal_moisture_buffered', 'Moisture readings acknowledged but not stored yet')
+moisture_stored = Counter('plantpal_moisture_buffer_stored_total', 'Moisture readings stored by the write-behind buffer')
+moisture_failed_flushes = Counter('plantpal_moisture_buffer_failed_flushes_total', 'Failed flushes of the write-behind buffer')
+moisture_readings = Counter('plantpal_moisture_readings_total', 'Moisture readings stored or filtered by the plant storage policy', ['result'])
+registry.register(moisture_buffered, moisture_stored, moisture_failed_flushes, moisture_readings)
+
+mail_sessions = Counter('plantpal_mail_sessions_total', 'SMTP sessions opened')
+mail_retried = Counter('plantpal_mail_retried_total', 'Emails scheduled for a retry')
+mail_failed = Counter('plantpal_mail_failed_total', 'Emails rejected by the server or dropped after their last attempt')
+registry.register(mail_sessions, mail_retried, mail_failed)
+
+cluster_leader = Gauge('plantpal_cluster_leader', 'Whether this worker is the leader and runs the irrigation scheduler')
+cluster_connected = Gauge('plantpal_cluster_connected', 'Whether this worker listens on the cluster channel')
+cluster_messages = Counter('plantpal_cluster_messages_total', 'Messages published to or received from the other workers', ['direction'])
+registry.register(cluster_leader, cluster_connected, cluster_messages)
+
+
+@registry.on_collect
+def collect():
+    for name, cache in (('device_identities', device_identities), ('rendered_graphs', rendered_graphs), ('latest_moisture', latest_moisture)):
+        stats = cache.stats()
+        cache_hits.set(stats['hits'], cache=name)
+        cache_misses.set(stats['misses'], cache=name)
+        cache_entries.set(stats['size'], cache=name)
+        cache_weight.set(stats['weight'], cache=name)
+        cache_maxsize.set(stats['maxsize'], cache=name)
+
+    stats = hashing_pool.stats()
+    pool_workers.set(stats['workers'], pool='hasher')
+    pool_in_flight.set(stats['queue_depth'], pool='hasher')
+    pool_calls.set(stats['calls'], pool='hasher')
+    pool_rejected.set(stats['rejected'], pool='hasher')
+    pool_call_seconds.set(stats['total_seconds'], pool='hasher')
+    pool_call_max_seconds.set(stats['max_seconds'], pool='hasher')
+
+    stats = chart_renderer.stats()
+    pool_workers.set(stats['workers'], pool='chart_renderer')
+    pool_in_flight.set(stats['in_flight'], pool='chart_renderer')
+    pool_calls.set(stats['renders'], pool='chart_renderer')
+    pool_rejected.set(stats['timeouts'], pool='chart_renderer')
+
+    stats = mail_dispatcher.stats()
+    pool_workers.set(stats['connections'], pool='mail')
+    pool_in_flight.set(stats['queue_depth'] + stats['retrying'], pool='mail')
+    pool_calls.set(stats['sent'], pool='mail')
+    pool_rejected.set(stats['rejected'], pool='mail')
+    mail_sessions.set(stats['sessions'])
+    mail_retried.set(stats['retried'])
+    mail_failed.set(stats['failed'])
+
+    stats = cluster.stats()
+    cluster_leader.set(int(stats['leader']))
+    cluster_connected.set(int(stats['connected']))
+    cluster_messages.set(stats['published'], direction='published')
+    cluster_messages.set(stats['received'], direction='received')
+
+    devices_connected.set(len(device_hub))
+    scheduled_plants.set(len(irrigation_scheduler.wheel))
+
+    moisture_readings.set(latest_moisture.stored, result='stored')
+    moisture_readings.set(latest_moisture.filtered, result='filtered')
+
+    if moisture_buffer.enabled:
+        stats = moisture_buffer.stats()
+        moisture_buffered.set(stats['pending'])
+        moisture_stored.set(stats['stored'])
+        moisture_failed_flushes.set(stats['failed_flushes'])
+
+    if read_router.replica is not None:
+        replica_available.set(int(read_router.available))
+        if read_router.lag is not None:
+            replica_lag.set(read_router.lag)
+
+
+class MetricsMiddleware:
+    '''
+    Times every HTTP request and counts the database queries it issued,
+    requests are labelled with the path of the route that served them
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: dict = {}
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        if endpoint not in self._routes:
+            self._routes = {
+                route.endpoint: route.path
+                for route in scope['app'].routes
+                if hasattr(route, 'endpoint')
+            }
+        return self._routes.get(endpoint, 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        method = scope['method']
+        status = 500
+        # Requests made inside an outer recorder, like assert_max_queries in tests, are added to it
+        outer = request_queries.get()
+        queries = RequestQueries(log=[] if outer is not None and outer.log is not None else None)
+        token = request_queries.set(queries)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        requests_in_flight.inc(method=method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec(method=method)
+            request_queries.reset(token)
+            if outer is not None:
+                outer.add(queries)
+
+            route = self._route(scope)
+            requests_total.inc(method=method, route=route, status=status)
+            request_duration.observe(elapsed, method=method, route=route)
+            request_db_queries.observe(queries.count, method=method, route=route)
+            request_db_seconds.observe(queries.seconds, method=method, route=route)
+
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+async def metrics():
+    return Response(registry.render(), media_type='text/plain; version=0.0.4')
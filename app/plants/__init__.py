@@ -1 +1,2 @@
 from .routers import router
+from . import crud, push, scheduler, moisture_buffer, sync
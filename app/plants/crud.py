@@ -1,76 +1,68 @@
+import json
 import random
+from typing import NamedTuple
+from prisma.enums import DayOfWeek
+from prisma.models import MoisturePercentageRecord
 from prisma.errors import UniqueViolationError as PrismaUniqueViolationError
-import pygal, pygal.style
 import datetime
-from app.auth.crud import get_user_by_email
-from app.utils.graph_period import GraphPeriod
-from app.utils.comparedatetime import filter_timestamps, filter_periodstamps
+from app.utils.graph_period import GraphPeriod, GRAPH_PERIOD_WINDOWS, graph_period_start
+from app.utils.etag import make_etag, etag_matches
+from app.utils.charts import chart_renderer
+from app.utils.export import ExportRecords
 from app.utils.minutes_to_weektime import minutes_to_weektime
-from app.prisma import prisma
+from app.prisma import prisma, read_router
+from app.cache import device_identities, rendered_graphs, forget_device
+from .schedule import PlantSchedule, ScheduledStamp, schedule_index
+from .scheduler import irrigation_scheduler
+from .rollups import ROLLUP_TABLES, ROLLUP_BUCKETS_QUERY, store_readings
+from .moisture_buffer import moisture_buffer
+from .moisture_policy import latest_moisture, as_utc
 import app.auth as auth
+import app.config as config
 from . import schemas
 
 
-charts_style = pygal.style.Style(
-    background='transparent',
-    plot_background='transparent',
-    foreground='#bbb',
-    foreground_strong='#fff',
-    foreground_subtle='#bbb',
-    opacity='.4',
-    opacity_hover='.9',
-    transition='400ms ease-in',
-    colors=('#E853A0', '#E8537A', '#E95355', '#E87653', '#E89B53')
-)
+settings = config.Settings()
 
 
 async def get_plant_by_chip_id(plant_id: str, chip_id: str):
-    return await prisma.plant.find_first(where={
+    plant = device_identities.get((plant_id, chip_id))
+    if plant is not None:
+        return plant
+
+    plant = await prisma.plant.find_first(where={
         'id': plant_id,
         'chip_id': chip_id
-    },
-    include={
-        'user': True
     })
+    if plant is not None:
+        device_identities.set((plant_id, chip_id), plant)
 
+    return plant
 
-async def get_plant_by_id(user_email: str, plant_id: str):
-    user = await auth.crud.get_user_by_email(user_email)
-    if user is None:
-        return None
 
-    return await prisma.plant.find_first(where={
+async def get_plant_by_id(user_id: str, plant_id: str, db=prisma):
+    return await db.plant.find_first(where={
         'id': plant_id,
-        'user_id': user.id
-    },
-    include={
-        'user': True
+        'user_id': user_id
     })
 
 
-async def get_plant(user_email: str, plant_id: str):
-    plant = await get_plant_by_id(user_email, plant_id)
-    if plant is None or plant.user is None:
-        return None
-    return plant
+async def get_plant(user_id: str, plant_id: str):
+    return await get_plant_by_id(user_id, plant_id)
 
 
-async def get_plant_timestamps(user_email: str, plant_id: str):
-    plant = await get_plant_by_id(user_email, plant_id)
-    if plant is None:
-        return None
-
-    return await prisma.plant.find_first(where={
-        'id': plant.id,
+async def get_plant_timestamps(user_id: str, plant_id: str):
+    return await read_router.read(user_id, lambda db: db.plant.find_first(where={
+        'id': plant_id,
+        'user_id': user_id
     },
     include={
-        'user': True,
         'timestamps': True
-    })
+    }))
 
 
-async def add_plant_timestamp(user_email: str, plant_id: str, timestamp: schemas.TimeStampAdd):
-    plant = await get_plant_by_id(user_email, plant_id)
+async def add_plant_timestamp(user_id: str, plant_id: str, timestamp: schemas.TimeStampAdd):
+    plant = await get_plant_by_id(user_id, plant_id)
     if plant is None:
         return None
     
@@ -82,51 +74,59 @@ async def add_plant_timestamp(user_email: str, plant_id: str, timestamp: schemas
     }) is not None:
         return "already exists"
 
-    return await prisma.timestamp.create({
+    created_timestamp = await prisma.timestamp.create({
         'day_of_week': timestamp.day_of_week,
         'hour': timestamp.hour,
         'minute': timestamp.minute,
         'plant_id': plant.id
     })
+    schedule_index.invalidate(plant.id)
+    read_router.pin(user_id)
+
+    return created_timestamp
 
 
-async def remove_plant_all_timestamps(user_email: str, plant_id: str):
-    plant = await get_plant_by_id(user_email, plant_id)
+async def remove_plant_all_timestamps(user_id: str, plant_id: str):
+    plant = await get_plant_by_id(user_id, plant_id)
     if plant is None:
         return None
 
-    return await prisma.timestamp.delete_many(where={
+    deleted = await prisma.timestamp.delete_many(where={
         'plant_id': plant.id
     })
+    schedule_index.invalidate(plant.id)
+    read_router.pin(user_id)
 
+    return deleted
 
-async def remove_plant_timestamp(user_email: str, plant_id: str, timestamp_id: str):
-    plant = await get_plant_by_id(user_email, plant_id)
+
+async def remove_plant_timestamp(user_id: str, plant_id: str, timestamp_id: str):
+    plant = await get_plant_by_id(user_id, plant_id)
     if plant is None:
         return None
 
-    return await prisma.timestamp.delete_many(where={
+    deleted = await prisma.timestamp.delete_many(where={
         'id': timestamp_id,
         'plant_id': plant_id
     })
+    schedule_index.invalidate(plant.id)
+    read_router.pin(user_id)
 
+    return deleted
 
-async def get_plant_periodstamps(user_email: str, plant_id: str):
-    plant = await get_plant_by_id(user_email, plant_id)
-    if plant is None:
-        return None
 
-    return await prisma.plant.find_first(where={
-        'id': plant.id,
+async def get_plant_periodstamps(user_id: str, plant_id: str):
+    return await read_router.read(user_id, lambda db: db.plant.find_first(where={
+        'id': plant_id,
+        'user_id': user_id
     },
     include={
-        'user': True,
         'periodstamps': True
-    })
+    }))
 
 
-async def change_plant_periodstamps(user_email: str, plant_id: str, periodstamp: schemas.PeriodStampsChange):
-    plant = await get_plant_by_id(user_email, plant_id)
+async def change_plant_periodstamps(user_id: str, plant_id: str, periodstamp: schemas.PeriodStampsChange):
+    plant = await get_plant_by_id(user_id, plant_id)
     if plant is None:
         return None
 
@@ -140,7 +140,11 @@ async def change_plant_periodstamps(user_email: str, plant_id: str, periodstamp:
     await prisma.periodstamp.delete_many(where={
         'plant_id': plant.id
     })
+    forget_device(plant.id, plant.chip_id)
+    read_router.pin(user_id)
+    # Invalidated once the new stamps exist, a refresh in between would keep no stamps
     if periodstamp.times_a_week == 0:
+        schedule_index.invalidate(plant.id)
         return 0
     
     WEEK_IN_MINUTES = 10_080
@@ -150,7 +154,7 @@ async def change_plant_periodstamps(user_email: str, plant_id: str, periodstamp:
             ((irrigation_delay * m) + random.randint(0, 10)) if irrigation_delay * m < WEEK_IN_MINUTES else WEEK_IN_MINUTES
         ) for m in range(periodstamp.times_a_week)
     ]
-    return await prisma.periodstamp.create_many(data=[
+    created = await prisma.periodstamp.create_many(data=[
         {
             'plant_id': plant.id,
             'day_of_week': p.weekday,
@@ -159,108 +163,135 @@ async def change_plant_periodstamps(user_email: str, plant_id: str, periodstamp:
         }
         for p in periods if p is not None
     ])
+    schedule_index.invalidate(plant.id)
 
+    return created
 
-async def get_plant_times(user_email: str, plant_id: str):
-    plant = await get_plant_by_id(user_email, plant_id)
-    if plant is None:
-        return None
 
-    plant_data = await prisma.plant.find_first(where={
-        'id': plant.id,
-        'user_id': plant.user_id
+async def get_plant_times(user_id: str, plant_id: str):
+    plant_data = await read_router.read(user_id, lambda db: db.plant.find_first(where={
+        'id': plant_id,
+        'user_id': user_id
     },
     include={
-        'user': True,
-        'timestamps': plant.irrigation_type == 'time',
-        'periodstamps': plant.irrigation_type == 'period',
-    })
-    if plant_data is None:
-        return None
+        'timestamps': True,
+        'periodstamps': True,
+    }))
+    return plant_data
+
 
+def irrigation_stamps(plant) -> list:
+    '''
+    Stamps of the irrigation type of a plant fetched with its timestamps and periodstamps
+    '''
     if plant.irrigation_type == 'time':
-        return {
-            **plant_data.dict(),
-            'times': plant_data.timestamps
-        }
-    
-    return {
-        **plant_data.dict(),
-        'times': plant_data.periodstamps
-    }
+        return plant.timestamps
+    return plant.periodstamps
+
+
+async def get_plant_schedule(plant):
+    schedule = schedule_index.get(plant.id)
+    if schedule is not None and schedule.irrigation_type == plant.irrigation_type:
+        return schedule
+
+    version = schedule_index.version(plant.id)
+    if plant.irrigation_type == 'time':
+        stamps = await prisma.timestamp.find_many(where={
+            'plant_id': plant.id
+        })
+    else:
+        stamps = await prisma.periodstamp.find_many(where={
+            'plant_id': plant.id
+        })
+
+    return schedule_index.put(plant.id, version, plant.irrigation_type, stamps)
 
 
 async def get_plant_today_times(plant_id: str, chip_id: str):
     plant = await get_plant_by_chip_id(plant_id, chip_id)
-    if plant is None or plant.user is None:
+    if plant is None:
+        return None
+
+    schedule = await get_plant_schedule(plant)
+    return schedule.today(datetime.datetime.now())
+
+
+async def get_plant_today_next_time(plant_id: str, chip_id: str):
+    plant = await get_plant_by_chip_id(plant_id, chip_id)
+    if plant is None:
         return None
 
-    plant_data = await prisma.plant.find_first(where={
-        'id': plant.id,
-        'user_id': plant.user_id
+    schedule = await get_plant_schedule(plant)
+    return schedule.next_today(datetime.datetime.now())
+
+
+async def get_should_irrigate_now(plant_id: str, chip_id: str):
+    '''
+    Whether the irrigation scheduler found the plant due, None when the plant is unknown,
+    or is not due and has no irrigation left today
+    '''
+    now = datetime.datetime.now()
+    version = schedule_index.version(plant_id)
+    schedule = schedule_index.get(plant_id)
+    # Stamps are only loaded when the plant is not indexed yet, either way it's a single query
+    plant = await prisma.plant.find_first(where={
+        'id': plant_id,
+        'chip_id': chip_id
     },
     include={
-        'user': True,
-        'timestamps': filter_timestamps(plant.irrigation_type == 'time'),
-        'periodstamps': filter_periodstamps(plant.irrigation_type == 'period'),
+        'timestamps': schedule is None,
+        'periodstamps': schedule is None,
+        'irrigation_due': True
     })
-    if plant_data is None:
+    if plant is None:
         return None
-    
 
-    if plant.irrigation_type == 'time':
-        return plant_data.timestamps
+    if irrigation_scheduler.is_due(plant, now):
+        return True
 
-    return plant_data.periodstamps
+    if schedule is None:
+        stamps = plant.timestamps if plant.irrigation_type == 'time' else plant.periodstamps
+        schedule = schedule_index.put(plant.id, version, plant.irrigation_type, stamps or [])
+    elif schedule.irrigation_type != plant.irrigation_type:
+        schedule = await get_plant_schedule(plant)
 
+    if schedule.next_today(now) is None:
+        return None
+    return False
 
 
-async def get_plant_today_next_time(plant_id: str, chip_id: str):
-    times = await get_plant_today_times(plant_id, chip_id)
-    if times is None:
-        return None
-    
-    return times[0]
+class RenderedGraph(NamedTuple):
+    etag: str
+    # None when the client already has the graph with this etag
+    svg: bytes | None
 
 
-async def get_should_irrigate_now(plant_id: str, chip_id: str):
-    plant = await get_plant_by_chip_id(plant_id, chip_id)
+async def get_plant_irrigation_graph(user_id: str, plant_id: str, if_none_match: str | None = None):
+    return await read_router.read(user_id, _get_plant_irrigation_graph, user_id, plant_id, if_none_match)
+
+
+async def _get_plant_irrigation_graph(db, user_id: str, plant_id: str, if_none_match: str | None):
+    plant = await get_plant_by_id(user_id, plant_id, db)
     if plant is None:
         return None
-    time = await get_plant_today_next_time(plant_id, chip_id)
-    if time is None:
-        return None
-    
-    moisture = await prisma.moisturepercentagerecord.find_first(where={
-        'plant': {
-            'is': {
-                'id': plant_id,
-                'chip_id': chip_id
-            }
-        }
-    },
-    order={
-        'at': 'desc'
+
+    # Irrigations are only ever added, their count moves with every one, older ones included
+    irrigations = await db.irrigationrecord.count(where={
+        'plant_id': plant.id
     })
-    
-    now = datetime.datetime.now()
-    threshold = plant.moisture_percentage_treshold
-    if moisture is None:
-        return time.hour == now.hour and time.minute == now.minute
-    elif plant.auto_irrigation and moisture.percentage <= threshold:
-        return True
-    elif moisture.percentage <= threshold:
-        return time.hour == now.hour and time.minute == now.minute
+    if irrigations == 0:
+        return False
 
-    return False
+    key = (plant.id, 'irrigations', irrigations)
+    etag = make_etag(*key)
+    if etag_matches(if_none_match, etag):
+        return RenderedGraph(etag, None)
 
+    svg = rendered_graphs.get(key)
+    if svg is not None:
+        return RenderedGraph(etag, svg)
 
-async def get_plant_irrigation_graph(user_email: str, plant_id: str):
-    plant = await get_plant_by_id(user_email, plant_id)
-    if plant is None:
-        return None
-    
-    irrigation_records = await prisma.irrigationrecord.find_many(where={
+    irrigation_records = await db.irrigationrecord.find_many(where={
         'plant_id': plant.id
     })
 
@@ -275,33 +306,99 @@ async def get_plant_irrigation_graph(user_email: str, plant_id: str):
         irrigation_records
     ))
 
-    graph = pygal.Bar(
-        title="Irrigations",
-        width = 1000,
-        height = 600,
-        show_legend=False,
-        explicit_size = True,
-        style = charts_style,
+    svg = await chart_renderer.render_bar_chart(
+        'Irrigations',
+        list(map(lambda r: r['x'], records)),
+        list(map(lambda r: r['y'], records))
     )
-    graph.x_labels = list(map(lambda r: r['x'], records))
-    graph.y_labels = list(range(0, 101, 5))
-    graph.add(f'Irrigations', list(map(lambda r: r['y'], records)))
-    graph.x_labels_major_count = 10
-    graph.show_minor_x_labels = False
+    if svg is None:
+        return 'render timeout'
+
+    rendered_graphs.set(key, svg)
+    return RenderedGraph(etag, svg)
+
+
+MOISTURE_BUCKETS_QUERY = '''
+WITH bounds AS (
+    SELECT min(at) AS first_at, max(at) AS last_at
+    FROM "MoisturePercentageRecord"
+    WHERE plant_id = $1 AND at >= $2::timestamp
+), width AS (
+    SELECT first_at, greatest(extract(epoch FROM last_at - first_at) / $3, 1) AS seconds
+    FROM bounds
+)
+SELECT
+    first_at + make_interval(secs => floor(extract(epoch FROM r.at - first_at) / seconds) * seconds) AS bucket,
+    avg(r.percentage)::float AS avg,
+    min(r.percentage) AS min,
+    max(r.percentage) AS max
+FROM "MoisturePercentageRecord" r, width
+WHERE r.plant_id = $1 AND r.at >= $2::timestamp
+GROUP BY bucket
+ORDER BY bucket
+'''
+
+
+# Longer periods are aggregated from the hourly or daily rollups instead of the raw records
+GRAPH_PERIOD_ROLLUPS = {
+    GraphPeriod.past_15_days: 'hour',
+    GraphPeriod.past_month: 'hour',
+    GraphPeriod.past_6_months: 'day',
+    GraphPeriod.past_year: 'day',
+    GraphPeriod.all_time: 'day',
+}
+
+
+async def get_moisture_percentage_buckets(plant_id: str, graph_period: GraphPeriod, db=prisma):
+    start = graph_period_start(graph_period, datetime.datetime.now(datetime.timezone.utc))
+    rollup_unit = GRAPH_PERIOD_ROLLUPS.get(graph_period)
+    if rollup_unit is None:
+        query = MOISTURE_BUCKETS_QUERY
+    else:
+        query = ROLLUP_BUCKETS_QUERY.format(table=ROLLUP_TABLES[rollup_unit], unit=rollup_unit)
+
+    buckets = await db.query_raw(
+        query,
+        plant_id,
+        start.isoformat(),
+        settings.graph_max_buckets
+    )
+
+    return [
+        {
+            **b,
+            'bucket': datetime.datetime.fromisoformat(b['bucket']) if isinstance(b['bucket'], str) else b['bucket']
+        }
+        for b in buckets
+    ]
+
 
-    return graph.render()
+async def get_moisture_percentage_graph(user_id: str, plant_id: str, graph_period: GraphPeriod, if_none_match: str | None = None):
+    return await read_router.read(user_id, _get_moisture_percentage_graph, user_id, plant_id, graph_period, if_none_match)
 
 
-async def get_moisture_percentage_graph(user_email: str, plant_id: str, graph_period: GraphPeriod):
-    plant = await get_plant_by_id(user_email, plant_id)
+async def _get_moisture_percentage_graph(db, user_id: str, plant_id: str, graph_period: GraphPeriod, if_none_match: str | None):
+    plant = await get_plant_by_id(user_id, plant_id, db)
     if plant is None:
         return None
-    
-    moisture_record = await prisma.moisturepercentagerecord.find_many(where={
-        'plant_id': plant.id
-    })
 
-    if len(moisture_record) == 0:
+    # Windowed periods also change when their start moves by a bucket, without new data
+    now = datetime.datetime.now(datetime.timezone.utc)
+    window = GRAPH_PERIOD_WINDOWS[graph_period]
+    window_step = int(now.timestamp() // max(window.total_seconds() / settings.graph_max_buckets, 1)) if window else 0
+
+    # The moisture version moves with every stored reading, backfilled ones included
+    key = (plant.id, 'moisture_percentage', graph_period.value, window_step, plant.moisture_version)
+    etag = make_etag(*key)
+    if etag_matches(if_none_match, etag):
+        return RenderedGraph(etag, None)
+
+    svg = rendered_graphs.get(key)
+    if svg is not None:
+        return RenderedGraph(etag, svg)
+
+    buckets = await get_moisture_percentage_buckets(plant.id, graph_period, db)
+    if len(buckets) == 0:
         return False
 
     time_format = '%Y-%m-%d %H:%M:%S'
@@ -309,41 +406,118 @@ async def get_moisture_percentage_graph(user_email: str, plant_id: str, graph_pe
         time_format = '%H:%M:%S'
 
     records = list(map(
-        lambda r: {
-            'x': r.at.strftime(time_format),
-            'y': r.percentage
+        lambda b: {
+            'x': b['bucket'].strftime(time_format),
+            'y': {
+                'value': round(b['avg'], 1),
+                'label': f"min {b['min']}% / max {b['max']}%"
+            }
         },
-        moisture_record
+        buckets
     ))
 
-    graph = pygal.Bar(
-        title="Moisture Percentage",
-        width = 1000,
-        height = 600,
-        show_legend=False,
-        explicit_size = True,
-        style = charts_style,
+    svg = await chart_renderer.render_bar_chart(
+        'Moisture Percentage',
+        list(map(lambda r: r['x'], records)),
+        list(map(lambda r: r['y'], records))
     )
-    graph.x_labels = list(map(lambda r: r['x'], records))
-    graph.y_labels = list(range(0, 101, 5))
-    graph.add(f'Moisture Percentage', list(map(lambda r: r['y'], records)))
-    graph.x_labels_major_count = 10
-    graph.show_minor_x_labels = False
+    if svg is None:
+        return 'render timeout'
+
+    rendered_graphs.set(key, svg)
+    return RenderedGraph(etag, svg)
+
+
+EXPORT_FIELDS = {
+    ExportRecords.moisture_percentage: ('id', 'at', 'percentage'),
+    ExportRecords.irrigations: ('id', 'at', 'water_amount'),
+}
+
+
+async def iterate_plant_records(plant_id: str, records: ExportRecords, start: datetime.datetime | None, end: datetime.datetime | None, db=prisma):
+    '''
+    Yields pages of records ordered by (at, id), paginated on the last (at, id) seen
+    '''
+    actions = db.moisturepercentagerecord if records == ExportRecords.moisture_percentage else db.irrigationrecord
+
+    at_filter = {}
+    if start is not None:
+        at_filter['gte'] = start
+    if end is not None:
+        at_filter['lt'] = end
+    where = {'plant_id': plant_id, 'at': at_filter} if at_filter else {'plant_id': plant_id}
+
+    last = None
+    while True:
+        page = await actions.find_many(where=where if last is None else {
+            'AND': [
+                where,
+                {
+                    'OR': [
+                        {'at': {'gt': last.at}},
+                        {'at': last.at, 'id': {'gt': last.id}}
+                    ]
+                }
+            ]
+        },
+        order=[
+            {'at': 'asc'},
+            {'id': 'asc'}
+        ],
+        take=settings.export_page_size)
+
+        if page:
+            yield page
+        if len(page) < settings.export_page_size:
+            return
+        last = page[-1]
+
+
+async def get_plant_records_export(user_id: str, plant_id: str, records: ExportRecords, start: datetime.datetime | None = None, end: datetime.datetime | None = None):
+    # Pages are streamed, the client is chosen once for the whole export
+    db = read_router.client(user_id)
+    plant = await get_plant_by_id(user_id, plant_id, db)
+    if plant is None:
+        return None
 
-    return graph.render()
+    return iterate_plant_records(plant.id, records, start, end, db)
 
 
-async def get_current_moisture(user_email: str, plant_id: str):
-    plant = await get_plant_by_id(user_email, plant_id)
+async def get_current_moisture(user_id: str, plant_id: str):
+    return await read_router.read(user_id, _get_current_moisture, user_id, plant_id)
+
+
+async def _get_current_moisture(db, user_id: str, plant_id: str):
+    plant = await get_plant_by_id(user_id, plant_id, db)
     if plant is None:
         return False
 
-    return await prisma.moisturepercentagerecord.find_first(where={
+    record = await db.moisturepercentagerecord.find_first(where={
         'plant_id': plant.id
     },
     order={
         'at': 'desc'
     })
+    return _with_last_moisture(plant, record)
+
+
+def _with_last_moisture(plant, record):
+    '''
+    The latest stored record, or the newer reading kept on the plant when the storage policy
+    filtered it, under the id of the stored record standing for it
+    '''
+    if record is None or plant.last_moisture_at is None or record.at >= plant.last_moisture_at:
+        return record
+
+    return MoisturePercentageRecord(id=record.id, plant_id=plant.id, percentage=plant.last_moisture_percentage, at=plant.last_moisture_at)
+
+
+async def _store_readings(readings: list[dict]) -> int:
+    if moisture_buffer.enabled:
+        await moisture_buffer.add(readings)
+        return sum(r['stored'] for r in readings)
+
+    return await store_readings(readings)
 
 
 async def register_current_moisture(percentage: int, plant: schemas.PlantESPGet):
@@ -351,20 +525,120 @@ async def register_current_moisture(percentage: int, plant: schemas.PlantESPGet)
     if _plant is None:
         return None
 
-    return await prisma.moisturepercentagerecord.create(data={
-        'plant_id': _plant.id,
-        'percentage': percentage
-    })
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stored = latest_moisture.should_store(_plant, percentage, now)
+    reading = moisture_buffer.reading(_plant.id, percentage, now, stored)
+    # A filtered reading stands for the stored one it was compared to,
+    # taken before the state can be popped or evicted while storing
+    record_id = reading['id'] if stored else latest_moisture.get(_plant.id).id
+    await _store_readings([reading])
 
+    latest_moisture.record(_plant.id, percentage, now, reading['id'] if stored else None)
+    return MoisturePercentageRecord(id=record_id, plant_id=_plant.id, percentage=percentage, at=now)
 
-async def get_plants(user_email: str):
-    user = await auth.crud.get_user_by_email(user_email)
-    if user is None:
+
+async def register_moisture_readings(readings: schemas.PlantMoistureReadings):
+    _plant = await get_plant_by_chip_id(readings.plant_id, readings.chip_id)
+    if _plant is None:
         return None
 
-    return await prisma.plant.find_many(where={
-        'user_id': user.id,
-    })
+    now = datetime.datetime.now(datetime.timezone.utc)
+    records = []
+    for r in readings.readings:
+        at = r.at or now
+        stored = latest_moisture.should_store(_plant, r.percentage, at)
+        record = moisture_buffer.reading(_plant.id, r.percentage, at, stored)
+        latest_moisture.record(_plant.id, r.percentage, at, record['id'] if stored else None)
+        records.append(record)
+
+    if not records:
+        return 0
+
+    try:
+        return await _store_readings(records)
+    except Exception:
+        # The readings were kept as stored, the next reading has to be stored again
+        latest_moisture.pop(_plant.id)
+        raise
+
+
+async def get_plants(user_id: str):
+    return await read_router.read(user_id, lambda db: db.plant.find_many(where={
+        'user_id': user_id,
+    }))
+
+
+# Every plant of a user with its latest moisture reading, last irrigation and the stamps of its irrigation type
+PLANTS_OVERVIEW_QUERY = '''
+SELECT
+    p.id, p.chip_id, p.name, p.water_amount, p.created_at, p.updated_at, p.auto_irrigation,
+    p.irrigation_type, p.moisture_percentage_treshold, p.periodstamp_times_a_week,
+    p.moisture_deadband, p.moisture_heartbeat_seconds, p.last_moisture_percentage, p.last_moisture_at,
+    i.water_amount AS irrigation_water_amount, i.at AS irrigation_at,
+    s.stamps
+FROM "Plant" p
+LEFT JOIN LATERAL (
+    SELECT water_amount, at
+    FROM "IrrigationRecord"
+    WHERE plant_id = p.id
+    ORDER BY at DESC
+    LIMIT 1
+) i ON true
+LEFT JOIN LATERAL (
+    SELECT coalesce(json_agg(json_build_object('id', t.id, 'day_of_week', t.day_of_week, 'hour', t.hour, 'minute', t.minute)), '[]') AS stamps
+    FROM (
+        SELECT id, day_of_week, hour, minute FROM "Timestamp" WHERE plant_id = p.id AND p.irrigation_type = 'time'
+        UNION ALL
+        SELECT id, day_of_week, hour, minute FROM "Periodstamp" WHERE plant_id = p.id AND p.irrigation_type = 'period'
+    ) t
+) s ON true
+WHERE p.user_id = $1
+ORDER BY p.created_at
+'''
+
+
+OVERVIEW_PLANT_FIELDS = (
+    'id', 'chip_id', 'name', 'water_amount', 'auto_irrigation',
+    'irrigation_type', 'moisture_percentage_treshold', 'periodstamp_times_a_week',
+    'moisture_deadband', 'moisture_heartbeat_seconds'
+)
+
+
+def _as_datetime(value):
+    return as_utc(value) if value is not None else None
+
+
+async def get_plants_overview(user_id: str):
+    rows = await read_router.read(user_id, lambda db: db.query_raw(PLANTS_OVERVIEW_QUERY, user_id))
+
+    now = datetime.datetime.now()
+    overview = []
+    for row in rows:
+        # Indexed schedules are kept up to date, otherwise the stamps of the query are used without indexing them
+        schedule = schedule_index.get(row['id'])
+        if schedule is None or schedule.irrigation_type != row['irrigation_type']:
+            stamps = json.loads(row['stamps']) if isinstance(row['stamps'], str) else row['stamps']
+            schedule = PlantSchedule(row['irrigation_type'], [
+                ScheduledStamp(s['id'], DayOfWeek(s['day_of_week']), s['hour'], s['minute'])
+                for s in stamps
+            ])
+
+        overview.append({
+            **{field: row[field] for field in OVERVIEW_PLANT_FIELDS},
+            'created_at': _as_datetime(row['created_at']),
+            'updated_at': _as_datetime(row['updated_at']),
+            'current_moisture': {
+                'percentage': row['last_moisture_percentage'],
+                'at': _as_datetime(row['last_moisture_at'])
+            } if row['last_moisture_at'] is not None else None,
+            'last_irrigation': {
+                'water_amount': row['irrigation_water_amount'],
+                'at': _as_datetime(row['irrigation_at'])
+            } if row['irrigation_at'] is not None else None,
+            'next_irrigation_time': schedule.next_today(now)
+        })
+
+    return overview
 
 
 async def create_plant(plant: schemas.PlantCreate):
@@ -379,21 +653,16 @@ async def create_plant(plant: schemas.PlantCreate):
         })
     except PrismaUniqueViolationError:
         return "chipid exists"
+    read_router.pin(user.id)
 
     return created_plant
 
 
-async def update_plant(user_email: str, plant_id: str, plant: schemas.PlantUpdate):
-    _plant = await get_plant_by_id(user_email, plant_id)
+async def update_plant(user_id: str, plant_id: str, plant: schemas.PlantUpdate):
+    _plant = await get_plant_by_id(user_id, plant_id)
     if _plant is None:
         return None
     
-    user = await get_user_by_email(user_email)
-    user_id = _plant.user_id
-
-    if user is None or user_id != user.id:
-        return
-    
     # Update periodstamp
     if plant.periodstamp_times_a_week != _plant.periodstamp_times_a_week:
         await prisma.periodstamp.delete_many(where={
@@ -418,13 +687,15 @@ async def update_plant(user_email: str, plant_id: str, plant: schemas.PlantUpdat
             ])
         
     
-    return await prisma.plant.update(data={
+    updated_plant = await prisma.plant.update(data={
         'name': plant.name,
         'water_amount': plant.water_amount,
         'auto_irrigation': plant.auto_irrigation,
         'irrigation_type': plant.irrigation_type,
         'moisture_percentage_treshold': plant.moisture_percentage_treshold,
         'periodstamp_times_a_week': plant.periodstamp_times_a_week,
+        'moisture_deadband': plant.moisture_deadband,
+        'moisture_heartbeat_seconds': plant.moisture_heartbeat_seconds,
         'user': {
             'connect': {
                 'id': user_id
@@ -437,15 +708,24 @@ async def update_plant(user_email: str, plant_id: str, plant: schemas.PlantUpdat
     include={
         'user': True
     })
+    schedule_index.invalidate(_plant.id)
+    forget_device(_plant.id, _plant.chip_id)
+    read_router.pin(user_id)
+
+    return updated_plant
 
-async def delete_plant(user_email: str, plant_id: str):
-    db_plant = await get_plant_by_id(user_email, plant_id)
+async def delete_plant(user_id: str, plant_id: str):
+    db_plant = await get_plant_by_id(user_id, plant_id)
     if db_plant is None:
         return False
     
     deleted_plant = await prisma.plant.delete(where={
         'id': db_plant.id
     })
+    schedule_index.invalidate(db_plant.id)
+    forget_device(db_plant.id, db_plant.chip_id)
+    latest_moisture.pop(db_plant.id)
+    read_router.pin(user_id)
 
     return deleted_plant is not None
 
@@ -459,5 +739,6 @@ async def irrigate_plant(irrigation: schemas.PlantIrrigation):
         'plant_id': plant.id,
         'water_amount': plant.water_amount
     })
+    await irrigation_scheduler.consume(plant.id)
 
     return plant_irrigation is not None
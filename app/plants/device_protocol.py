@@ -0,0 +1,150 @@
+'''
+Compact binary variant of the ESP endpoints, negotiated with the content type.
+
+All integers are little endian. Requests sent with the device media type are:
+    identity: plant_id length (uint8), plant_id (ascii), chip_id (16 ascii hex digits)
+    readings: identity, count (uint16), count * (seconds before sending (uint32), percentage (uint8))
+Responses are binary when the request was, or when the Accept header asks for it:
+    plant:               water_amount (uint16), auto_irrigation, irrigation_type, treshold, times a week (uint8)
+    should irrigate:     irrigate (uint8)
+    times:               count (uint16), count * minute of the week (uint16)
+    next time:           minute of the week (uint16), NO_TIME when there is none
+    registered readings: count (uint16)
+'''
+import json
+import struct
+import datetime
+from typing import Callable
+from fastapi import Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from pydantic.error_wrappers import ErrorWrapper
+from .schedule import weektime_to_minutes
+
+
+DEVICE_MEDIA_TYPE = 'application/vnd.plantpal.device'
+
+CHIP_ID_LENGTH = 16
+NO_TIME = 0xFFFF
+IRRIGATION_TYPES = ('time', 'period')
+
+_LENGTH = struct.Struct('<B')
+_COUNT = struct.Struct('<H')
+_READING = struct.Struct('<IB')
+_PLANT = struct.Struct('<HBBBB')
+_BOOL = struct.Struct('<B')
+
+
+def is_device_media_type(content_type: str | None) -> bool:
+    return content_type is not None and content_type.split(';')[0].strip() == DEVICE_MEDIA_TYPE
+
+
+def unpack_request(body: bytes, now: datetime.datetime) -> dict:
+    '''
+    Decodes a binary device request to the equivalent JSON body
+    '''
+    try:
+        (length,) = _LENGTH.unpack_from(body)
+        offset = _LENGTH.size
+        plant_id = body[offset:offset + length].decode('ascii')
+        offset += length
+        chip_id = body[offset:offset + CHIP_ID_LENGTH].decode('ascii')
+        offset += CHIP_ID_LENGTH
+        if len(plant_id) != length or len(chip_id) != CHIP_ID_LENGTH:
+            raise ValueError('Device request is too short')
+
+        payload = {'plant_id': plant_id, 'chip_id': chip_id}
+        if offset == len(body):
+            return payload
+
+        (count,) = _COUNT.unpack_from(body, offset)
+        offset += _COUNT.size
+        if len(body) != offset + count * _READING.size:
+            raise ValueError('Length of the readings does not match their count')
+        payload['readings'] = [
+            {'at': (now - datetime.timedelta(seconds=seconds)).isoformat(), 'percentage': percentage}
+            for seconds, percentage in _READING.iter_unpack(body[offset:])
+        ]
+        return payload
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError('Malformed device request') from e
+
+
+def pack_request(plant_id: str, chip_id: str, readings: list[tuple[int, int]] | None = None) -> bytes:
+    '''
+    Encodes a device request, readings are (seconds before sending, percentage) pairs
+    '''
+    plant_id = plant_id.encode('ascii')
+    body = _LENGTH.pack(len(plant_id)) + plant_id + chip_id.encode('ascii')
+    if readings is None:
+        return body
+    return body + _COUNT.pack(len(readings)) + b''.join(_READING.pack(*r) for r in readings)
+
+
+def pack_plant(plant) -> bytes:
+    return _PLANT.pack(
+        plant.water_amount,
+        plant.auto_irrigation,
+        IRRIGATION_TYPES.index(plant.irrigation_type),
+        plant.moisture_percentage_treshold,
+        # Plants saved before times a week was limited to a byte
+        min(plant.periodstamp_times_a_week, 255)
+    )
+
+
+def pack_bool(value: bool) -> bytes:
+    return _BOOL.pack(value)
+
+
+def pack_count(count: int) -> bytes:
+    return _COUNT.pack(count)
+
+
+def _stamp_minutes(stamp, now: datetime.datetime) -> int:
+    # Stamps for everyday have no weekday of their own, they are all stamps of today
+    return weektime_to_minutes(now.weekday(), stamp.hour, stamp.minute)
+
+
+def pack_times(stamps: list, now: datetime.datetime) -> bytes:
+    return struct.pack(f'<H{len(stamps)}H', len(stamps), *(_stamp_minutes(s, now) for s in stamps))
+
+
+def pack_next_time(stamp, now: datetime.datetime) -> bytes:
+    return _COUNT.pack(NO_TIME if stamp is None else _stamp_minutes(stamp, now))
+
+
+def wants_binary(request: Request) -> bool:
+    return getattr(request.state, 'device_binary', False) or DEVICE_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def device_response(content: bytes = b'', status_code: int = 200) -> Response:
+    return Response(content, status_code=status_code, media_type=DEVICE_MEDIA_TYPE)
+
+
+class DeviceRequest(Request):
+    '''
+    Binary device request, seen by the endpoints as the equivalent JSON request
+    '''
+
+    def __init__(self, request: Request, payload: dict):
+        headers = [(k, v) for k, v in request.scope['headers'] if k != b'content-type']
+        headers.append((b'content-type', b'application/json'))
+        super().__init__({**request.scope, 'headers': headers}, request.receive)
+        self._body = json.dumps(payload).encode()
+        self.state.device_binary = True
+
+
+class DeviceRoute(APIRoute):
+    def get_route_handler(self) -> Callable:
+        route_handler = super().get_route_handler()
+
+        async def device_route_handler(request: Request) -> Response:
+            if is_device_media_type(request.headers.get('content-type')):
+                try:
+                    payload = unpack_request(await request.body(), datetime.datetime.now(datetime.timezone.utc))
+                except ValueError as e:
+                    raise RequestValidationError([ErrorWrapper(e, ('body',))])
+                request = DeviceRequest(request, payload)
+            return await route_handler(request)
+
+        return device_route_handler
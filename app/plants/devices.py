@@ -0,0 +1,56 @@
+from typing import NamedTuple
+from fastapi import WebSocket
+
+
+class DeviceConnection(NamedTuple):
+    chip_id: str
+    websocket: WebSocket
+
+
+class DeviceHub:
+    '''
+    Open WebSocket connections of the ESP devices, one per plant
+    '''
+
+    def __init__(self):
+        self._connections: dict[str, DeviceConnection] = {}
+
+    def __len__(self):
+        return len(self._connections)
+
+    def __contains__(self, plant_id: str):
+        return plant_id in self._connections
+
+    def get(self, plant_id: str) -> DeviceConnection | None:
+        return self._connections.get(plant_id)
+
+    def items(self) -> list[tuple[str, DeviceConnection]]:
+        return list(self._connections.items())
+
+    def connect(self, plant_id: str, chip_id: str, websocket: WebSocket) -> DeviceConnection | None:
+        '''
+        Returns the previous connection of the plant, if there was one
+        '''
+        previous = self._connections.get(plant_id)
+        self._connections[plant_id] = DeviceConnection(chip_id, websocket)
+        return previous
+
+    def disconnect(self, plant_id: str, websocket: WebSocket):
+        connection = self._connections.get(plant_id)
+        if connection is not None and connection.websocket is websocket:
+            del self._connections[plant_id]
+
+    async def send(self, plant_id: str, message: dict) -> bool:
+        connection = self._connections.get(plant_id)
+        if connection is None:
+            return False
+
+        try:
+            await connection.websocket.send_json(message)
+        except Exception:
+            self.disconnect(plant_id, connection.websocket)
+            return False
+        return True
+
+
+device_hub = DeviceHub()
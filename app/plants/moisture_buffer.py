@@ -0,0 +1,239 @@
+'''
+Write-behind buffer of moisture readings.
+
+A reading is acknowledged once it is appended to the buffer and to the log segment on disk,
+a background task stores the buffered readings in one statement once `flush_size` of them are
+buffered or every `flush_seconds`. Every flush closes the current segment, whose file is
+removed once its readings are stored. Segments left behind by a stopped or crashed worker are
+replayed on startup. Reading ids are generated here, so storing a segment a second time skips
+the readings that were already stored. Readings of plants deleted in the meantime are dropped.
+Readings filtered by the storage policy are buffered too, they only update the plant's latest reading.
+'''
+import os
+import glob
+import time
+import uuid
+import asyncio
+import datetime
+import orjson
+import app.config as config
+from .rollups import store_readings
+try:
+    import fcntl
+except ImportError:
+    # Without file locks the segments of running workers can not be told apart, run a single worker
+    fcntl = None
+
+
+settings = config.Settings()
+
+
+def read_segment(file) -> list[dict]:
+    readings = []
+    for line in file:
+        try:
+            reading = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # Torn last line of a worker that crashed while appending
+            continue
+        reading['at'] = datetime.datetime.fromisoformat(reading['at'])
+        readings.append(reading)
+    return readings
+
+
+class Segment:
+    '''
+    Log file of the readings of one flush, locked for as long as its readings are not stored
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.readings: list[dict] = []
+        self._file = open(path, 'ab')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+
+    def append(self, readings: list[dict], fsync: bool):
+        self._file.write(b''.join(orjson.dumps(r) + b'\n' for r in readings))
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        self.readings.extend(readings)
+
+    def remove(self):
+        self._file.close()
+        os.remove(self.path)
+
+
+class MoistureBuffer:
+    def __init__(self, enabled: bool, log_dir: str, flush_size: int, flush_seconds: float, max_size: int, fsync: bool):
+        self.enabled = enabled
+        self.log_dir = log_dir
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.max_size = max_size
+        self.fsync = fsync
+        self.stored = 0
+        self.failed_flushes = 0
+        self._pending = 0
+        self._segment: Segment | None = None
+        # Closed segments, oldest first, kept until their readings are stored
+        self._closed: list[Segment] = []
+        self._sequence = 0
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return self._pending
+
+    @staticmethod
+    def reading(plant_id: str, percentage: int, at: datetime.datetime | None = None, stored: bool = True) -> dict:
+        return {
+            'id': uuid.uuid4().hex,
+            'plant_id': plant_id,
+            'percentage': percentage,
+            'at': at or datetime.datetime.now(datetime.timezone.utc),
+            'stored': stored
+        }
+
+    def _open_segment(self) -> Segment:
+        self._sequence += 1
+        return Segment(os.path.join(self.log_dir, f'{os.getpid()}-{time.time_ns()}-{self._sequence}.log'))
+
+    def _own_paths(self) -> set[str]:
+        segments = self._closed + ([self._segment] if self._segment is not None else [])
+        return {s.path for s in segments}
+
+    async def add(self, readings: list[dict]):
+        '''
+        Buffers readings made with `reading`, waits for a flush while the buffer is full
+        '''
+        if self._pending >= self.max_size:
+            await self.flush()
+
+        if self._segment is None:
+            self._segment = self._open_segment()
+        self._segment.append(readings, self.fsync)
+        self._pending += len(readings)
+
+        if len(self._segment.readings) >= self.flush_size:
+            self._full.set()
+
+    async def flush(self):
+        async with self._lock:
+            if self._segment is not None:
+                self._closed.append(self._segment)
+                self._segment = None
+
+            # A segment failing to store does not hold back the others, it is retried on the next flush
+            error = None
+            for segment in list(self._closed):
+                try:
+                    if segment.readings:
+                        self.stored += await store_readings(segment.readings)
+                except Exception as e:
+                    error = error or e
+                    continue
+                self._closed.remove(segment)
+                self._pending -= len(segment.readings)
+                segment.remove()
+
+            if error is not None:
+                raise error
+
+    async def replay(self) -> int:
+        '''
+        Stores the readings of the segments no running worker holds,
+        segments failing to store are taken over and retried by the flushes
+        '''
+        replayed = 0
+        own = self._own_paths()
+        for path in sorted(glob.glob(os.path.join(self.log_dir, '*.log'))):
+            if path in own:
+                continue
+            try:
+                file = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+
+            with file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                readings = read_segment(file)
+                try:
+                    if readings:
+                        self.stored += await store_readings(readings)
+                    stored = True
+                except Exception as e:
+                    print(f"Replaying {len(readings)} moisture readings of {path} failed, retrying with the next flush: {e!r}")
+                    stored = False
+
+            if not stored:
+                segment = Segment(path)
+                segment.readings = readings
+                self._closed.append(segment)
+                self._pending += len(readings)
+                continue
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            replayed += len(readings)
+        return replayed
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"Flushing {self._pending} moisture readings failed: {e!r}")
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        replayed = await self.replay()
+        if replayed:
+            print(f"Replayed {replayed} moisture readings")
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Flushing {self._pending} moisture readings failed, they are replayed on the next start: {e!r}")
+
+    def stats(self) -> dict:
+        return {
+            'pending': self._pending,
+            'stored': self.stored,
+            'failed_flushes': self.failed_flushes
+        }
+
+
+moisture_buffer = MoistureBuffer(
+    settings.moisture_write_behind,
+    settings.moisture_log_dir,
+    settings.moisture_flush_size,
+    settings.moisture_flush_seconds,
+    settings.moisture_buffer_size,
+    settings.moisture_log_fsync
+)
@@ -0,0 +1,78 @@
+'''
+Per plant storage policy of moisture readings.
+
+A reading is stored when it differs more than the plant's moisture_deadband from the last
+stored reading, or when moisture_heartbeat_seconds passed since that one was stored.
+A deadband of 0 stores every reading. Readings older than the last stored one are backfilled
+and always stored. The latest reading of a plant is kept on the plant whether it was stored or not.
+'''
+import datetime
+from typing import NamedTuple
+from app.utils.lru_cache import LRUCache
+import app.config as config
+
+
+settings = config.Settings()
+
+
+class MoistureState(NamedTuple):
+    # Last stored reading, which stands for the readings within its deadband
+    id: str
+    percentage: int
+    at: datetime.datetime
+
+
+def as_utc(at: datetime.datetime | str) -> datetime.datetime:
+    # Naive datetimes are UTC, like the database stores them
+    if isinstance(at, str):
+        at = datetime.datetime.fromisoformat(at)
+    if at.tzinfo is None:
+        return at.replace(tzinfo=datetime.timezone.utc)
+    return at
+
+
+class LatestMoisture:
+    def __init__(self, size: int):
+        self.stored = 0
+        self.filtered = 0
+        self._states = LRUCache(size)
+
+    def get(self, plant_id: str) -> MoistureState | None:
+        return self._states.get(plant_id)
+
+    def pop(self, plant_id: str):
+        self._states.pop(plant_id)
+
+    def should_store(self, plant, percentage: int, at: datetime.datetime) -> bool:
+        if plant.moisture_deadband <= 0:
+            return True
+
+        state = self._states.get(plant.id)
+        at = as_utc(at)
+        if state is None or at < state.at:
+            return True
+
+        return (
+            abs(percentage - state.percentage) > plant.moisture_deadband
+            or (at - state.at).total_seconds() >= plant.moisture_heartbeat_seconds
+        )
+
+    def record(self, plant_id: str, percentage: int, at: datetime.datetime, stored_id: str | None = None):
+        '''
+        Counts a reading, stored_id is the id it was stored with, None when it was filtered
+        '''
+        if stored_id is None:
+            self.filtered += 1
+            return
+
+        self.stored += 1
+        at = as_utc(at)
+        state = self._states.get(plant_id)
+        if state is None or at >= state.at:
+            self._states.set(plant_id, MoistureState(stored_id, percentage, at))
+
+    def stats(self) -> dict:
+        return self._states.stats()
+
+
+latest_moisture = LatestMoisture(settings.latest_moisture_size)
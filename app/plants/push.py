@@ -0,0 +1,95 @@
+import asyncio
+import dataclasses
+import datetime
+from . import crud
+from .devices import device_hub
+from .schedule import schedule_index
+from .scheduler import irrigation_scheduler
+
+
+# Amount of connected devices evaluated concurrently each minute
+PUSH_CHUNK_SIZE = 100
+
+_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(coroutine):
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def push_schedule(plant_id: str):
+    connection = device_hub.get(plant_id)
+    if connection is None:
+        return False
+
+    version = schedule_index.version(plant_id)
+    times = await crud.get_plant_today_times(plant_id, connection.chip_id)
+    # Invalidated while the stamps were loaded, the push of that invalidation sends the new ones
+    if times is None or schedule_index.version(plant_id) != version:
+        return False
+
+    return await device_hub.send(plant_id, {
+        'type': 'schedule',
+        'times': [dataclasses.asdict(t) for t in times]
+    })
+
+
+async def push_irrigation(plant_id: str):
+    connection = device_hub.get(plant_id)
+    if connection is None:
+        return False
+
+    plant = await crud.get_plant_by_chip_id(plant_id, connection.chip_id)
+    return await device_hub.send(plant_id, {
+        'type': 'irrigate',
+        'water_amount': plant.water_amount if plant is not None else None
+    })
+
+
+def _on_schedule_invalidated(plant_id: str):
+    if plant_id in device_hub:
+        _spawn(push_schedule(plant_id))
+
+
+def _on_irrigation_due(plant_id: str):
+    if plant_id in device_hub:
+        _spawn(push_irrigation(plant_id))
+
+
+schedule_index.on_invalidate(_on_schedule_invalidated)
+irrigation_scheduler.on_due(_on_irrigation_due)
+
+
+async def _push_all(push):
+    plant_ids = [plant_id for plant_id, _ in device_hub.items()]
+    for i in range(0, len(plant_ids), PUSH_CHUNK_SIZE):
+        await asyncio.gather(
+            *(push(plant_id) for plant_id in plant_ids[i:i + PUSH_CHUNK_SIZE]),
+            return_exceptions=True
+        )
+
+
+async def run():
+    '''
+    Pushes the new schedule to the connected devices when the day changed,
+    due irrigations are pushed as soon as the irrigation scheduler marks them
+    '''
+    while True:
+        now = datetime.datetime.now()
+        await asyncio.sleep(60 - now.second - now.microsecond / 1_000_000)
+
+        now = datetime.datetime.now()
+        if now.hour == 0 and now.minute == 0:
+            await _push_all(push_schedule)
+
+
+def start():
+    return _spawn(run())
+
+
+def stop():
+    for task in list(_tasks):
+        task.cancel()
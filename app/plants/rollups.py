@@ -0,0 +1,169 @@
+'''
+Hourly and daily rollups of the moisture percentage records.
+
+Backfill or rebuild the rollups from the raw records with:
+    python -m app.plants.rollups [plant_id]
+'''
+import sys
+import json
+import asyncio
+import datetime
+from app.prisma import prisma
+
+
+ROLLUP_TABLES = {
+    'hour': 'MoistureHourlyRollup',
+    'day': 'MoistureDailyRollup',
+}
+
+_ROLLUP_UPSERT = '''
+INSERT INTO "{table}" (plant_id, bucket, count, min, max, sum)
+SELECT plant_id, date_trunc('{unit}', at), count(*), min(percentage), max(percentage), sum(percentage)
+FROM inserted
+GROUP BY 1, 2
+ON CONFLICT (plant_id, bucket) DO UPDATE SET
+    count = "{table}".count + excluded.count,
+    min = least("{table}".min, excluded.min),
+    max = greatest("{table}".max, excluded.max),
+    sum = "{table}".sum + excluded.sum
+'''
+
+# Readings, both rollups and the latest reading of every plant are written by one statement,
+# readings stored before are skipped by their id and readings of deleted plants are dropped.
+# Readings filtered by the storage policy only update the latest reading. The moisture version
+# of a plant moves with every reading stored, older ones included. The plants are locked first,
+# so their rollups are not rebuilt while the readings are added to them
+STORE_READINGS_QUERY = f'''
+WITH readings AS (
+    SELECT * FROM jsonb_to_recordset($1::jsonb) AS r(id text, plant_id text, at timestamp, percentage int, stored boolean)
+), plants AS (
+    SELECT id FROM "Plant"
+    WHERE id IN (SELECT plant_id FROM readings)
+    ORDER BY id
+    FOR KEY SHARE
+), inserted AS (
+    INSERT INTO "MoisturePercentageRecord" (id, plant_id, at, percentage)
+    SELECT id, plant_id, at, percentage FROM readings
+    WHERE stored AND plant_id IN (SELECT id FROM plants)
+    ON CONFLICT (id) DO NOTHING
+    RETURNING plant_id, at, percentage
+), latest AS (
+    UPDATE "Plant" p SET
+        last_moisture_percentage = CASE WHEN p.last_moisture_at IS NULL OR p.last_moisture_at <= l.at THEN l.percentage ELSE p.last_moisture_percentage END,
+        last_moisture_at = greatest(p.last_moisture_at, l.at),
+        moisture_version = p.moisture_version + coalesce(i.stored, 0)
+    FROM (
+        SELECT DISTINCT ON (plant_id) plant_id, at, percentage
+        FROM readings
+        ORDER BY plant_id, at DESC
+    ) l
+    LEFT JOIN (
+        SELECT plant_id, count(*)::int AS stored
+        FROM inserted
+        GROUP BY plant_id
+    ) i ON i.plant_id = l.plant_id
+    WHERE p.id = l.plant_id AND (p.last_moisture_at IS NULL OR p.last_moisture_at <= l.at OR i.stored > 0)
+    RETURNING 1
+), hourly AS (
+    {_ROLLUP_UPSERT.format(table=ROLLUP_TABLES['hour'], unit='hour')}
+    RETURNING 1
+), daily AS (
+    {_ROLLUP_UPSERT.format(table=ROLLUP_TABLES['day'], unit='day')}
+    RETURNING 1
+)
+SELECT count(*)::int AS stored FROM inserted
+'''
+
+# Waits for the readings being stored and keeps new ones out until the rebuild is committed,
+# ordered like STORE_READINGS_QUERY locks them
+_ROLLUP_REBUILD_LOCK = '''
+SELECT id FROM "Plant"
+WHERE $1::text IS NULL OR id = $1
+ORDER BY id
+FOR UPDATE
+'''
+
+_ROLLUP_REBUILD = '''
+INSERT INTO "{table}" (plant_id, bucket, count, min, max, sum)
+SELECT plant_id, date_trunc('{unit}', at), count(*), min(percentage), max(percentage), sum(percentage)
+FROM "MoisturePercentageRecord"
+WHERE $1::text IS NULL OR plant_id = $1
+GROUP BY 1, 2
+'''
+
+ROLLUP_BUCKETS_QUERY = '''
+WITH bounds AS (
+    SELECT min(bucket) AS first_at, max(bucket) AS last_at
+    FROM "{table}"
+    WHERE plant_id = $1 AND bucket >= date_trunc('{unit}', $2::timestamp)
+), width AS (
+    SELECT first_at, greatest(extract(epoch FROM last_at - first_at) / $3, 1) AS seconds
+    FROM bounds
+)
+SELECT
+    first_at + make_interval(secs => floor(extract(epoch FROM r.bucket - first_at) / seconds) * seconds) AS bucket,
+    (sum(r.sum)::float / sum(r.count)) AS avg,
+    min(r.min) AS min,
+    max(r.max) AS max
+FROM "{table}" r, width
+WHERE r.plant_id = $1 AND r.bucket >= date_trunc('{unit}', $2::timestamp)
+GROUP BY 1
+ORDER BY 1
+'''
+
+
+def _as_naive_utc(at: datetime.datetime) -> datetime.datetime:
+    # Naive datetimes are stored as UTC, like prisma does
+    if at.tzinfo is None:
+        return at
+    return at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+async def store_readings(readings: list[dict]) -> int:
+    '''
+    Stores readings, dicts with id, plant_id, at, percentage and optionally stored, adds them to
+    the hourly and daily rollups, keeps the latest reading on the plants and bumps their moisture
+    version by the readings stored. Readings with stored
+    set to False only count as latest reading. Returns the amount of readings stored, without the
+    readings stored before and those of deleted plants
+    '''
+    if not readings:
+        return 0
+
+    result = await prisma.query_raw(
+        STORE_READINGS_QUERY,
+        json.dumps([
+            {
+                'id': r['id'],
+                'plant_id': r['plant_id'],
+                'at': _as_naive_utc(r['at']).isoformat(),
+                'percentage': r['percentage'],
+                'stored': r.get('stored', True)
+            }
+            for r in readings
+        ])
+    )
+    return result[0]['stored']
+
+
+async def rebuild_rollups(plant_id: str | None = None):
+    '''
+    Rebuilds the rollups of a plant, or of every plant, from its records in one transaction
+    '''
+    async with prisma.batch_() as batch:
+        batch.execute_raw(_ROLLUP_REBUILD_LOCK, plant_id)
+        for unit, table in ROLLUP_TABLES.items():
+            batch.execute_raw(f'DELETE FROM "{table}" WHERE $1::text IS NULL OR plant_id = $1', plant_id)
+            batch.execute_raw(_ROLLUP_REBUILD.format(table=table, unit=unit), plant_id)
+
+
+async def main(plant_id: str | None):
+    await prisma.connect()
+    try:
+        await rebuild_rollups(plant_id)
+    finally:
+        await prisma.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
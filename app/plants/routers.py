@@ -1,108 +1,229 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+import asyncio
+import datetime
+import orjson
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi_jwt_auth import AuthJWT
-from . import crud, schemas
+from pydantic import ValidationError
+from app.auth.tokens import get_jwt_user_id
+from app.query_recorder import query_budget
+from . import crud, schemas, push
+from .devices import device_hub
+from .device_protocol import DeviceRoute, wants_binary, device_response, pack_plant, pack_bool, pack_count, pack_times, pack_next_time
 from app.utils.graph_period import GraphPeriod
+from app.utils.export import ExportFormat, ExportRecords, EXPORT_MEDIA_TYPES, encode_pages
+from app.utils.serializer import Serializer, json_response
+import app.config as config
 
 
-router = APIRouter(prefix="/plants")
+settings = config.Settings()
 
+router = APIRouter(prefix="/plants", route_class=DeviceRoute)
 
-@router.get('/', response_model=list[schemas.PlantResponseSmall])
+# Hot routes render their response_model with these instead of validating the rows again
+plant_small_serializer = Serializer(schemas.PlantResponseSmall)
+plant_serializer = Serializer(schemas.PlantResponse)
+plant_overview_serializer = Serializer(schemas.PlantOverviewResponse)
+plant_stamps_serializer = Serializer(schemas.PlantWithIrrigationStampsResponse)
+plant_timestamps_serializer = Serializer(schemas.PlantWithTimeStampsResponse)
+plant_periodstamps_serializer = Serializer(schemas.PlantWithPeriodStampsResponse)
+timestamp_serializer = Serializer(schemas.TimeStamp)
+
+
+@router.get('/', response_model=list[schemas.PlantResponseSmall], dependencies=[query_budget(2)])
 async def get_plants(Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
 
-    user_email = Authorize.get_jwt_subject()
-    user_plants = await crud.get_plants(user_email)
+    user_id = await get_jwt_user_id(Authorize)
+    user_plants = await crud.get_plants(user_id)
+
+    return plant_small_serializer.response_many(user_plants)
+
+
+@router.get('/overview', response_model=list[schemas.PlantOverviewResponse], dependencies=[query_budget(2)])
+async def get_plants_overview(Authorize: AuthJWT = Depends()):
+    '''
+    Every plant of the user with its latest moisture reading, last irrigation and next irrigation time today
+    '''
+    Authorize.jwt_required()
 
-    return user_plants
+    user_id = await get_jwt_user_id(Authorize)
+    return plant_overview_serializer.response_many(await crud.get_plants_overview(user_id))
 
 
-@router.get('/{plant_id}', response_model=schemas.PlantResponse)
+@router.get('/{plant_id}', response_model=schemas.PlantResponse, dependencies=[query_budget(2)])
 async def get_plant(plant_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_data = await crud.get_plant_by_id(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_data = await crud.get_plant_by_id(user_id, plant_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return plant_data
+    return plant_serializer.response(plant_data)
 
 
-@router.post('/espget', response_model=schemas.PlantResponse)
-async def get_plant_esp(plant: schemas.PlantESPGet):
+@router.post('/espget', response_model=schemas.PlantResponse, dependencies=[query_budget(1)])
+async def get_plant_esp(plant: schemas.PlantESPGet, request: Request):
     plant_data = await crud.get_plant_by_chip_id(plant.plant_id, plant.chip_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return plant_data
+    if wants_binary(request):
+        return device_response(pack_plant(plant_data))
 
+    return plant_serializer.response(plant_data)
 
-@router.post('/should_irrigate_now')
-async def get_should_irrigate_now(plant: schemas.PlantESPGet):
+
+@router.post('/should_irrigate_now', dependencies=[query_budget(2)])
+async def get_should_irrigate_now(plant: schemas.PlantESPGet, request: Request):
     should_irrigate = await crud.get_should_irrigate_now(plant.plant_id, plant.chip_id)
 
     if should_irrigate is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "No irrigations found for today")
 
-    return {"irrigate":should_irrigate}
-
+    if wants_binary(request):
+        return device_response(pack_bool(should_irrigate))
+
+    return json_response(orjson.dumps({"irrigate": should_irrigate}))
+
+
+async def receive_device_message(websocket: WebSocket) -> dict | None:
+    '''
+    Next message of a device, None when it is not a JSON object
+    '''
+    message = await websocket.receive()
+    if message['type'] == 'websocket.disconnect':
+        raise WebSocketDisconnect(message.get('code', status.WS_1000_NORMAL_CLOSURE))
+
+    try:
+        data = orjson.loads(message.get('text') or message.get('bytes') or b'')
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@router.websocket('/ws')
+async def device_websocket(websocket: WebSocket):
+    '''
+    Devices send {"plant_id", "chip_id"} within `device_identify_timeout` seconds, then
+    {"type": "moisture", "percentage"} and {"type": "irrigated"} messages. The server pushes
+    {"type": "schedule", "times"} and {"type": "irrigate", "water_amount"} messages, and answers
+    messages it could not handle with {"type": "error", "detail"}
+    '''
+    await websocket.accept()
+    try:
+        message = await asyncio.wait_for(receive_device_message(websocket), settings.device_identify_timeout)
+        plant = schemas.PlantESPGet.parse_obj(message)
+    except WebSocketDisconnect:
+        return
+    except (asyncio.TimeoutError, ValidationError):
+        await websocket.close(status.WS_1008_POLICY_VIOLATION)
+        return
 
-@router.post('/today_next_irrigation_time', response_model=List[schemas.TimeStamp])
-async def get_plant_today_next_time(plant: schemas.PlantESPGet):
+    plant_data = await crud.get_plant_by_chip_id(plant.plant_id, plant.chip_id)
+    if plant_data is None:
+        await websocket.close(status.WS_1008_POLICY_VIOLATION)
+        return
+
+    previous = device_hub.connect(plant_data.id, plant_data.chip_id, websocket)
+    if previous is not None:
+        await previous.websocket.close()
+
+    try:
+        await push.push_schedule(plant_data.id)
+        while True:
+            message = await receive_device_message(websocket)
+            if message is None:
+                await websocket.send_json({'type': 'error', 'detail': 'Messages must be JSON objects'})
+                continue
+
+            try:
+                match message.get('type'):
+                    case 'moisture':
+                        percentage = message.get('percentage')
+                        if type(percentage) != int or not (0 < percentage < 100):
+                            await websocket.send_json({'type': 'error', 'detail': 'Percentage should be in range(0, 100)'})
+                            continue
+                        await crud.register_current_moisture(percentage, plant)
+                    case 'irrigated':
+                        await crud.irrigate_plant(schemas.PlantIrrigation(plant_id=plant.plant_id, chip_id=plant.chip_id))
+                    case _:
+                        await websocket.send_json({'type': 'error', 'detail': 'Unknown message type'})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                print(f"Handling the message {message!r} of plant {plant_data.id} failed: {e!r}")
+                await websocket.send_json({'type': 'error', 'detail': 'Message could not be handled, send it again'})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        device_hub.disconnect(plant_data.id, websocket)
+
+
+@router.post('/today_next_irrigation_time', response_model=schemas.TimeStamp, dependencies=[query_budget(2)])
+async def get_plant_today_next_time(plant: schemas.PlantESPGet, request: Request):
+    now = datetime.datetime.now()
     plant_data = await crud.get_plant_today_next_time(plant.plant_id, plant.chip_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return plant_data
+    if wants_binary(request):
+        return device_response(pack_next_time(plant_data, now))
 
+    return timestamp_serializer.response(plant_data)
 
-@router.post('/today_irrigation_times', response_model=List[schemas.TimeStamp])
-async def get_plant_today_times(plant: schemas.PlantESPGet):
+
+@router.post('/today_irrigation_times', response_model=List[schemas.TimeStamp], dependencies=[query_budget(2)])
+async def get_plant_today_times(plant: schemas.PlantESPGet, request: Request):
+    now = datetime.datetime.now()
     plant_data = await crud.get_plant_today_times(plant.plant_id, plant.chip_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return plant_data
+    if wants_binary(request):
+        return device_response(pack_times(plant_data, now))
 
+    return timestamp_serializer.response_many(plant_data)
 
-@router.get('/{plant_id}/times', response_model=schemas.PlantWithIrrigationStampsResponse)
+
+@router.get('/{plant_id}/times', response_model=schemas.PlantWithIrrigationStampsResponse, dependencies=[query_budget(2)])
 async def get_plant_times(plant_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_data = await crud.get_plant_times(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_data = await crud.get_plant_times(user_id, plant_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return plant_data
+    return plant_stamps_serializer.response(plant_data, stamps=crud.irrigation_stamps(plant_data))
 
 
 @router.get('/{plant_id}/timestamps', response_model=schemas.PlantWithTimeStampsResponse)
 async def get_plant_timestamps(plant_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_data = await crud.get_plant_timestamps(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_data = await crud.get_plant_timestamps(user_id, plant_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return plant_data
+    return plant_timestamps_serializer.response(plant_data)
 
 
 @router.post('/{plant_id}/timestamps', response_model=schemas.TimeStamp)
 async def add_plant_timestamp(plant_id: str, timestamp: schemas.TimeStampAdd, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_data = await crud.add_plant_timestamp(user_email, plant_id, timestamp)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_data = await crud.add_plant_timestamp(user_id, plant_id, timestamp)
 
     if type(plant_data) == str and plant_data == 'already exists':
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Timestamp already exists")
@@ -116,8 +237,8 @@ async def add_plant_timestamp(plant_id: str, timestamp: schemas.TimeStampAdd, Au
 async def remove_plant_all_timestamps(plant_id: str, timestamp_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_data = await crud.remove_plant_all_timestamps(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_data = await crud.remove_plant_all_timestamps(user_id, plant_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
@@ -129,8 +250,8 @@ async def remove_plant_all_timestamps(plant_id: str, timestamp_id: str, Authoriz
 async def remove_plant_timestamp(plant_id: str, timestamp_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_data = await crud.remove_plant_timestamp(user_email, plant_id, timestamp_id)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_data = await crud.remove_plant_timestamp(user_id, plant_id, timestamp_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
@@ -142,21 +263,21 @@ async def remove_plant_timestamp(plant_id: str, timestamp_id: str, Authorize: Au
 async def get_plant_periodstamps(plant_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_data = await crud.get_plant_periodstamps(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_data = await crud.get_plant_periodstamps(user_id, plant_id)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return plant_data
+    return plant_periodstamps_serializer.response(plant_data)
 
 
 @router.post('/{plant_id}/periodstamps')
 async def change_plant_periodstamps(plant_id: str, periodstamp: schemas.PeriodStampsChange, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_data = await crud.change_plant_periodstamps(user_email, plant_id, periodstamp)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_data = await crud.change_plant_periodstamps(user_id, plant_id, periodstamp)
 
     if plant_data is None:
         raise HTTPException(status.HTTP_409_CONFLICT, "Plant with given id not found")
@@ -164,44 +285,75 @@ async def change_plant_periodstamps(plant_id: str, periodstamp: schemas.PeriodSt
     return {"amount_of_irrigations_per_week": plant_data}
 
 
-@router.get('/{plant_id}/irrigations_graph.svg')
-async def get_plant_irrigations_graph(plant_id: str, Authorize: AuthJWT = Depends()):
+@router.get('/{plant_id}/irrigations_graph.svg', dependencies=[query_budget(4)])
+async def get_plant_irrigations_graph(plant_id: str, if_none_match: str | None = Header(default=None), Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    svg = await crud.get_plant_irrigation_graph(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    graph = await crud.get_plant_irrigation_graph(user_id, plant_id, if_none_match)
 
-    if type(svg) == bool and not svg:
+    if type(graph) == bool and not graph:
         raise HTTPException(status.HTTP_204_NO_CONTENT, "No irrigation data")
 
-    if svg is None:
+    if graph is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return Response(svg, media_type='image/svg+xml')
+    if graph == 'render timeout':
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Graph could not be rendered in time")
 
+    headers = {'ETag': graph.etag, 'Cache-Control': 'no-cache'}
+    if graph.svg is None:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-@router.get('/{plant_id}/moisture_percentage_graph.svg')
-async def get_moisture_percentage_graph(plant_id: str, p: GraphPeriod = GraphPeriod.all_time, Authorize: AuthJWT = Depends()):
+    return Response(graph.svg, media_type='image/svg+xml', headers=headers)
+
+
+@router.get('/{plant_id}/moisture_percentage_graph.svg', dependencies=[query_budget(4)])
+async def get_moisture_percentage_graph(plant_id: str, p: GraphPeriod = GraphPeriod.all_time, if_none_match: str | None = Header(default=None), Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
 
-    user_email = Authorize.get_jwt_subject()
-    svg = await crud.get_moisture_percentage_graph(user_email, plant_id, p)
+    user_id = await get_jwt_user_id(Authorize)
+    graph = await crud.get_moisture_percentage_graph(user_id, plant_id, p, if_none_match)
 
-    if type(svg) == bool and not svg:
+    if type(graph) == bool and not graph:
         raise HTTPException(status.HTTP_204_NO_CONTENT, "No moisture data")
 
-    if svg is None:
+    if graph is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
+
+    if graph == 'render timeout':
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Graph could not be rendered in time")
+
+    headers = {'ETag': graph.etag, 'Cache-Control': 'no-cache'}
+    if graph.svg is None:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(graph.svg, media_type='image/svg+xml', headers=headers)
+
+
+@router.get('/{plant_id}/export/{records}')
+async def export_plant_records(plant_id: str, records: ExportRecords, format: ExportFormat = ExportFormat.csv, start: datetime.datetime | None = None, end: datetime.datetime | None = None, Authorize: AuthJWT = Depends()):
+    Authorize.jwt_required()
+
+    user_id = await get_jwt_user_id(Authorize)
+    pages = await crud.get_plant_records_export(user_id, plant_id, records, start, end)
+
+    if pages is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
-    return Response(svg, media_type='image/svg+xml')
+    return StreamingResponse(
+        encode_pages(pages, crud.EXPORT_FIELDS[records], format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{plant_id}-{records.value}.{format.value}"'}
+    )
 
 
-@router.get('/{plant_id}/current_moisture')
+@router.get('/{plant_id}/current_moisture', dependencies=[query_budget(3)])
 async def get_current_moisture(plant_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    current_moisture = await crud.get_current_moisture(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    current_moisture = await crud.get_current_moisture(user_id, plant_id)
     if type(current_moisture) == bool and not current_moisture:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
@@ -212,25 +364,40 @@ async def get_current_moisture(plant_id: str, Authorize: AuthJWT = Depends()):
 async def get_current_moisture_chart(plant_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    current_moisture = await crud.get_current_moisture_chart(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    current_moisture = await crud.get_current_moisture_chart(user_id, plant_id)
     if type(current_moisture) == bool and not current_moisture:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
     return {"current_moisture":current_moisture}
 
 
-@router.post('/current_moisture/{percentage}')
-async def set_current_moisture(percentage: int, plant: schemas.PlantESPGet):
+@router.post('/current_moisture/{percentage}', dependencies=[query_budget(3)])
+async def set_current_moisture(percentage: int, plant: schemas.PlantESPGet, request: Request):
     if not (0 < percentage < 100):
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Percentage should be in range(0, 100)")
     current_moisture = await crud.register_current_moisture(percentage, plant)
     if current_moisture is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
 
+    if wants_binary(request):
+        return device_response(status_code=status.HTTP_204_NO_CONTENT)
+
     return {"current_moisture":current_moisture}
 
 
+@router.post('/current_moisture', dependencies=[query_budget(3)])
+async def set_moisture_readings(readings: schemas.PlantMoistureReadings, request: Request):
+    registered = await crud.register_moisture_readings(readings)
+    if registered is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
+
+    if wants_binary(request):
+        return device_response(pack_count(registered))
+
+    return {"registered": registered}
+
+
 @router.post("/")
 async def create_plant(plant: schemas.PlantCreate):
     created_plant = await crud.create_plant(plant)
@@ -247,8 +414,8 @@ async def create_plant(plant: schemas.PlantCreate):
 async def update_plant(plant_id: str, plant: schemas.PlantUpdate, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    updated_plant = await crud.update_plant(user_email, plant_id, plant)
+    user_id = await get_jwt_user_id(Authorize)
+    updated_plant = await crud.update_plant(user_id, plant_id, plant)
 
     if not updated_plant:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
@@ -260,8 +427,8 @@ async def update_plant(plant_id: str, plant: schemas.PlantUpdate, Authorize: Aut
 async def delete_plant(plant_id: str, Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     
-    user_email = Authorize.get_jwt_subject()
-    plant_deleted = await crud.delete_plant(user_email, plant_id)
+    user_id = await get_jwt_user_id(Authorize)
+    plant_deleted = await crud.delete_plant(user_id, plant_id)
 
     if not plant_deleted:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id not found")
@@ -269,10 +436,13 @@ async def delete_plant(plant_id: str, Authorize: AuthJWT = Depends()):
     return {'message': 'Plant deleted'}
 
 
-@router.post("/irrigate")
-async def plant_irrigation(irrigation: schemas.PlantIrrigation):
+@router.post("/irrigate", dependencies=[query_budget(3)])
+async def plant_irrigation(irrigation: schemas.PlantIrrigation, request: Request):
     plant_irrigated = await crud.irrigate_plant(irrigation)
     if not plant_irrigated:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Plant with given id and Chip ID not found")
+
+    if wants_binary(request):
+        return device_response(status_code=status.HTTP_204_NO_CONTENT)
     
     return {'message': 'Plant irrigated'}
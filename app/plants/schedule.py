@@ -0,0 +1,105 @@
+import bisect
+import datetime
+from array import array
+from typing import Callable
+from dataclasses import dataclass
+from prisma.enums import DayOfWeek
+from app.utils.comparedatetime import weekdaytoint
+from app.utils.minutes_to_weektime import DAY_IN_MINUTES, HOUR_IN_MINUTES
+
+
+@dataclass(frozen=True)
+class ScheduledStamp:
+    id: str
+    day_of_week: DayOfWeek
+    hour: int
+    minute: int
+
+
+def weektime_to_minutes(weekday: int, hour: int, minute: int) -> int:
+    '''
+    Inverse of minutes_to_weektime, monday 00:00 -> 0
+    '''
+    return weekday * DAY_IN_MINUTES + hour * HOUR_IN_MINUTES + minute
+
+
+def minute_of_week(now: datetime.datetime) -> int:
+    return weektime_to_minutes(now.weekday(), now.hour, now.minute)
+
+
+class PlantSchedule:
+    '''
+    Stamps of one plant as sorted minutes of the week,
+    stamps for everyday are expanded to every day of the week
+    '''
+
+    def __init__(self, irrigation_type: str, stamps: list):
+        entries = []
+        for stamp in stamps:
+            weekday = weekdaytoint(stamp.day_of_week)
+            days = range(7) if weekday == -1 else (weekday,)
+            scheduled = ScheduledStamp(stamp.id, stamp.day_of_week, stamp.hour, stamp.minute)
+            entries.extend((weektime_to_minutes(day, stamp.hour, stamp.minute), scheduled) for day in days)
+        entries.sort(key=lambda e: e[0])
+
+        self.irrigation_type = irrigation_type
+        self.minutes = array('H', (m for m, _ in entries))
+        self.stamps = tuple(s for _, s in entries)
+
+    def _today_range(self, now: datetime.datetime):
+        start = bisect.bisect_left(self.minutes, minute_of_week(now))
+        end = bisect.bisect_left(self.minutes, (now.weekday() + 1) * DAY_IN_MINUTES)
+        return start, end
+
+    def today(self, now: datetime.datetime) -> list[ScheduledStamp]:
+        start, end = self._today_range(now)
+        return list(self.stamps[start:end])
+
+    def next_today(self, now: datetime.datetime) -> ScheduledStamp | None:
+        start, end = self._today_range(now)
+        if start == end:
+            return None
+        return self.stamps[start]
+
+
+class ScheduleIndex:
+    def __init__(self):
+        self._schedules: dict[str, PlantSchedule] = {}
+        self._versions: dict[str, int] = {}
+        self._listeners: list[Callable[[str], None]] = []
+
+    def on_invalidate(self, listener: Callable[[str], None]):
+        '''
+        Registers a listener called with the plant id whenever its stamps changed
+        '''
+        self._listeners.append(listener)
+
+    def version(self, plant_id: str) -> int:
+        return self._versions.get(plant_id, 0)
+
+    def get(self, plant_id: str) -> PlantSchedule | None:
+        return self._schedules.get(plant_id)
+
+    def put(self, plant_id: str, version: int, irrigation_type: str, stamps: list) -> PlantSchedule:
+        schedule = PlantSchedule(irrigation_type, stamps)
+        # Only keep the schedule if no invalidation happened while the stamps were loaded
+        if self.version(plant_id) == version:
+            self._schedules[plant_id] = schedule
+        return schedule
+
+    def clear(self):
+        '''
+        Drops every schedule, without telling the listeners
+        '''
+        for plant_id in self._schedules:
+            self._versions[plant_id] = self.version(plant_id) + 1
+        self._schedules.clear()
+
+    def invalidate(self, plant_id: str):
+        self._versions[plant_id] = self.version(plant_id) + 1
+        self._schedules.pop(plant_id, None)
+        for listener in self._listeners:
+            listener(plant_id)
+
+
+schedule_index = ScheduleIndex()
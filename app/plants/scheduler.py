@@ -0,0 +1,286 @@
+import asyncio
+import datetime
+import json
+from typing import Callable, Iterable
+from app.prisma import prisma
+from app.utils.minutes_to_weektime import WEEK_IN_MINUTES
+import app.config as config
+from .schedule import PlantSchedule, schedule_index, minute_of_week
+
+
+settings = config.Settings()
+
+LOAD_PAGE_SIZE = 1000
+
+LATEST_MOISTURE_QUERY = '''
+SELECT p.id, p.moisture_percentage_treshold AS threshold, p.last_moisture_percentage AS percentage
+FROM "Plant" p
+WHERE p.id IN (SELECT jsonb_array_elements_text($1::jsonb))
+'''
+
+# Fired decisions are kept in the database, so every worker answers the devices and a restart
+# neither loses nor repeats them. due_at is the server's local time like the stamps. Returns
+# the plants that were not due yet, plants deleted since the tick started are skipped
+SAVE_DUE_QUERY = '''
+WITH previous AS (
+    SELECT plant_id, due_at FROM "IrrigationDue"
+    WHERE plant_id IN (SELECT jsonb_array_elements_text($1::jsonb))
+), saved AS (
+    INSERT INTO "IrrigationDue" (plant_id, due_at)
+    SELECT id, $2::timestamp FROM "Plant"
+    WHERE id IN (SELECT jsonb_array_elements_text($1::jsonb))
+    ON CONFLICT (plant_id) DO UPDATE SET due_at = greatest("IrrigationDue".due_at, excluded.due_at)
+    RETURNING plant_id
+)
+SELECT s.plant_id FROM saved s
+LEFT JOIN previous p ON p.plant_id = s.plant_id
+WHERE p.due_at IS NULL OR p.due_at < $3::timestamp
+'''
+
+# Last minute the scheduler processed, the next leader continues from there
+LOAD_CURSOR_QUERY = '''
+SELECT ticked_at FROM "SchedulerCursor" WHERE id = 1
+'''
+
+SAVE_CURSOR_QUERY = '''
+INSERT INTO "SchedulerCursor" (id, ticked_at) VALUES (1, $1::timestamp)
+ON CONFLICT (id) DO UPDATE SET ticked_at = excluded.ticked_at
+'''
+
+
+class TimerWheel:
+    '''
+    One slot per minute of the week, holding the plants with a stamp on that minute
+    '''
+
+    def __init__(self):
+        self.slots: list[set[str]] = [set() for _ in range(WEEK_IN_MINUTES)]
+        self._plant_minutes: dict[str, tuple[int, ...]] = {}
+
+    def __len__(self):
+        return len(self._plant_minutes)
+
+    def set_plant(self, plant_id: str, minutes: Iterable[int]):
+        self.remove_plant(plant_id)
+        minutes = tuple(set(minutes))
+        for minute in minutes:
+            self.slots[minute].add(plant_id)
+        self._plant_minutes[plant_id] = minutes
+
+    def remove_plant(self, plant_id: str):
+        for minute in self._plant_minutes.pop(plant_id, ()):
+            self.slots[minute].discard(plant_id)
+
+    def due(self, minute: int) -> set[str]:
+        return self.slots[minute]
+
+
+class IrrigationScheduler:
+    '''
+    Decides every minute which plants of the whole fleet have to be irrigated,
+    the device endpoints only look the decision up. Runs in the leader worker only
+    '''
+
+    def __init__(self, due_minutes: int):
+        self.due_minutes = due_minutes
+        self.loaded = False
+        self.wheel = TimerWheel()
+        self._schedules: dict[str, PlantSchedule] = {}
+        self._auto_irrigation: set[str] = set()
+        self._pending_refresh: set[str] = set()
+        self._listeners: list[Callable[[str], None]] = []
+        self._tasks: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+        schedule_index.on_invalidate(self._on_schedule_invalidated)
+
+    def on_due(self, listener: Callable[[str], None]):
+        '''
+        Registers a listener called with the plant id whenever a plant becomes due
+        '''
+        self._listeners.append(listener)
+
+    def notify_due(self, plant_id: str):
+        for listener in self._listeners:
+            listener(plant_id)
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _set_plant(self, plant, version: int):
+        # Invalidated while the stamps were loaded, the refresh of that invalidation sets the plant
+        if schedule_index.version(plant.id) != version:
+            return
+        stamps = plant.timestamps if plant.irrigation_type == 'time' else plant.periodstamps
+        schedule = schedule_index.put(plant.id, version, plant.irrigation_type, stamps or [])
+        self._schedules[plant.id] = schedule
+        self.wheel.set_plant(plant.id, schedule.minutes)
+        if plant.auto_irrigation:
+            self._auto_irrigation.add(plant.id)
+        else:
+            self._auto_irrigation.discard(plant.id)
+
+    def _remove_plant(self, plant_id: str):
+        self._schedules.pop(plant_id, None)
+        self._auto_irrigation.discard(plant_id)
+        self.wheel.remove_plant(plant_id)
+
+    async def load(self):
+        cursor = None
+        while True:
+            page = await prisma.plant.find_many(
+                take=LOAD_PAGE_SIZE,
+                skip=1 if cursor else None,
+                cursor={'id': cursor} if cursor else None,
+                order={'id': 'asc'},
+                include={
+                    'timestamps': True,
+                    'periodstamps': True
+                }
+            )
+            for plant in page:
+                self._set_plant(plant, schedule_index.version(plant.id))
+            if len(page) < LOAD_PAGE_SIZE:
+                break
+            cursor = page[-1].id
+
+        self.loaded = True
+        pending, self._pending_refresh = self._pending_refresh, set()
+        for plant_id in pending:
+            await self.refresh_plant(plant_id)
+
+    async def refresh_plant(self, plant_id: str):
+        version = schedule_index.version(plant_id)
+        plant = await prisma.plant.find_first(where={
+            'id': plant_id
+        },
+        include={
+            'timestamps': True,
+            'periodstamps': True
+        })
+        if plant is None:
+            self._remove_plant(plant_id)
+        else:
+            self._set_plant(plant, version)
+
+    def _on_schedule_invalidated(self, plant_id: str):
+        if self.loaded:
+            self._spawn(self.refresh_plant(plant_id))
+        elif self._task is not None:
+            self._pending_refresh.add(plant_id)
+
+    async def tick(self, now: datetime.datetime) -> list[str]:
+        '''
+        Marks the plants due at `now`, returns the plants that became due
+        '''
+        stamped = self.wheel.due(minute_of_week(now))
+        auto = {
+            plant_id for plant_id in self._auto_irrigation
+            if plant_id not in stamped and self._schedules[plant_id].next_today(now) is not None
+        }
+        if not stamped and not auto:
+            return []
+
+        plants = await prisma.query_raw(LATEST_MOISTURE_QUERY, json.dumps([*stamped, *auto]))
+
+        matched = []
+        for plant in plants:
+            percentage = plant['percentage']
+            low = percentage is not None and percentage <= plant['threshold']
+            # Same decision as should_irrigate, for the current minute
+            if (plant['id'] in stamped and (percentage is None or low)) or (plant['id'] in auto and low):
+                matched.append(plant['id'])
+        if not matched:
+            return []
+
+        # Saved before the listeners are told
+        expired = now - datetime.timedelta(minutes=self.due_minutes)
+        rows = await prisma.query_raw(SAVE_DUE_QUERY, json.dumps(matched), now.isoformat(), expired.isoformat())
+        due = [row['plant_id'] for row in rows]
+        for plant_id in due:
+            self.notify_due(plant_id)
+        return due
+
+    def is_due(self, plant, now: datetime.datetime) -> bool:
+        '''
+        Whether a plant fetched with its irrigation_due is due,
+        its latest reading is checked again since it may be moist by now
+        '''
+        if plant.irrigation_due is None:
+            return False
+        # Stored as local time, prisma reads it as UTC
+        due_at = plant.irrigation_due.due_at.replace(tzinfo=None)
+        if now - due_at > datetime.timedelta(minutes=self.due_minutes):
+            return False
+
+        percentage = plant.last_moisture_percentage
+        return percentage is None or percentage <= plant.moisture_percentage_treshold
+
+    async def consume(self, plant_id: str):
+        await prisma.execute_raw('DELETE FROM "IrrigationDue" WHERE plant_id = $1', plant_id)
+
+    async def load_cursor(self) -> datetime.datetime | None:
+        rows = await prisma.query_raw(LOAD_CURSOR_QUERY)
+        if not rows:
+            return None
+        # Stored as local time like due_at
+        return datetime.datetime.fromisoformat(rows[0]['ticked_at']).replace(tzinfo=None)
+
+    async def catch_up(self, cursor: datetime.datetime | None, now: datetime.datetime) -> datetime.datetime | None:
+        '''
+        Ticks every minute after the cursor up to `now`, returns the last minute that ticked.
+        A failed tick stops the catch up, it is retried from that minute on the next call.
+        Minutes older than a due irrigation lasts are skipped
+        '''
+        now = now.replace(second=0, microsecond=0)
+        minute = now - datetime.timedelta(minutes=self.due_minutes)
+        if cursor is not None:
+            minute = max(minute, cursor + datetime.timedelta(minutes=1))
+        else:
+            minute = now
+
+        while minute <= now:
+            try:
+                await self.tick(minute)
+                await prisma.execute_raw(SAVE_CURSOR_QUERY, minute.isoformat())
+            except Exception as e:
+                print(f"Irrigation scheduler tick of {minute:%Y-%m-%d %H:%M} failed, it is retried: {e!r}")
+                break
+            cursor = minute
+            minute += datetime.timedelta(minutes=1)
+        return cursor
+
+    async def run(self):
+        while True:
+            try:
+                await self.load()
+                cursor = await self.load_cursor()
+                break
+            except Exception as e:
+                print(f"Loading the irrigation scheduler failed, retrying: {e!r}")
+                await asyncio.sleep(60)
+
+        while True:
+            cursor = await self.catch_up(cursor, datetime.datetime.now())
+            now = datetime.datetime.now()
+            await asyncio.sleep(60 - now.second - now.microsecond / 1_000_000)
+
+    def start(self):
+        if self._task is None:
+            self._task = self._spawn(self.run())
+
+    def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._task = None
+        self.loaded = False
+        self._pending_refresh.clear()
+        # Loaded again from scratch by the next start
+        self._schedules.clear()
+        self._auto_irrigation.clear()
+        self.wheel = TimerWheel()
+
+
+irrigation_scheduler = IrrigationScheduler(settings.irrigation_due_minutes)
@@ -4,6 +4,10 @@ from prisma.enums import DayOfWeek, IrrigationType
 from pydantic import BaseModel, EmailStr, validator
 
 
+# How far past the server's clock the timestamp of a reading may be
+MAX_CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
 class PlantBase(BaseModel):
     pass
 
@@ -51,6 +55,8 @@ class PlantUpdate(PlantBase):
     irrigation_type: IrrigationType = IrrigationType.period
     moisture_percentage_treshold: int = 50
     periodstamp_times_a_week: int = 0
+    moisture_deadband: int = 0
+    moisture_heartbeat_seconds: int = 3600
 
     @validator('water_amount')
     def validate_water_amount_range(cls, value):
@@ -67,6 +73,65 @@ class PlantUpdate(PlantBase):
         
         return value
 
+    @validator('moisture_deadband')
+    def validate_moisture_deadband_range(cls, value):
+        if value not in range(0, 101):
+            raise ValueError('value must be in range 0 to 100')
+
+        return value
+
+    @validator('moisture_heartbeat_seconds')
+    def validate_moisture_heartbeat_range(cls, value):
+        # Accepted range is: 1 minute -> 1 day
+        if value not in range(60, 86401):
+            raise ValueError('value must be in range 60 to 86400')
+
+        return value
+
+    @validator('periodstamp_times_a_week')
+    def validate_times_a_week_range(cls, value):
+        # Sent to the devices as one byte
+        if value not in range(0, 256):
+            raise ValueError('value must be in range 0 to 255')
+
+        return value
+
+
+class MoistureReading(BaseModel):
+    percentage: int
+    at: datetime.datetime | None = None
+
+    @validator('percentage')
+    def validate_percentage_range(cls, value):
+        if not (0 < value < 100):
+            raise ValueError('Percentage should be in range(0, 100)')
+
+        return value
+
+    @validator('at')
+    def validate_at(cls, value):
+        if value is None:
+            return value
+
+        if value.tzinfo is None or value.utcoffset() is None:
+            raise ValueError('Timestamp must include a timezone')
+
+        if value > datetime.datetime.now(datetime.timezone.utc) + MAX_CLOCK_SKEW:
+            raise ValueError('Timestamp can not be in the future')
+
+        return value
+
+
+class PlantMoistureReadings(PlantESPGet):
+    readings: List[MoistureReading]
+
+    @validator('readings')
+    def validate_readings_length(cls, value):
+        if len(value) not in range(1, 1001):
+            raise ValueError('Amount of readings must be in range 1 to 1000')
+
+        return value
+
 
 class PlantIrrigation(PlantBase):
     plant_id: str
@@ -99,6 +164,8 @@ class PlantResponse(PlantBase):
     irrigation_type: str
     moisture_percentage_treshold: int = 50
     periodstamp_times_a_week: int = 0
+    moisture_deadband: int = 0
+    moisture_heartbeat_seconds: int = 3600
 
 
 class TimeStamp(BaseModel):
@@ -108,6 +175,22 @@ class TimeStamp(BaseModel):
     minute: int
 
 
+class MoistureRecordResponse(BaseModel):
+    percentage: int
+    at: datetime.datetime
+
+
+class IrrigationRecordResponse(BaseModel):
+    water_amount: int
+    at: datetime.datetime
+
+
+class PlantOverviewResponse(PlantResponse):
+    current_moisture: MoistureRecordResponse | None
+    last_irrigation: IrrigationRecordResponse | None
+    next_irrigation_time: TimeStamp | None
+
+
 class TimeStampAdd(BaseModel):
     day_of_week: DayOfWeek
     hour: int
@@ -131,6 +214,14 @@ class TimeStampAdd(BaseModel):
 class PeriodStampsChange(BaseModel):
     times_a_week: int = 0
 
+    @validator('times_a_week')
+    def validate_times_a_week_range(cls, value):
+        # Sent to the devices as one byte
+        if value not in range(0, 256):
+            raise ValueError('value must be in range 0 to 255')
+
+        return value
+
 
 class PlantWithTimeStampsResponse(PlantResponse):
     timestamps: List[TimeStamp]
@@ -0,0 +1,26 @@
+'''
+Keeps the workers in step: schedule changes and due irrigations reach every worker,
+so each can push them to the devices connected to it. The irrigation scheduler runs
+in the leader only.
+'''
+from app.cluster import cluster
+from .schedule import schedule_index
+from .scheduler import irrigation_scheduler
+
+
+def _on_leadership(leader: bool):
+    if leader:
+        irrigation_scheduler.start()
+    else:
+        irrigation_scheduler.stop()
+
+
+schedule_index.on_invalidate(lambda plant_id: cluster.publish('schedule', plant_id))
+cluster.subscribe('schedule', schedule_index.invalidate)
+# Changes of other workers may have been missed
+cluster.subscribe('reconnected', lambda _: schedule_index.clear())
+
+irrigation_scheduler.on_due(lambda plant_id: cluster.publish('due', plant_id))
+cluster.subscribe('due', irrigation_scheduler.notify_due)
+
+cluster.on_leadership(_on_leadership)
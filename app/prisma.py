@@ -1,4 +1,190 @@
+import json
+import time
+import asyncio
+import contextvars
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from prisma import Prisma
+from prisma.errors import PrismaError
+from app.utils.lru_cache import LRUCache
+from app.utils.metrics import Counter, registry
+import app.config as config
 
 
-prisma = Prisma()
+settings = config.Settings()
+
+
+@dataclass
+class RequestQueries:
+    count: int = 0
+    seconds: float = 0.0
+    # (model, method, arguments, seconds) of every query, only when the query recorder is enabled
+    log: list[tuple[str, str, str, float]] | None = None
+
+    def add(self, queries: 'RequestQueries'):
+        self.count += queries.count
+        self.seconds += queries.seconds
+        if self.log is not None and queries.log:
+            self.log.extend(queries.log)
+
+
+# Set per request by the metrics middleware
+request_queries: contextvars.ContextVar[RequestQueries | None] = contextvars.ContextVar('request_queries', default=None)
+
+db_queries = Counter('plantpal_db_queries_total', 'Queries sent to the query engine', ['model', 'method'])
+db_query_seconds = Counter('plantpal_db_query_seconds_total', 'Time spent waiting on the query engine', ['model', 'method'])
+registry.register(db_queries, db_query_seconds)
+
+
+class InstrumentedPrisma(Prisma):
+    '''
+    Prisma client counting and timing every query it sends to the query engine
+    '''
+
+    async def _execute(self, method, operation, arguments, model=None, root_selection=None):
+        start = time.perf_counter()
+        try:
+            return await super()._execute(method, operation, arguments, model, root_selection)
+        finally:
+            elapsed = time.perf_counter() - start
+            labels = {'model': model or 'raw', 'method': method}
+            db_queries.inc(**labels)
+            db_query_seconds.inc(elapsed, **labels)
+
+            queries = request_queries.get()
+            if queries is not None:
+                queries.count += 1
+                queries.seconds += elapsed
+                if queries.log is not None:
+                    queries.log.append((labels['model'], method, json.dumps(arguments, sort_keys=True, default=str), elapsed))
+
+
+def worker_connection_limit() -> int | None:
+    if settings.db_connection_limit is None:
+        return None
+    # The cluster connection of the worker is not part of the pool
+    return max(settings.db_connection_limit // max(settings.workers, 1) - 1, 1)
+
+
+def pooled_url(url: str) -> str:
+    '''
+    Adds the pool settings of this worker to a postgres connection url
+    '''
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    connection_limit = worker_connection_limit()
+    if connection_limit is not None:
+        query['connection_limit'] = str(connection_limit)
+    query['pool_timeout'] = str(settings.db_pool_timeout)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def create_client(url: str | None) -> InstrumentedPrisma:
+    # Without a url in the settings prisma reads DATABASE_URL as is
+    return InstrumentedPrisma(
+        datasource={'url': pooled_url(url)} if url is not None else None,
+        connect_timeout=settings.db_connect_timeout
+    )
+
+
+prisma = create_client(settings.database_url)
+replica = create_client(settings.replica_database_url) if settings.replica_database_url is not None else None
+
+
+# Replay lag in seconds, 0 when the replica replayed everything it received or is no replica at all,
+# NULL when it does not stream from the primary, having replayed everything it received says nothing then.
+# The status of the receiver is only visible to roles with pg_read_all_stats, a running receiver counts as streaming without
+REPLICA_LAG_QUERY = '''
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE coalesce(status, 'streaming') = 'streaming') THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+END::float AS lag
+'''
+
+PINNED_USERS_SIZE = 10_000
+
+
+class ReadRouter:
+    '''
+    Sends reads to the replica while it is reachable and lags at most `max_lag` seconds,
+    reads of users who wrote in the last `pin_seconds` stay on the primary
+    '''
+
+    def __init__(self, primary: Prisma, replica: Prisma | None, max_lag: float, pin_seconds: float, check_interval: float):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # None while the replica is unreachable or does not stream from the primary
+        self.lag: float | None = None
+        self._pinned = LRUCache(PINNED_USERS_SIZE, pin_seconds)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def available(self) -> bool:
+        return self.replica is not None and self.lag is not None and self.lag <= self.max_lag
+
+    def pin(self, user_id: str):
+        '''
+        Keeps the reads of the user on the primary, so they see their own writes
+        '''
+        if self.replica is not None:
+            self._pinned.set(user_id, True)
+
+    def client(self, user_id: str | None = None) -> Prisma:
+        if not self.available or (user_id is not None and self._pinned.get(user_id, False)):
+            return self.primary
+        return self.replica
+
+    async def read(self, user_id: str | None, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        '''
+        Calls func(client, *args) on the replica when possible, on the primary when the replica fails
+        '''
+        client = self.client(user_id)
+        if client is self.primary:
+            return await func(client, *args)
+
+        try:
+            return await func(client, *args)
+        except PrismaError as e:
+            print(f"Replica read failed, falling back to the primary: {e!r}")
+            self.lag = None
+            return await func(self.primary, *args)
+
+    async def check(self):
+        try:
+            if not self.replica.is_connected():
+                await self.replica.connect()
+            result = await asyncio.wait_for(self.replica.query_raw(REPLICA_LAG_QUERY), settings.health_check_timeout)
+            # None keeps the reads on the primary
+            self.lag = result[0]['lag']
+        except Exception:
+            self.lag = None
+
+    async def run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self):
+        if self.replica is not None and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.replica is not None and self.replica.is_connected():
+            await self.replica.disconnect()
+
+
+read_router = ReadRouter(
+    prisma,
+    replica,
+    settings.replica_max_lag_seconds,
+    settings.replica_pin_seconds,
+    settings.replica_check_interval
+)
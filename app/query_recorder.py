@@ -0,0 +1,90 @@
+'''
+Development aid around the database queries issued per request.
+
+With QUERY_LOG=true every request logs its queries and flags identical queries
+it repeated. Routes declare the most queries they may issue with query_budget,
+an exceeded budget is logged, or raised with QUERY_BUDGET_STRICT=true so tests fail.
+Both rely on the per request counts kept by the metrics middleware. Tests assert the
+queries of a block, requests included, with assert_max_queries.
+'''
+from collections import Counter
+from contextlib import contextmanager
+from fastapi import Depends, Request
+from app.prisma import RequestQueries, request_queries
+import app.config as config
+
+
+settings = config.Settings()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def repeated_queries(queries: RequestQueries) -> dict[tuple[str, str, str], int]:
+    repeated = Counter((model, method, arguments) for model, method, arguments, _ in queries.log or [])
+    return {query: count for query, count in repeated.items() if count > 1}
+
+
+def print_queries(name: str, queries: RequestQueries):
+    print(f'{name}: {queries.count} queries in {queries.seconds * 1000:.1f} ms')
+    for model, method, arguments, seconds in queries.log or []:
+        print(f'    {seconds * 1000:>7.1f} ms {model}.{method} {arguments}')
+    for (model, method, arguments), count in repeated_queries(queries).items():
+        print(f'    repeated {count} times: {model}.{method} {arguments}')
+
+
+class QueryRecorderMiddleware:
+    '''
+    Logs the queries of every HTTP request, must run inside the metrics middleware
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        queries = request_queries.get() if scope['type'] == 'http' else None
+        if queries is None:
+            return await self.app(scope, receive, send)
+
+        queries.log = []
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            print_queries(f'{scope["method"]} {scope["path"]}', queries)
+
+
+def query_budget(max_queries: int):
+    '''
+    Route dependency declaring the most database queries the route may issue
+    '''
+    async def check_query_budget(request: Request):
+        yield
+        queries = request_queries.get()
+        if queries is None or queries.count <= max_queries:
+            return
+
+        message = f'{request.method} {request.url.path} issued {queries.count} database queries, its budget is {max_queries}'
+        if settings.query_budget_strict:
+            raise QueryBudgetExceeded(message)
+        print(message)
+
+    return Depends(check_query_budget)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int):
+    '''
+    Fails with the issued queries when the block issues more than max_queries database queries
+    '''
+    queries = RequestQueries(log=[])
+    token = request_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        request_queries.reset(token)
+
+    if queries.count > max_queries:
+        lines = [f'{queries.count} database queries issued, at most {max_queries} expected']
+        lines.extend(f'    {model}.{method} {arguments}' for model, method, arguments, _ in queries.log)
+        raise AssertionError('\n'.join(lines))
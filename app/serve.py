@@ -0,0 +1,47 @@
+'''
+Production entry point, runs WORKERS processes each with its own database pool:
+    python -m app.serve
+
+The workers share their changes through app.cluster, the leader among them runs the irrigation scheduler.
+'''
+import asyncio
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+import app.config as config
+import app.health as health
+
+
+settings = config.Settings()
+
+
+class DrainingServer(uvicorn.Server):
+    '''
+    On the first exit signal readiness fails for `shutdown_drain_seconds` while requests
+    are still served, so load balancers stop routing here before the server stops accepting
+    '''
+
+    def handle_exit(self, sig, frame):
+        if health.draining or settings.shutdown_drain_seconds <= 0:
+            return super().handle_exit(sig, frame)
+
+        health.draining = True
+        asyncio.get_event_loop().call_later(settings.shutdown_drain_seconds, super().handle_exit, sig, frame)
+
+
+def main():
+    server_config = uvicorn.Config(
+        'app:app',
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+        proxy_headers=True
+    )
+    server = DrainingServer(server_config)
+    if server_config.workers > 1:
+        Multiprocess(server_config, target=server.run, sockets=[server_config.bind_socket()]).run()
+    else:
+        server.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pygal, pygal.style
+import app.config as config
+
+
+charts_style = pygal.style.Style(
+    background='transparent',
+    plot_background='transparent',
+    foreground='#bbb',
+    foreground_strong='#fff',
+    foreground_subtle='#bbb',
+    opacity='.4',
+    opacity_hover='.9',
+    transition='400ms ease-in',
+    colors=('#E853A0', '#E8537A', '#E95355', '#E87653', '#E89B53')
+)
+
+
+def render_bar_chart(title: str, x_labels: list[str], values: list) -> bytes:
+    '''
+    Runs in the worker processes, only receives plain x/y data
+    '''
+    graph = pygal.Bar(
+        title=title,
+        width = 1000,
+        height = 600,
+        show_legend=False,
+        explicit_size = True,
+        style = charts_style,
+    )
+    graph.x_labels = x_labels
+    graph.y_labels = list(range(0, 101, 5))
+    graph.add(title, values)
+    graph.x_labels_major_count = 10
+    graph.show_minor_x_labels = False
+
+    return graph.render()
+
+
+class ChartRenderer:
+    '''
+    Renders charts in a process pool so the event loop keeps serving requests,
+    at most `concurrency` renders are in flight and callers wait at most `timeout` seconds
+    '''
+
+    def __init__(self, workers: int, concurrency: int, timeout: float):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.in_flight = 0
+        self.renders = 0
+        self.timeouts = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._executor: ProcessPoolExecutor | None = None
+
+    def start(self) -> ProcessPoolExecutor:
+        '''
+        Creates the pool, the workers are started by a fork server (spawned where there is none)
+        instead of forking the server with its threads, connections and event loop
+        '''
+        if self._executor is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            context = multiprocessing.get_context(method)
+            if method == 'forkserver':
+                context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    async def render_bar_chart(self, title: str, x_labels: list[str], values: list) -> bytes | None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return None
+
+        # The slot is only released once the worker is done, also when the caller timed out
+        self.in_flight += 1
+        future = loop.run_in_executor(self.start(), render_bar_chart, title, x_labels, values)
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return None
+
+    def _release(self, _):
+        self.in_flight -= 1
+        self.renders += 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'renders': self.renders,
+            'timeouts': self.timeouts,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+settings = config.Settings()
+
+chart_renderer = ChartRenderer(
+    settings.graph_render_workers,
+    settings.graph_render_concurrency,
+    settings.graph_render_timeout
+)
@@ -87,16 +87,16 @@ def stamps_args_today(now: datetime.datetime):
     }
 
 
-def filter_timestamps(condition: bool, now: datetime.datetime = datetime.datetime.now()) -> bool | FindManyTimestampArgsFromPlant:
+def filter_timestamps(condition: bool, now: datetime.datetime | None = None) -> bool | FindManyTimestampArgsFromPlant:
     if not condition:
         return False
     
-    return stamps_args_today(now)
+    return stamps_args_today(now or datetime.datetime.now())
 
 
-def filter_periodstamps(condition: bool, now: datetime.datetime = datetime.datetime.now()) -> bool | FindManyPeriodstampArgsFromPlant:
+def filter_periodstamps(condition: bool, now: datetime.datetime | None = None) -> bool | FindManyPeriodstampArgsFromPlant:
     if not condition:
         return False
     
-    return stamps_args_today(now)
+    return stamps_args_today(now or datetime.datetime.now())
 
@@ -0,0 +1,53 @@
+import csv
+import enum
+import io
+from typing import AsyncIterator, Iterable
+import orjson
+
+
+class ExportFormat(enum.Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+class ExportRecords(enum.Enum):
+    moisture_percentage = "moisture_percentage"
+    irrigations = "irrigations"
+
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.csv: 'text/csv',
+    ExportFormat.ndjson: 'application/x-ndjson',
+}
+
+
+def _encode_csv(rows: Iterable, fields: tuple[str, ...]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in (getattr(row, f) for f in fields)
+        ])
+    return buffer.getvalue().encode()
+
+
+def _encode_ndjson(rows: Iterable, fields: tuple[str, ...]) -> bytes:
+    return b''.join(
+        orjson.dumps({f: getattr(row, f) for f in fields}) + b'\n'
+        for row in rows
+    )
+
+
+async def encode_pages(pages: AsyncIterator[list], fields: tuple[str, ...], export_format: ExportFormat) -> AsyncIterator[bytes]:
+    '''
+    Encodes pages of records into one chunk per page, csv output starts with a header row
+    '''
+    if export_format == ExportFormat.csv:
+        yield (','.join(fields) + '\r\n').encode()
+        encode = _encode_csv
+    else:
+        encode = _encode_ndjson
+
+    async for page in pages:
+        yield encode(page, fields)
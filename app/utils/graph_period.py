@@ -1,4 +1,5 @@
 import enum
+import datetime
 
 
 class GraphPeriod(enum.Enum):
@@ -10,3 +11,22 @@ class GraphPeriod(enum.Enum):
     past_6_months = "past_6_months"
     past_year = "past_year"
     all_time = "all_time"
+
+
+GRAPH_PERIOD_WINDOWS = {
+    GraphPeriod.past_hour: datetime.timedelta(hours=1),
+    GraphPeriod.past_12_hours: datetime.timedelta(hours=12),
+    GraphPeriod.past_day: datetime.timedelta(days=1),
+    GraphPeriod.past_15_days: datetime.timedelta(days=15),
+    GraphPeriod.past_month: datetime.timedelta(days=30),
+    GraphPeriod.past_6_months: datetime.timedelta(days=182),
+    GraphPeriod.past_year: datetime.timedelta(days=365),
+    GraphPeriod.all_time: None,
+}
+
+
+def graph_period_start(graph_period: GraphPeriod, now: datetime.datetime) -> datetime.datetime:
+    window = GRAPH_PERIOD_WINDOWS[graph_period]
+    if window is None:
+        return datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return now - window
@@ -1,4 +1,9 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
+import app.config as config
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -10,3 +15,77 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+class HashingPool:
+    '''
+    Runs bcrypt on a dedicated thread pool, when more than max_queue
+    calls are waiting or running new calls are rejected with HasherBusyError
+    '''
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_depth = 0
+        self.queue_peak = 0
+        self.rejected = 0
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hasher')
+
+    def _timed(self, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.calls += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+
+    async def run(self, func, *args):
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise HasherBusyError()
+
+        self.queue_depth += 1
+        self.queue_peak = max(self.queue_peak, self.queue_depth)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, func, *args)
+        finally:
+            self.queue_depth -= 1
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'queue_depth': self.queue_depth,
+            'queue_peak': self.queue_peak,
+            'rejected': self.rejected,
+            'calls': self.calls,
+            'total_seconds': self.total_seconds,
+            'max_seconds': self.max_seconds,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+settings = config.Settings()
+
+hashing_pool = HashingPool(settings.hash_workers, settings.hash_queue_size)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await hashing_pool.run(get_password_hash, password)
@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    '''
+    Bounded least-recently-used cache, entries optionally expire after ttl seconds.
+    By default maxsize is the amount of entries, with weigh it is the total weight of the values
+    '''
+
+    def __init__(self, maxsize: int, ttl: float | None = None, weigh: Callable[[Any], int] | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, int, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or (self.ttl is not None and entry[0] < time.monotonic()):
+            if entry is not None:
+                self.pop(key)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key: Hashable, value: Any):
+        weight = self.weigh(value) if self.weigh is not None else 1
+        if weight > self.maxsize:
+            return
+
+        self.pop(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else 0.0
+        self._data[key] = (expires_at, weight, value)
+        self.weight += weight
+        while self.weight > self.maxsize:
+            _, (_, evicted_weight, _) = self._data.popitem(last=False)
+            self.weight -= evicted_weight
+
+    def pop(self, key: Hashable):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[1]
+
+    def remove_where(self, predicate: Callable[[Any], bool]):
+        for key in [k for k, (_, _, value) in self._data.items() if predicate(value)]:
+            self.pop(key)
+
+    def clear(self):
+        self._data.clear()
+        self.weight = 0
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'weight': self.weight,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,130 @@
+'''
+Minimal metrics in the Prometheus text exposition format
+'''
+import math
+import bisect
+from typing import Callable, Iterable
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames: Iterable[str], labelvalues: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, self.labelnames, key, value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(
+            f'{name}{_format_labels(labelnames, key)} {_format_value(value)}'
+            for name, labelnames, key, value in self.samples()
+        )
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        '''
+        For counters kept elsewhere and copied at collection time
+        '''
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: counts per bucket (not cumulative), sum and count
+        self._histograms: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def samples(self):
+        labelnames = (*self.labelnames, 'le')
+        for key, (counts, total, count) in self._histograms.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', labelnames, (*key, _format_value(bound)), cumulative
+            yield f'{self.name}_sum', self.labelnames, key, total
+            yield f'{self.name}_count', self.labelnames, key, count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+        self._collectors: list[Callable[[], None]] = []
+
+    def register(self, *metrics: Metric):
+        self._metrics.extend(metrics)
+
+    def on_collect(self, collector: Callable[[], None]):
+        '''
+        Registers a function called before rendering, to update gauges read from elsewhere
+        '''
+        self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+registry = Registry()
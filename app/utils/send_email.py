@@ -1,31 +1,249 @@
-from pydantic import DirectoryPath, EmailStr
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
+'''
+Outbound email over a few persistent SMTP sessions.
+
+Emails are rendered from precompiled templates into a bounded queue. Each session sends up to
+`batch_size` queued emails per wake up without reconnecting, and is closed after `idle_seconds`
+without emails. Failed emails are retried with exponential backoff, except when the server
+permanently rejected them.
+'''
+import asyncio
+from dataclasses import dataclass
+from email.message import EmailMessage
+from email.utils import formataddr
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
 import app.config as config
 
 
 settings = config.Settings()
 
-conf = ConnectionConfig(
-	MAIL_USERNAME=settings.mail_username,
-	MAIL_PASSWORD=settings.mail_password,
-	MAIL_FROM=settings.mail_from,
-	MAIL_PORT=settings.mail_port,
-	MAIL_SERVER=settings.mail_server,
-	MAIL_FROM_NAME=settings.mail_from_name,
-	MAIL_STARTTLS=True,
-	MAIL_SSL_TLS=False,
-	USE_CREDENTIALS=True,
-	TEMPLATE_FOLDER='./app/templates/email'
-)
+TEMPLATE_FOLDER = './app/templates/email'
+
+MAX_RETRY_DELAY = 300.0
+
+
+class MailQueueFullError(Exception):
+    pass
+
+
+@dataclass
+class OutboundMail:
+    message: EmailMessage
+    attempts: int = 0
+
+
+def is_permanent(error: Exception) -> bool:
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(r.code >= 500 for r in error.recipients)
+    return isinstance(error, (aiosmtplib.SMTPSenderRefused, aiosmtplib.SMTPDataError)) and error.code >= 500
+
+
+class MailDispatcher:
+    def __init__(
+        self,
+        smtp: dict,
+        sender: str,
+        template_folder: str,
+        connections: int,
+        queue_size: int,
+        batch_size: int,
+        max_attempts: int,
+        retry_delay: float,
+        idle_seconds: float
+    ):
+        # Keyword arguments of aiosmtplib.SMTP
+        self.smtp = smtp
+        self.sender = sender
+        self.connections = connections
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.idle_seconds = idle_seconds
+        self.environment = Environment(
+            loader=FileSystemLoader(template_folder),
+            autoescape=select_autoescape(['html']),
+            auto_reload=False
+        )
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.sessions = 0
+        self._templates: dict[str, Template] = {}
+        self._queue: asyncio.Queue[OutboundMail] = asyncio.Queue(queue_size)
+        self._retrying = 0
+        self._workers: list[asyncio.Task] = []
+
+    def template(self, name: str) -> Template:
+        template = self._templates.get(name)
+        if template is None:
+            template = self._templates[name] = self.environment.get_template(name)
+        return template
+
+    def render(self, subject: str, email_to: str, body: dict, template_name: str) -> EmailMessage:
+        message = EmailMessage()
+        message['Subject'] = subject
+        message['From'] = self.sender
+        message['To'] = email_to
+        message.set_content(self.template(template_name).render(**body), subtype='html')
+        return message
+
+    def enqueue(self, subject: str, email_to: str, body: dict, template_name: str = 'email.html'):
+        '''
+        Queues an email, raises MailQueueFullError when the queue is full
+        '''
+        try:
+            self._queue.put_nowait(OutboundMail(self.render(subject, email_to, body, template_name)))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise MailQueueFullError()
+
+    def _requeue(self, mail: OutboundMail):
+        try:
+            self._queue.put_nowait(mail)
+            self._retrying -= 1
+        except asyncio.QueueFull:
+            asyncio.get_running_loop().call_later(self.retry_delay, self._requeue, mail)
+
+    def _retry(self, mails: list[OutboundMail], error: Exception):
+        loop = asyncio.get_running_loop()
+        for mail in mails:
+            mail.attempts += 1
+            if mail.attempts >= self.max_attempts:
+                self.failed += 1
+                print(f"Sending email to {mail.message['To']} failed {mail.attempts} times, dropping it: {error!r}")
+                continue
 
+            self.retried += 1
+            self._retrying += 1
+            loop.call_later(min(self.retry_delay * 2 ** (mail.attempts - 1), MAX_RETRY_DELAY), self._requeue, mail)
 
-async def send_email_async(subject: str, email_to: EmailStr, body: dict, template_name: str = 'email.html'):
-	message = MessageSchema(
-		subject=subject,
-		recipients=[email_to],
-		template_body=body,
-		subtype=MessageType.html,
-	)
+    async def _close(self, session: aiosmtplib.SMTP | None) -> None:
+        if session is None:
+            return None
+        try:
+            await session.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            session.close()
+        return None
 
-	fm = FastMail(conf)
-	await fm.send_message(message, template_name=template_name)
+    async def _connect(self) -> aiosmtplib.SMTP:
+        session = aiosmtplib.SMTP(**self.smtp)
+        await session.connect()
+        self.sessions += 1
+        return session
+
+    async def _send_batch(self, session: aiosmtplib.SMTP | None, batch: list[OutboundMail]) -> aiosmtplib.SMTP | None:
+        for i, mail in enumerate(batch):
+            try:
+                if session is None or not session.is_connected:
+                    session = await self._connect()
+                try:
+                    await session.send_message(mail.message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    # The server closed the idle session, reconnect once
+                    session.close()
+                    session = await self._connect()
+                    await session.send_message(mail.message)
+                self.sent += 1
+            except (aiosmtplib.SMTPException, OSError) as e:
+                if is_permanent(e):
+                    self.failed += 1
+                    print(f"Email to {mail.message['To']} was rejected: {e!r}")
+                    continue
+
+                if isinstance(e, (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused)) and session is not None and session.is_connected:
+                    # The server only declined this email for now, the session stays usable
+                    self._retry([mail], e)
+                    continue
+
+                # The session is likely unusable, the rest of the batch is retried with this email
+                session = await self._close(session)
+                self._retry(batch[i:], e)
+                break
+        return session
+
+    async def _work(self):
+        session = None
+        try:
+            while True:
+                try:
+                    mail = await asyncio.wait_for(self._queue.get(), self.idle_seconds if session is not None else None)
+                except asyncio.TimeoutError:
+                    session = await self._close(session)
+                    continue
+
+                batch = [mail]
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                try:
+                    session = await self._send_batch(session, batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            if session is not None:
+                session.close()
+
+    async def join(self):
+        '''
+        Waits until every queued email was sent, dropped or scheduled for a retry
+        '''
+        await self._queue.join()
+
+    def start(self):
+        if self._workers:
+            return
+
+        for name in self.environment.list_templates():
+            self.template(name)
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._work()) for _ in range(self.connections)]
+
+    async def stop(self, timeout: float):
+        if not self._workers:
+            return
+
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+        unsent = self._queue.qsize() + self._retrying
+        if unsent:
+            print(f"{unsent} queued emails were not sent")
+
+    def stats(self) -> dict:
+        return {
+            'connections': self.connections,
+            'queue_depth': self._queue.qsize(),
+            'retrying': self._retrying,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'rejected': self.rejected,
+            'sessions': self.sessions
+        }
+
+
+mail_dispatcher = MailDispatcher(
+    {
+        'hostname': settings.mail_server,
+        'port': settings.mail_port,
+        'username': settings.mail_username if settings.mail_use_credentials else None,
+        'password': settings.mail_password if settings.mail_use_credentials else None,
+        'start_tls': settings.mail_starttls,
+        'timeout': settings.mail_timeout
+    },
+    formataddr((settings.mail_from_name, settings.mail_from)),
+    TEMPLATE_FOLDER,
+    settings.mail_connections,
+    settings.mail_queue_size,
+    settings.mail_batch_size,
+    settings.mail_max_attempts,
+    settings.mail_retry_delay,
+    settings.mail_idle_seconds
+)
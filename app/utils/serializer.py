@@ -0,0 +1,65 @@
+'''
+Serializes rows straight into JSON bytes following the fields of a response schema.
+
+Routes keep the schema as their response_model so the OpenAPI document does not change,
+returning the rendered Response skips FastAPI's validation and encoding of the content.
+'''
+from typing import Any, Iterable
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+
+
+def _get(row, name: str, default):
+    if isinstance(row, dict):
+        return row.get(name, default)
+    return getattr(row, name, default)
+
+
+class Serializer:
+    '''
+    Projects prisma models, dataclasses or dicts onto the fields of `schema`,
+    values are trusted to already have the declared types
+    '''
+
+    def __init__(self, schema: type[BaseModel]):
+        self.schema = schema
+        # (name, default, serializer of a nested schema, whether the field is a list)
+        self.fields: list[tuple[str, Any, 'Serializer | None', bool]] = []
+        for name, field in schema.__fields__.items():
+            nested = None
+            if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+                nested = Serializer(field.type_)
+            self.fields.append((name, field.default, nested, field.shape != SHAPE_SINGLETON))
+
+    def project(self, row, **values) -> dict | None:
+        '''
+        Fields of the schema read from `row`, `values` take precedence over the row
+        '''
+        if row is None:
+            return None
+
+        data = {}
+        for name, default, nested, many in self.fields:
+            value = values[name] if name in values else _get(row, name, default)
+            if nested is not None and value is not None:
+                value = [nested.project(v) for v in value] if many else nested.project(value)
+            data[name] = value
+        return data
+
+    def dumps(self, row, **values) -> bytes:
+        return orjson.dumps(self.project(row, **values))
+
+    def dumps_many(self, rows: Iterable) -> bytes:
+        return orjson.dumps([self.project(row) for row in rows])
+
+    def response(self, row, **values) -> Response:
+        return json_response(self.dumps(row, **values))
+
+    def response_many(self, rows: Iterable) -> Response:
+        return json_response(self.dumps_many(rows))
+
+
+def json_response(content: bytes, status_code: int = 200) -> Response:
+    return Response(content, status_code=status_code, media_type='application/json')
@@ -0,0 +1,192 @@
+'''
+Simulates a fleet of ESP devices and a smaller population of dashboard users
+against a running server, and reports throughput and latency percentiles per route.
+
+Users are seeded directly in the server's (local, disposable) database, every device
+gets its plant through POST /plants/ like a real ESP. Run from the repository root:
+    python -m benchmarks.load_test --url http://localhost:8000 --devices 2000 --duration 120
+'''
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from collections import defaultdict
+import httpx
+from app.prisma import prisma
+from app.utils.hasher import get_password_hash
+from app.utils.graph_period import GraphPeriod
+
+
+SEED_PREFIX = 'load-test'
+PASSWORD = 'load-test-password'
+
+GRAPH_PERIODS = [p.value for p in GraphPeriod]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            return None
+        self.latencies[route].append(time.perf_counter() - start)
+        if response.status_code >= 400 and response.status_code != 404:
+            self.errors[route] += 1
+        return response
+
+    def report(self, elapsed: float):
+        print(f'{"route":<48} {"requests":>9} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        total = 0
+        for route in sorted(self.latencies.keys() | self.errors.keys()):
+            latencies = self.latencies[route]
+            total += len(latencies)
+            if len(latencies) > 1:
+                q = statistics.quantiles(latencies, n=100)
+                p50, p95, p99 = q[49] * 1000, q[94] * 1000, q[98] * 1000
+            else:
+                p50 = p95 = p99 = latencies[0] * 1000 if latencies else 0
+            print(f'{route:<48} {len(latencies):>9} {len(latencies) / elapsed:>8.1f} '
+                  f'{p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {self.errors[route]:>7}')
+        print(f'{"total":<48} {total:>9} {total / elapsed:>8.1f}')
+
+
+async def seed_users(users: int) -> list[str]:
+    password = get_password_hash(PASSWORD)
+    emails = []
+    for i in range(users):
+        email = f'{SEED_PREFIX}-{i}@plantpal.local'
+        await prisma.user.create(data={
+            'email': email,
+            'first_name': 'Load',
+            'last_name': 'Test',
+            'password': password,
+            'verification': {
+                'create': {
+                    'code': '-',
+                    'verified': True
+                }
+            }
+        })
+        emails.append(email)
+    return emails
+
+
+async def cleanup():
+    await prisma.user.delete_many(where={
+        'email': {
+            'startswith': f'{SEED_PREFIX}-'
+        }
+    })
+
+
+async def create_devices(client: httpx.AsyncClient, stats: Stats, emails: list[str], devices: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create(i: int):
+        chip_id = f'{random.getrandbits(64):016x}'
+        async with semaphore:
+            response = await stats.request(client, 'POST /plants/', 'POST', '/plants/', json={
+                'email': emails[i % len(emails)],
+                'password': PASSWORD,
+                'chip_id': chip_id
+            })
+        if response is None or response.status_code != 200:
+            return None
+        return response.json()['id'], chip_id
+
+    created = await asyncio.gather(*(create(i) for i in range(devices)))
+    return [device for device in created if device is not None]
+
+
+async def device(client: httpx.AsyncClient, stats: Stats, plant_id: str, chip_id: str, args, deadline: float):
+    identity = {'plant_id': plant_id, 'chip_id': chip_id}
+    await asyncio.sleep(random.uniform(0, args.poll_interval))
+    last_moisture = 0.0
+    while time.monotonic() < deadline:
+        response = await stats.request(client, 'POST /plants/should_irrigate_now', 'POST', '/plants/should_irrigate_now', json=identity)
+        if response is not None and response.status_code == 200 and response.json()['irrigate']:
+            await stats.request(client, 'POST /plants/irrigate', 'POST', '/plants/irrigate', json=identity)
+        elif random.random() < args.irrigate_probability:
+            await stats.request(client, 'POST /plants/irrigate', 'POST', '/plants/irrigate', json=identity)
+
+        if time.monotonic() - last_moisture >= args.moisture_interval:
+            last_moisture = time.monotonic()
+            await stats.request(client, 'POST /plants/current_moisture/{percentage}', 'POST',
+                                f'/plants/current_moisture/{random.randint(1, 99)}', json=identity)
+
+        await asyncio.sleep(args.poll_interval * random.uniform(0.9, 1.1))
+
+
+async def dashboard(client: httpx.AsyncClient, stats: Stats, email: str, args, deadline: float):
+    response = await stats.request(client, 'POST /auth/login', 'POST', '/auth/login', json={
+        'email': email,
+        'password': PASSWORD
+    })
+    if response is None or response.status_code != 200:
+        return
+    headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+    response = await stats.request(client, 'GET /plants/', 'GET', '/plants/', headers=headers)
+    plant_ids = [plant['id'] for plant in response.json()] if response is not None and response.status_code == 200 else []
+    if not plant_ids:
+        return
+
+    while time.monotonic() < deadline:
+        plant_id = random.choice(plant_ids)
+        await stats.request(client, 'GET /plants/{id}/times', 'GET', f'/plants/{plant_id}/times', headers=headers)
+        await stats.request(client, 'GET /plants/{id}/moisture_percentage_graph.svg', 'GET',
+                            f'/plants/{plant_id}/moisture_percentage_graph.svg',
+                            params={'p': random.choice(GRAPH_PERIODS)}, headers=headers)
+        await stats.request(client, 'GET /plants/{id}/irrigations_graph.svg', 'GET',
+                            f'/plants/{plant_id}/irrigations_graph.svg', headers=headers)
+        await asyncio.sleep(args.think_time * random.uniform(0.5, 1.5))
+
+
+async def main(args):
+    await prisma.connect()
+    await cleanup()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    try:
+        emails = await seed_users(args.users)
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+            setup = Stats()
+            start = time.monotonic()
+            devices = await create_devices(client, setup, emails, args.devices, args.connections)
+            print(f'{len(devices)} of {args.devices} devices created')
+            setup.report(time.monotonic() - start)
+
+            stats = Stats()
+            start = time.monotonic()
+            deadline = start + args.duration
+            await asyncio.gather(
+                *(device(client, stats, plant_id, chip_id, args, deadline) for plant_id, chip_id in devices),
+                *(dashboard(client, stats, emails[i % len(emails)], args, deadline) for i in range(args.dashboards))
+            )
+            print()
+            stats.report(time.monotonic() - start)
+    finally:
+        await cleanup()
+        await prisma.disconnect()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PlantPal device fleet load test')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100, help='seeded users owning the devices')
+    parser.add_argument('--dashboards', type=int, default=20, help='concurrent dashboard users')
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--poll-interval', type=float, default=10, help='seconds between should_irrigate_now polls of a device')
+    parser.add_argument('--moisture-interval', type=float, default=30, help='seconds between moisture posts of a device')
+    parser.add_argument('--irrigate-probability', type=float, default=0.01, help='chance a poll also registers an irrigation')
+    parser.add_argument('--think-time', type=float, default=2, help='seconds between dashboard page loads')
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=30)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+'''
+Sends verification emails to a local aiosmtpd stub, once with a new SMTP session and
+template environment per email like the previous send_email_async, once through the
+mail dispatcher, and compares the sessions opened and the throughput.
+
+Needs aiosmtpd (pip install aiosmtpd), run from the repository root:
+    python -m benchmarks.mail_dispatch [emails] [port]
+'''
+import sys
+import time
+import asyncio
+from email.message import EmailMessage
+import aiosmtplib
+from aiosmtpd.controller import Controller
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from app.utils.send_email import MailDispatcher, TEMPLATE_FOLDER
+
+
+SENDER = 'PlantPal <bench@plantpal.local>'
+
+
+class CountingHandler:
+    def __init__(self):
+        self.messages = 0
+        self.peers: set[tuple] = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        self.peers.add(session.peer)
+        return '250 Message accepted for delivery'
+
+
+def body(i: int) -> dict:
+    return {'title': 'Verify Account', 'name': f'User {i}', 'user_id': f'user-{i}', 'code': f'{i:06d}'}
+
+
+async def send_per_email(i: int, port: int):
+    environment = Environment(loader=FileSystemLoader(TEMPLATE_FOLDER), autoescape=select_autoescape(['html']))
+    message = EmailMessage()
+    message['Subject'] = 'Account Verification'
+    message['From'] = SENDER
+    message['To'] = f'user-{i}@plantpal.local'
+    message.set_content(environment.get_template('verify.html').render(**body(i)), subtype='html')
+    await aiosmtplib.send(message, hostname='127.0.0.1', port=port, start_tls=False)
+
+
+async def per_email(emails: int, port: int):
+    await asyncio.gather(*(send_per_email(i, port) for i in range(emails)))
+
+
+async def dispatched(emails: int, port: int):
+    dispatcher = MailDispatcher(
+        {'hostname': '127.0.0.1', 'port': port, 'start_tls': False},
+        SENDER,
+        TEMPLATE_FOLDER,
+        connections=2,
+        queue_size=emails,
+        batch_size=20,
+        max_attempts=3,
+        retry_delay=0.5,
+        idle_seconds=5.0
+    )
+    dispatcher.start()
+    for i in range(emails):
+        dispatcher.enqueue('Account Verification', f'user-{i}@plantpal.local', body(i), 'verify.html')
+    await dispatcher.join()
+    await dispatcher.stop(5.0)
+
+
+async def measure(name: str, send, emails: int, port: int):
+    handler = CountingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        start = time.perf_counter()
+        await send(emails, port)
+        elapsed = time.perf_counter() - start
+    finally:
+        controller.stop()
+
+    print(f'{name:<10} {handler.messages:>6} emails {len(handler.peers):>6} sessions '
+          f'{elapsed:>8.2f} s {handler.messages / elapsed:>8.1f} emails/s')
+
+
+async def main(emails: int, port: int):
+    await measure('per email', per_email, emails, port)
+    await measure('dispatched', dispatched, emails, port)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 8025
+    ))
@@ -0,0 +1,86 @@
+'''
+Compares the CPU time per response of FastAPI's response_model path (validation,
+jsonable_encoder and json.dumps) with the serializers of the hot routes.
+
+Needs no database, run from the repository root:
+    python -m benchmarks.serialization [iterations]
+'''
+import sys
+import time
+import datetime
+import orjson
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from prisma.enums import DayOfWeek, IrrigationType
+from prisma.models import Plant, Timestamp
+from app.plants import schemas
+from app.plants.routers import plant_small_serializer, plant_serializer, plant_timestamps_serializer, timestamp_serializer
+
+
+NOW = datetime.datetime.now(datetime.timezone.utc)
+
+
+def make_timestamp(i: int) -> Timestamp:
+    return Timestamp(id=f'timestamp-{i}', day_of_week=DayOfWeek.everyday, hour=i % 24, minute=i % 60, plant_id='plant-0')
+
+
+def make_plant(i: int, timestamps: int = 0) -> Plant:
+    return Plant(
+        id=f'plant-{i}',
+        chip_id=f'{i:016x}',
+        name=f'Plant {i}',
+        water_amount=1000,
+        created_at=NOW,
+        updated_at=NOW,
+        auto_irrigation=True,
+        moisture_percentage_treshold=50,
+        irrigation_type=IrrigationType.time,
+        periodstamp_times_a_week=0,
+        moisture_deadband=0,
+        moisture_heartbeat_seconds=3600,
+        moisture_version=0,
+        user_id='user-0',
+        timestamps=[make_timestamp(t) for t in range(timestamps)] or None
+    )
+
+
+CASES = [
+    ('GET /plants/ (100 plants)', list[schemas.PlantResponseSmall], plant_small_serializer.response_many, [make_plant(i) for i in range(100)]),
+    ('POST /plants/espget', schemas.PlantResponse, plant_serializer.response, make_plant(0)),
+    ('GET /plants/{id}/timestamps (50)', schemas.PlantWithTimeStampsResponse, plant_timestamps_serializer.response, make_plant(0, 50)),
+    ('POST /plants/today_irrigation_times (8)', list[schemas.TimeStamp], timestamp_serializer.response_many, [make_timestamp(i) for i in range(8)]),
+]
+
+
+def response_model_path(field, content) -> bytes:
+    # What FastAPI does with the return value of a route declaring a response_model,
+    # the coroutine never suspends so it is driven without an event loop
+    try:
+        serialize_response(field=field, response_content=content).send(None)
+    except StopIteration as result:
+        return JSONResponse(result.value).body
+
+
+def cpu_per_call(func, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations * 1_000_000
+
+
+def main(iterations: int):
+    print(f'{"route":<42} {"response_model":>16} {"serializer":>12} {"speedup":>8}')
+    for name, model, serialize, content in CASES:
+        field = create_response_field(name='Response', type_=model)
+        before = response_model_path(field, content)
+        after = serialize(content).body
+        assert orjson.loads(before) == orjson.loads(after), name
+
+        slow = cpu_per_call(lambda: response_model_path(field, content), iterations)
+        fast = cpu_per_call(lambda: serialize(content).body, iterations)
+        print(f'{name:<42} {slow:>13.1f} us {fast:>9.1f} us {slow / fast:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,133 @@
+'''
+Compares DB round trips and latency of the irrigation decision before and after
+it was collapsed into a single query.
+
+Run from the repository root against a migrated database:
+    python -m benchmarks.should_irrigate_now [iterations]
+'''
+import sys
+import time
+import asyncio
+import datetime
+from app.prisma import prisma
+from app.plants import crud
+from app.utils.comparedatetime import inttoweekday, filter_timestamps, filter_periodstamps
+
+
+round_trips = 0
+_execute = prisma._execute
+
+
+async def counting_execute(*args, **kwargs):
+    global round_trips
+    round_trips += 1
+    return await _execute(*args, **kwargs)
+
+
+prisma._execute = counting_execute
+
+
+def should_irrigate(plant, time, moisture, now: datetime.datetime) -> bool:
+    threshold = plant.moisture_percentage_treshold
+    if moisture is None:
+        return time.hour == now.hour and time.minute == now.minute
+    elif plant.auto_irrigation and moisture.percentage <= threshold:
+        return True
+    elif moisture.percentage <= threshold:
+        return time.hour == now.hour and time.minute == now.minute
+
+    return False
+
+
+async def legacy_get_plant_by_chip_id(plant_id: str, chip_id: str):
+    # The previous lookup queried the database every time, crud.get_plant_by_chip_id is cached now
+    return await prisma.plant.find_first(where={
+        'id': plant_id,
+        'chip_id': chip_id
+    })
+
+
+async def legacy_should_irrigate_now(plant_id: str, chip_id: str):
+    # Call sequence of the previous implementation:
+    # plant lookup, today times (plant lookup + plant with stamps) and latest moisture
+    now = datetime.datetime.now()
+    plant = await legacy_get_plant_by_chip_id(plant_id, chip_id)
+    if plant is None:
+        return None
+    _plant = await legacy_get_plant_by_chip_id(plant_id, chip_id)
+    if _plant is None:
+        return None
+    plant_data = await prisma.plant.find_first(where={
+        'id': _plant.id,
+        'user_id': _plant.user_id
+    },
+    include={
+        'user': True,
+        'timestamps': filter_timestamps(_plant.irrigation_type == 'time', now),
+        'periodstamps': filter_periodstamps(_plant.irrigation_type == 'period', now),
+    })
+    times = plant_data.timestamps if plant.irrigation_type == 'time' else plant_data.periodstamps
+    if not times:
+        return None
+    moisture = await prisma.moisturepercentagerecord.find_first(where={
+        'plant': {
+            'is': {
+                'id': plant_id,
+                'chip_id': chip_id
+            }
+        }
+    },
+    order={
+        'at': 'desc'
+    })
+    return should_irrigate(plant, times[0], moisture, now)
+
+
+async def measure(name: str, func, plant_id: str, chip_id: str, iterations: int):
+    global round_trips
+    round_trips = 0
+    results = set()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        results.add(await func(plant_id, chip_id))
+    elapsed = time.perf_counter() - start
+    print(f'{name:<8} {round_trips / iterations:>6.1f} round trips/call '
+          f'{elapsed / iterations * 1000:>8.2f} ms/call  results={results}')
+
+
+async def main(iterations: int):
+    await prisma.connect()
+    user = await prisma.user.create(data={
+        'email': f'bench-{time.time_ns()}@plantpal.local',
+        'first_name': 'Bench',
+        'last_name': 'Mark',
+        'password': '-'
+    })
+    plant = await prisma.plant.create(data={
+        'user_id': user.id,
+        'chip_id': f'{time.time_ns() & 0xFFFFFFFFFFFFFFFF:016x}',
+        'irrigation_type': 'time'
+    })
+    now = datetime.datetime.now()
+    await prisma.timestamp.create(data={
+        'plant_id': plant.id,
+        'day_of_week': inttoweekday(now.weekday()),
+        'hour': 23,
+        'minute': 59
+    })
+    await prisma.moisturepercentagerecord.create(data={
+        'plant_id': plant.id,
+        'percentage': 70
+    })
+
+    try:
+        await measure('before', legacy_should_irrigate_now, plant.id, plant.chip_id, iterations)
+        await measure('after', crud.get_should_irrigate_now, plant.id, plant.chip_id, iterations)
+    finally:
+        await prisma.timestamp.delete_many(where={'plant_id': plant.id})
+        await prisma.user.delete(where={'id': user.id})
+        await prisma.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
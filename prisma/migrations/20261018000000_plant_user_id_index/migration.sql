@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX CONCURRENTLY "Plant_user_id_idx" ON "Plant"("user_id");
@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX CONCURRENTLY "MoisturePercentageRecord_plant_id_at_idx" ON "MoisturePercentageRecord"("plant_id", "at");
@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX CONCURRENTLY "IrrigationRecord_plant_id_at_idx" ON "IrrigationRecord"("plant_id", "at");
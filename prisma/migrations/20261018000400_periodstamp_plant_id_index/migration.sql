@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX CONCURRENTLY "Periodstamp_plant_id_day_of_week_hour_minute_idx" ON "Periodstamp"("plant_id", "day_of_week", "hour", "minute");
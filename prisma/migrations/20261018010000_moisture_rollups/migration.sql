@@ -0,0 +1,29 @@
+-- CreateTable
+CREATE TABLE "MoistureHourlyRollup" (
+    "bucket" TIMESTAMP(3) NOT NULL,
+    "count" INTEGER NOT NULL,
+    "min" INTEGER NOT NULL,
+    "max" INTEGER NOT NULL,
+    "sum" INTEGER NOT NULL,
+    "plant_id" TEXT NOT NULL,
+
+    CONSTRAINT "MoistureHourlyRollup_pkey" PRIMARY KEY ("plant_id","bucket")
+);
+
+-- CreateTable
+CREATE TABLE "MoistureDailyRollup" (
+    "bucket" TIMESTAMP(3) NOT NULL,
+    "count" INTEGER NOT NULL,
+    "min" INTEGER NOT NULL,
+    "max" INTEGER NOT NULL,
+    "sum" INTEGER NOT NULL,
+    "plant_id" TEXT NOT NULL,
+
+    CONSTRAINT "MoistureDailyRollup_pkey" PRIMARY KEY ("plant_id","bucket")
+);
+
+-- AddForeignKey
+ALTER TABLE "MoistureHourlyRollup" ADD CONSTRAINT "MoistureHourlyRollup_plant_id_fkey" FOREIGN KEY ("plant_id") REFERENCES "Plant"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "MoistureDailyRollup" ADD CONSTRAINT "MoistureDailyRollup_plant_id_fkey" FOREIGN KEY ("plant_id") REFERENCES "Plant"("id") ON DELETE CASCADE ON UPDATE CASCADE;
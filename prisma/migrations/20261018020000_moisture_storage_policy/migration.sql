@@ -0,0 +1,3 @@
+-- AlterTable
+ALTER TABLE "Plant" ADD COLUMN     "moisture_deadband" INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN     "moisture_heartbeat_seconds" INTEGER NOT NULL DEFAULT 3600;
@@ -0,0 +1,12 @@
+-- AlterTable
+ALTER TABLE "Plant" ADD COLUMN     "last_moisture_at" TIMESTAMP(3),
+ADD COLUMN     "last_moisture_percentage" INTEGER;
+
+-- Backfill
+UPDATE "Plant" p SET "last_moisture_percentage" = m."percentage", "last_moisture_at" = m."at"
+FROM (
+    SELECT DISTINCT ON ("plant_id") "plant_id", "percentage", "at"
+    FROM "MoisturePercentageRecord"
+    ORDER BY "plant_id", "at" DESC
+) m
+WHERE p."id" = m."plant_id";
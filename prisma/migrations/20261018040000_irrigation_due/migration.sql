@@ -0,0 +1,10 @@
+-- CreateTable
+CREATE TABLE "IrrigationDue" (
+    "due_at" TIMESTAMP(3) NOT NULL,
+    "plant_id" TEXT NOT NULL,
+
+    CONSTRAINT "IrrigationDue_pkey" PRIMARY KEY ("plant_id")
+);
+
+-- AddForeignKey
+ALTER TABLE "IrrigationDue" ADD CONSTRAINT "IrrigationDue_plant_id_fkey" FOREIGN KEY ("plant_id") REFERENCES "Plant"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,7 @@
+-- CreateTable
+CREATE TABLE "SchedulerCursor" (
+    "id" INTEGER NOT NULL DEFAULT 1,
+    "ticked_at" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "SchedulerCursor_pkey" PRIMARY KEY ("id")
+);
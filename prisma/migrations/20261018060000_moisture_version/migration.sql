@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "Plant" ADD COLUMN     "moisture_version" INTEGER NOT NULL DEFAULT 0;
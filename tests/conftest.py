@@ -0,0 +1,65 @@
+import uuid
+import pytest
+import httpx
+
+
+PASSWORD = 'plantpal-test-password'
+
+
+@pytest.fixture(scope='session')
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture(scope='session')
+async def db():
+    # Imported here, tests without a database also run without the generated prisma client
+    try:
+        from app.prisma import prisma
+        await prisma.connect()
+        await prisma.execute_raw('SELECT 1')
+    except Exception as e:
+        pytest.skip(f'No database available: {e!r}')
+    yield prisma
+    await prisma.disconnect()
+
+
+@pytest.fixture
+async def client(db):
+    from app import app
+    async with httpx.AsyncClient(app=app, base_url='http://test') as client:
+        yield client
+
+
+@pytest.fixture
+async def plant(db):
+    '''
+    Verified user with one plant irrigated every day at 23:59
+    '''
+    from app.utils.hasher import get_password_hash
+    user = await db.user.create(data={
+        'email': f'{uuid.uuid4().hex}@plantpal.test',
+        'first_name': 'Test',
+        'last_name': 'User',
+        'password': get_password_hash(PASSWORD)
+    })
+    await db.verification.create(data={
+        'code': '000000',
+        'verified': True,
+        'user_id': user.id
+    })
+    plant = await db.plant.create(data={
+        'user_id': user.id,
+        'chip_id': uuid.uuid4().hex[:16],
+        'irrigation_type': 'time'
+    })
+    await db.timestamp.create(data={
+        'plant_id': plant.id,
+        'day_of_week': 'everyday',
+        'hour': 23,
+        'minute': 59
+    })
+    yield plant, user
+
+    await db.timestamp.delete_many(where={'plant_id': plant.id})
+    await db.user.delete(where={'id': user.id})
@@ -0,0 +1,74 @@
+import struct
+import datetime
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('prisma.enums', reason='The prisma client is not generated, run prisma generate')
+
+from app.plants.device_protocol import (
+    NO_TIME, unpack_request, pack_request, pack_plant, pack_bool, pack_count, pack_times, pack_next_time
+)
+from app.plants.schedule import weektime_to_minutes
+
+
+NOW = datetime.datetime(2026, 10, 19, 12, 0, tzinfo=datetime.timezone.utc)
+CHIP_ID = '0123456789abcdef'
+
+
+def test_identity_round_trip():
+    assert unpack_request(pack_request('plant-1', CHIP_ID), NOW) == {'plant_id': 'plant-1', 'chip_id': CHIP_ID}
+
+
+def test_readings_round_trip():
+    payload = unpack_request(pack_request('plant-1', CHIP_ID, [(0, 40), (90, 99)]), NOW)
+
+    assert payload['readings'] == [
+        {'at': NOW.isoformat(), 'percentage': 40},
+        {'at': (NOW - datetime.timedelta(seconds=90)).isoformat(), 'percentage': 99},
+    ]
+    assert unpack_request(pack_request('plant-1', CHIP_ID, []), NOW)['readings'] == []
+
+
+@pytest.mark.parametrize('body', [
+    b'',
+    # plant_id shorter than its length
+    b'\x07plant',
+    # chip_id too short
+    b'\x07plant-1' + b'0123',
+    # no room for the count
+    pack_request('plant-1', CHIP_ID) + b'\x01',
+    # count does not match the readings
+    pack_request('plant-1', CHIP_ID, [(0, 40)])[:-1],
+    pack_request('plant-1', CHIP_ID, [(0, 40)]) + b'\x00',
+    # not ascii
+    b'\x07plant-\xff' + CHIP_ID.encode(),
+])
+def test_malformed_requests(body):
+    with pytest.raises(ValueError):
+        unpack_request(body, NOW)
+
+
+def test_pack_plant():
+    plant = SimpleNamespace(water_amount=1000, auto_irrigation=True, irrigation_type='period', moisture_percentage_treshold=50, periodstamp_times_a_week=300)
+
+    assert struct.unpack('<HBBBB', pack_plant(plant)) == (1000, 1, 1, 50, 255)
+
+
+def test_pack_scalars():
+    assert struct.unpack('<B', pack_bool(True)) == (1,)
+    assert struct.unpack('<H', pack_count(1000)) == (1000,)
+
+
+def test_pack_times():
+    stamps = [SimpleNamespace(hour=9, minute=30), SimpleNamespace(hour=23, minute=59)]
+    body = pack_times(stamps, NOW)
+
+    (count,) = struct.unpack_from('<H', body)
+    assert count == 2
+    assert struct.unpack_from('<2H', body, 2) == (weektime_to_minutes(0, 9, 30), weektime_to_minutes(0, 23, 59))
+    assert pack_times([], NOW) == b'\x00\x00'
+
+
+def test_pack_next_time():
+    assert struct.unpack('<H', pack_next_time(SimpleNamespace(hour=1, minute=2), NOW)) == (62,)
+    assert struct.unpack('<H', pack_next_time(None, NOW)) == (NO_TIME,)
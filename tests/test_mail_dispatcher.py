@@ -0,0 +1,207 @@
+import time
+import socket
+import asyncio
+from collections import defaultdict
+from pathlib import Path
+import pytest
+from app.utils.send_email import MailDispatcher, MailQueueFullError
+
+
+TEMPLATE_FOLDER = str(Path(__file__).parent.parent / 'app' / 'templates' / 'email')
+
+RETRY_DELAY = 0.05
+
+
+class RecordingHandler:
+    '''
+    aiosmtpd handler accepting every email, recipients in `defer` are answered
+    451 for their first attempts, recipients in `refuse` always 550
+    '''
+
+    def __init__(self):
+        self.delivered: list[str] = []
+        self.attempts: dict[str, list[float]] = defaultdict(list)
+        self.defer: dict[str, int] = {}
+        self.refuse: set[str] = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        self.attempts[address].append(time.monotonic())
+        if address in self.refuse:
+            return '550 5.1.1 No such user'
+        if len(self.attempts[address]) <= self.defer.get(address, 0):
+            return '451 4.3.0 Try again later'
+
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.delivered.extend(envelope.rcpt_tos)
+        return '250 Message accepted for delivery'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+    handler = RecordingHandler()
+    controller = controller_module.Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield handler, controller.port
+    controller.stop()
+
+
+@pytest.fixture
+async def dispatcher(smtp_server):
+    _, port = smtp_server
+    dispatchers = []
+
+    def make(**options) -> MailDispatcher:
+        options = {
+            'connections': 1,
+            'queue_size': 10,
+            'batch_size': 3,
+            'max_attempts': 3,
+            'retry_delay': RETRY_DELAY,
+            'idle_seconds': 5.0,
+            **options
+        }
+        dispatcher = MailDispatcher(
+            {'hostname': '127.0.0.1', 'port': port, 'start_tls': False, 'timeout': 5.0},
+            'PlantPal <plantpal@plantpal.test>',
+            TEMPLATE_FOLDER,
+            **options
+        )
+        dispatchers.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for d in dispatchers:
+        await d.stop(1.0)
+
+
+def enqueue(dispatcher: MailDispatcher, email_to: str):
+    dispatcher.enqueue('Account Verification', email_to, {
+        'title': 'Verify Account',
+        'name': 'Test',
+        'user_id': 'user',
+        'code': '000000'
+    }, 'verify.html')
+
+
+async def wait_until(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'Timed out'
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.anyio
+async def test_sends_queued_emails_in_batches_over_one_session(smtp_server, dispatcher):
+    handler, _ = smtp_server
+    mails = dispatcher(batch_size=3)
+    batch_sizes = []
+    send_batch = mails._send_batch
+
+    async def recording_send_batch(session, batch):
+        batch_sizes.append(len(batch))
+        return await send_batch(session, batch)
+
+    mails._send_batch = recording_send_batch
+    recipients = [f'user-{i}@plantpal.test' for i in range(7)]
+    for email_to in recipients:
+        enqueue(mails, email_to)
+    mails.start()
+
+    await wait_until(lambda: mails.sent == 7)
+    assert batch_sizes == [3, 3, 1]
+    assert mails.sessions == 1
+    assert handler.delivered == recipients
+
+
+@pytest.mark.anyio
+async def test_retries_deferred_emails_with_backoff(smtp_server, dispatcher):
+    handler, _ = smtp_server
+    handler.defer['flaky@plantpal.test'] = 2
+    mails = dispatcher(max_attempts=3)
+    enqueue(mails, 'flaky@plantpal.test')
+    enqueue(mails, 'steady@plantpal.test')
+    mails.start()
+
+    await wait_until(lambda: mails.sent == 2)
+    attempts = handler.attempts['flaky@plantpal.test']
+    assert len(attempts) == 3
+    assert attempts[1] - attempts[0] >= RETRY_DELAY
+    assert attempts[2] - attempts[1] >= RETRY_DELAY * 2
+    assert mails.retried == 2
+    assert mails.failed == 0
+    # The deferral did not close the session
+    assert mails.sessions == 1
+
+
+@pytest.mark.anyio
+async def test_drops_emails_after_their_last_attempt(smtp_server, dispatcher):
+    handler, _ = smtp_server
+    handler.defer['flaky@plantpal.test'] = 100
+    mails = dispatcher(max_attempts=3)
+    enqueue(mails, 'flaky@plantpal.test')
+    mails.start()
+
+    await wait_until(lambda: mails.failed == 1)
+    assert len(handler.attempts['flaky@plantpal.test']) == 3
+    assert mails.retried == 2
+    assert mails.stats()['retrying'] == 0
+
+
+@pytest.mark.anyio
+async def test_does_not_retry_rejected_emails(smtp_server, dispatcher):
+    handler, _ = smtp_server
+    handler.refuse.add('unknown@plantpal.test')
+    mails = dispatcher()
+    enqueue(mails, 'unknown@plantpal.test')
+    enqueue(mails, 'steady@plantpal.test')
+    mails.start()
+
+    await wait_until(lambda: mails.sent == 1)
+    assert mails.failed == 1
+    assert mails.retried == 0
+    assert len(handler.attempts['unknown@plantpal.test']) == 1
+
+
+def test_full_queue_rejects_emails():
+    mails = MailDispatcher({}, 'PlantPal <plantpal@plantpal.test>', TEMPLATE_FOLDER, 1, 2, 1, 1, RETRY_DELAY, 1.0)
+    enqueue(mails, 'first@plantpal.test')
+    enqueue(mails, 'second@plantpal.test')
+
+    with pytest.raises(MailQueueFullError):
+        enqueue(mails, 'third@plantpal.test')
+    assert mails.rejected == 1
+    assert mails.stats()['queue_depth'] == 2
+
+
+@pytest.mark.anyio
+async def test_full_queue_answers_503(client, db, monkeypatch):
+    from app.utils.send_email import mail_dispatcher
+    from .conftest import PASSWORD
+
+    user = await db.user.create(data={
+        'email': f'{time.time_ns()}@plantpal.test',
+        'first_name': 'Test',
+        'last_name': 'User',
+        'password': PASSWORD
+    })
+    await db.verification.create(data={'code': '000000', 'user_id': user.id})
+    full = asyncio.Queue(1)
+    full.put_nowait(None)
+    monkeypatch.setattr(mail_dispatcher, '_queue', full)
+    try:
+        response = await client.post('/auth/user/resend_verification', json={'email': user.email})
+    finally:
+        await db.user.delete(where={'id': user.id})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '10'
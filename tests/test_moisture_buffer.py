@@ -0,0 +1,129 @@
+import os
+import shutil
+import datetime
+import pytest
+
+pytest.importorskip('prisma.enums', reason='The prisma client is not generated, run prisma generate')
+
+from app.plants import moisture_buffer as buffer_module
+from app.plants.moisture_buffer import MoistureBuffer
+from app.plants.rollups import store_readings
+
+
+NOW = datetime.datetime(2026, 10, 19, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+class FakeStore:
+    '''
+    Stores readings by id like STORE_READINGS_QUERY, readings stored before are skipped
+    '''
+
+    def __init__(self):
+        self.rows: dict[str, dict] = {}
+        self.failures = 0
+
+    async def __call__(self, readings: list[dict]) -> int:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Database unavailable')
+        new = [r for r in readings if r['id'] not in self.rows]
+        self.rows.update((r['id'], r) for r in new)
+        return len(new)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(buffer_module, 'store_readings', store)
+    return store
+
+
+def make_buffer(log_dir) -> MoistureBuffer:
+    return MoistureBuffer(True, str(log_dir), flush_size=100, flush_seconds=1.0, max_size=1000, fsync=False)
+
+
+def readings(count: int) -> list[dict]:
+    return [MoistureBuffer.reading('plant', 40 + i, NOW + datetime.timedelta(minutes=i)) for i in range(count)]
+
+
+async def crashed_segment(log_dir, count: int) -> str:
+    '''
+    Path of the segment a worker left behind after it buffered `count` readings
+    '''
+    crashed = make_buffer(log_dir)
+    await crashed.add(readings(count))
+    segment = crashed._segment
+    segment._file.close()
+    return segment.path
+
+
+@pytest.mark.anyio
+async def test_replay_stores_segments_left_behind(tmp_path, store):
+    path = await crashed_segment(tmp_path, 3)
+    with open(path, 'ab') as file:
+        # Torn line of a worker that crashed while appending
+        file.write(b'{"id": "torn", "plant_')
+
+    buffer = make_buffer(tmp_path)
+    assert await buffer.replay() == 3
+
+    assert len(store.rows) == 3
+    assert buffer.stored == 3
+    assert not os.path.exists(path)
+    assert all(isinstance(r['at'], datetime.datetime) for r in store.rows.values())
+
+
+@pytest.mark.anyio
+async def test_replaying_a_segment_twice_stores_it_once(tmp_path, store):
+    path = await crashed_segment(tmp_path, 3)
+    # A worker that crashed after storing the segment, before removing it
+    shutil.copy(path, tmp_path / 'copy')
+
+    buffer = make_buffer(tmp_path)
+    await buffer.replay()
+    shutil.move(tmp_path / 'copy', path)
+    assert await buffer.replay() == 3
+
+    assert len(store.rows) == 3
+    assert buffer.stored == 3
+    assert not os.path.exists(path)
+
+
+@pytest.mark.anyio
+async def test_failed_replay_is_retried_by_the_next_flush(tmp_path, store):
+    path = await crashed_segment(tmp_path, 3)
+    store.failures = 1
+
+    buffer = make_buffer(tmp_path)
+    assert await buffer.replay() == 0
+    assert len(buffer) == 3
+    assert os.path.exists(path)
+
+    await buffer.flush()
+    assert len(buffer) == 0
+    assert len(store.rows) == 3
+    assert not os.path.exists(path)
+
+
+@pytest.mark.anyio
+async def test_storing_readings_twice_stores_them_once(plant, db):
+    plant, _ = plant
+    stored = [MoistureBuffer.reading(plant.id, 40 + i, NOW + datetime.timedelta(minutes=i)) for i in range(3)]
+
+    assert await store_readings(stored) == 3
+    assert await store_readings(stored) == 0
+    assert await db.moisturepercentagerecord.count(where={'plant_id': plant.id}) == 3
+
+
+@pytest.mark.anyio
+async def test_backfilled_readings_move_the_moisture_version(plant, db):
+    plant, _ = plant
+    await store_readings([MoistureBuffer.reading(plant.id, 40, NOW)])
+    latest = await db.plant.find_unique(where={'id': plant.id})
+
+    await store_readings([MoistureBuffer.reading(plant.id, 60, NOW - datetime.timedelta(days=1))])
+    backfilled = await db.plant.find_unique(where={'id': plant.id})
+
+    assert backfilled.moisture_version == latest.moisture_version + 1
+    assert backfilled.last_moisture_percentage == 40
+    assert backfilled.last_moisture_at == latest.last_moisture_at
@@ -0,0 +1,83 @@
+import datetime
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('prisma.enums', reason='The prisma client is not generated, run prisma generate')
+
+from app.plants.moisture_policy import LatestMoisture
+
+
+NOW = datetime.datetime(2026, 10, 19, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def make_plant(deadband: int = 5, heartbeat_seconds: int = 3600):
+    return SimpleNamespace(id='plant', moisture_deadband=deadband, moisture_heartbeat_seconds=heartbeat_seconds)
+
+
+def stored(latest: LatestMoisture, percentage: int, at: datetime.datetime):
+    latest.record('plant', percentage, at, f'record-{percentage}')
+
+
+def test_stores_every_reading_without_deadband():
+    latest = LatestMoisture(10)
+    stored(latest, 50, NOW)
+
+    assert latest.should_store(make_plant(deadband=0), 50, NOW)
+
+
+def test_stores_the_first_reading():
+    assert LatestMoisture(10).should_store(make_plant(), 50, NOW)
+
+
+def test_filters_readings_within_the_deadband():
+    latest = LatestMoisture(10)
+    plant = make_plant(deadband=5)
+    stored(latest, 50, NOW)
+    later = NOW + datetime.timedelta(minutes=1)
+
+    assert not latest.should_store(plant, 55, later)
+    assert not latest.should_store(plant, 45, later)
+    assert latest.should_store(plant, 56, later)
+    assert latest.should_store(plant, 44, later)
+
+
+def test_stores_after_the_heartbeat():
+    latest = LatestMoisture(10)
+    plant = make_plant(heartbeat_seconds=600)
+    stored(latest, 50, NOW)
+
+    assert not latest.should_store(plant, 50, NOW + datetime.timedelta(seconds=599))
+    assert latest.should_store(plant, 50, NOW + datetime.timedelta(seconds=600))
+
+
+def test_stores_backfilled_readings():
+    latest = LatestMoisture(10)
+    stored(latest, 50, NOW)
+
+    assert latest.should_store(make_plant(), 50, NOW - datetime.timedelta(seconds=1))
+
+
+def test_naive_timestamps_are_utc():
+    latest = LatestMoisture(10)
+    stored(latest, 50, NOW)
+
+    assert not latest.should_store(make_plant(), 50, NOW.replace(tzinfo=None) + datetime.timedelta(minutes=1))
+
+
+def test_record_keeps_the_latest_stored_reading():
+    latest = LatestMoisture(10)
+    stored(latest, 50, NOW)
+    stored(latest, 40, NOW - datetime.timedelta(minutes=1))
+    latest.record('plant', 70, NOW + datetime.timedelta(minutes=1))
+
+    assert latest.get('plant').id == 'record-50'
+    assert (latest.stored, latest.filtered) == (2, 1)
+
+
+def test_pop_forgets_the_reading():
+    latest = LatestMoisture(10)
+    stored(latest, 50, NOW)
+    latest.pop('plant')
+
+    assert latest.get('plant') is None
+    assert latest.should_store(make_plant(), 50, NOW + datetime.timedelta(minutes=1))
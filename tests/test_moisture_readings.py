@@ -0,0 +1,33 @@
+import datetime
+import pytest
+from pydantic import ValidationError
+
+pytest.importorskip('prisma.enums', reason='The prisma client is not generated, run prisma generate')
+
+from app.plants.schemas import MoistureReading, MAX_CLOCK_SKEW
+
+
+def test_reading_accepts_timestamps_up_to_the_clock_skew():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for at in (now - datetime.timedelta(days=1), now, now + MAX_CLOCK_SKEW - datetime.timedelta(seconds=10)):
+        assert MoistureReading(percentage=50, at=at).at == at
+
+
+def test_reading_accepts_other_timezones():
+    at = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=2)))
+    assert MoistureReading(percentage=50, at=at.isoformat()).at == at
+
+
+def test_reading_without_timestamp():
+    assert MoistureReading(percentage=50).at is None
+
+
+def test_reading_rejects_timestamps_in_the_future():
+    at = datetime.datetime.now(datetime.timezone.utc) + MAX_CLOCK_SKEW + datetime.timedelta(minutes=1)
+    with pytest.raises(ValidationError, match='Timestamp can not be in the future'):
+        MoistureReading(percentage=50, at=at)
+
+
+def test_reading_rejects_naive_timestamps():
+    with pytest.raises(ValidationError, match='Timestamp must include a timezone'):
+        MoistureReading(percentage=50, at='2026-10-18T12:00:00')
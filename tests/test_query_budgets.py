@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip('prisma.enums', reason='The prisma client is not generated, run prisma generate')
+
+from app.prisma import RequestQueries, request_queries
+from app.query_recorder import assert_max_queries
+from .conftest import PASSWORD
+
+
+def test_assert_max_queries_counts_the_block():
+    with assert_max_queries(2) as queries:
+        request_queries.get().add(RequestQueries(count=2, log=[('plant', 'find_first', '{}', 0.0)] * 2))
+
+    assert queries.count == 2
+    assert request_queries.get() is None
+
+
+def test_assert_max_queries_fails_over_budget():
+    with pytest.raises(AssertionError, match='3 database queries issued, at most 2 expected'):
+        with assert_max_queries(2):
+            request_queries.get().add(RequestQueries(count=3, log=[]))
+
+
+@pytest.mark.anyio
+async def test_auth_routes(client, plant):
+    _, user = plant
+
+    with assert_max_queries(1):
+        response = await client.post('/auth/login', json={'email': user.email, 'password': PASSWORD})
+    assert response.status_code == 200
+    headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+
+    with assert_max_queries(1):
+        response = await client.get('/auth/user', headers=headers)
+    assert response.status_code == 200
+    assert response.json()['verified'] is True
+
+
+@pytest.mark.anyio
+async def test_hot_plant_routes(client, plant):
+    plant, user = plant
+    response = await client.post('/auth/login', json={'email': user.email, 'password': PASSWORD})
+    headers = {'Authorization': f'Bearer {response.json()["access_token"]}'}
+    device = {'plant_id': plant.id, 'chip_id': plant.chip_id}
+
+    for path in ('/plants/', '/plants/overview', f'/plants/{plant.id}'):
+        with assert_max_queries(1):
+            response = await client.get(path, headers=headers)
+        assert response.status_code == 200, path
+
+    with assert_max_queries(1):
+        response = await client.post('/plants/espget', json=device)
+    assert response.status_code == 200
+    # The device identity is cached by the first request
+    with assert_max_queries(0):
+        response = await client.post('/plants/espget', json=device)
+    assert response.status_code == 200
+
+    with assert_max_queries(1):
+        response = await client.post('/plants/current_moisture/40', json=device)
+    assert response.status_code == 200
+
+    with assert_max_queries(2):
+        response = await client.post('/plants/should_irrigate_now', json=device)
+    assert response.status_code == 200
+
+    with assert_max_queries(3):
+        response = await client.post('/plants/irrigate', json=device)
+    assert response.status_code == 200
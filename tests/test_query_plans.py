@@ -0,0 +1,199 @@
+'''
+Checks that the plants queries keep using their indexes on a seeded database.
+
+Raw queries are checked on their EXPLAIN output, prisma queries on the index and sequential
+scan counters of Postgres while the crud function issuing them runs.
+'''
+import json
+import asyncio
+import datetime
+import pytest
+
+pytest.importorskip('prisma.enums', reason='The prisma client is not generated, run prisma generate')
+
+from app.cache import device_identities
+from app.utils.export import ExportRecords
+from app.plants import crud
+from app.plants.crud import MOISTURE_BUCKETS_QUERY, PLANTS_OVERVIEW_QUERY
+from app.plants.rollups import ROLLUP_TABLES, ROLLUP_BUCKETS_QUERY, STORE_READINGS_QUERY, rebuild_rollups
+from app.plants.schedule import schedule_index
+from app.plants.scheduler import LATEST_MOISTURE_QUERY, SAVE_DUE_QUERY
+
+
+PLANTS = 10000
+PLANTS_PER_USER = 10
+RECORDS_PER_PLANT = 20
+
+USER = 'query-plans-user-1'
+PLANT = 'query-plans-plant-1'
+CHIP_ID = '0000000000000001'
+
+# Tables that grow with the fleet, a sequential scan on them is a regression
+LARGE_TABLES = {'MoisturePercentageRecord', 'IrrigationRecord', 'Timestamp', 'Periodstamp', 'Plant', *ROLLUP_TABLES.values()}
+
+# Counters of other connections reach the statistics views with a delay
+STATS_TIMEOUT = 5.0
+
+
+@pytest.fixture(scope='module')
+async def seeded(db):
+    users = PLANTS // PLANTS_PER_USER
+    await db.execute_raw(
+        'INSERT INTO "User" (id, email, first_name, last_name, password, updated_at) '
+        'SELECT \'query-plans-user-\' || g, \'query-plans-user-\' || g || \'@plantpal.local\', '
+        '\'Query\', \'Plans\', \'-\', now() '
+        'FROM generate_series(1, $1::int) g',
+        users
+    )
+    await db.execute_raw(
+        'INSERT INTO "Plant" (id, chip_id, user_id, irrigation_type, updated_at) '
+        'SELECT \'query-plans-plant-\' || g, lpad(to_hex(g), 16, \'0\'), '
+        '\'query-plans-user-\' || ((g - 1) % $1::int + 1), '
+        '(CASE WHEN g % 2 = 1 THEN \'time\' ELSE \'period\' END)::"IrrigationType", now() '
+        'FROM generate_series(1, $2::int) g',
+        users, PLANTS
+    )
+    for table in ('Timestamp', 'Periodstamp'):
+        await db.execute_raw(
+            f'INSERT INTO "{table}" (id, day_of_week, hour, minute, plant_id) '
+            f'SELECT \'query-plans-{table}-\' || g, '
+            '(enum_range(NULL::"DayOfWeek"))[g % 8 + 1], g % 24, g % 60, '
+            '\'query-plans-plant-\' || (g % $1::int + 1) '
+            'FROM generate_series(1, $1::int * 6) g',
+            PLANTS
+        )
+    await db.execute_raw(
+        'INSERT INTO "MoisturePercentageRecord" (id, percentage, at, plant_id) '
+        'SELECT \'query-plans-m-\' || g, g % 99 + 1, now() - make_interval(mins => g / $1::int), '
+        '\'query-plans-plant-\' || (g % $1::int + 1) '
+        'FROM generate_series(1, $1::int * $2::int) g',
+        PLANTS, RECORDS_PER_PLANT
+    )
+    await db.execute_raw(
+        'INSERT INTO "IrrigationRecord" (id, at, plant_id) '
+        'SELECT \'query-plans-i-\' || g, now() - make_interval(hours => g / $1::int), '
+        '\'query-plans-plant-\' || (g % $1::int + 1) '
+        'FROM generate_series(1, $1::int * 2) g',
+        PLANTS
+    )
+    await rebuild_rollups()
+    await db.execute_raw('ANALYZE')
+    yield db
+
+    for table in ('Timestamp', 'Periodstamp'):
+        await db.execute_raw(f'DELETE FROM "{table}" WHERE id LIKE \'query-plans-%\'')
+    await db.execute_raw('DELETE FROM "User" WHERE id LIKE \'query-plans-user-%\'')
+
+
+def plan_nodes(node: dict):
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+async def explain(db, query: str, *args) -> list[dict]:
+    result = await db.query_raw(f'EXPLAIN (FORMAT JSON) {query}', *args)
+    plan = result[0]['QUERY PLAN']
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return list(plan_nodes(plan[0]['Plan']))
+
+
+def readings_json():
+    return json.dumps([{
+        'id': 'query-plans-new',
+        'plant_id': PLANT,
+        'at': datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).isoformat(),
+        'percentage': 50,
+        'stored': True
+    }])
+
+
+def save_due_args():
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    return json.dumps([PLANT]), now.isoformat(), (now - datetime.timedelta(minutes=15)).isoformat()
+
+
+EXPLAIN_CHECKS = [
+    ('STORE_READINGS_QUERY', 'Plant_pkey', STORE_READINGS_QUERY, lambda: (readings_json(),)),
+    ('LATEST_MOISTURE_QUERY', 'Plant_pkey', LATEST_MOISTURE_QUERY, lambda: (json.dumps([PLANT]),)),
+    ('SAVE_DUE_QUERY', 'Plant_pkey', SAVE_DUE_QUERY, save_due_args),
+    ('PLANTS_OVERVIEW_QUERY', 'IrrigationRecord_plant_id_at_idx', PLANTS_OVERVIEW_QUERY, lambda: (USER,)),
+    ('MOISTURE_BUCKETS_QUERY', 'MoisturePercentageRecord_plant_id_at_idx', MOISTURE_BUCKETS_QUERY, lambda: (PLANT, '1970-01-01T00:00:00', 200)),
+    *(
+        (f'ROLLUP_BUCKETS_QUERY ({unit})', f'{table}_pkey', ROLLUP_BUCKETS_QUERY.format(table=table, unit=unit), lambda: (PLANT, '1970-01-01T00:00:00', 200))
+        for unit, table in ROLLUP_TABLES.items()
+    ),
+]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize('name, index, query, args', EXPLAIN_CHECKS, ids=[c[0] for c in EXPLAIN_CHECKS])
+async def test_raw_query_plan(seeded, name, index, query, args):
+    nodes = await explain(seeded, query, *args())
+
+    scanned = {n['Relation Name'] for n in nodes if n['Node Type'] == 'Seq Scan' and n.get('Relation Name') in LARGE_TABLES}
+    assert not scanned, f'{name} scans {scanned} sequentially'
+    assert any(n.get('Index Name') == index for n in nodes), f'{name} does not use {index}'
+
+
+async def scan_counts(db) -> tuple[dict, dict]:
+    indexes = await db.query_raw('SELECT indexrelname AS name, idx_scan AS scans FROM pg_stat_user_indexes')
+    tables = await db.query_raw('SELECT relname AS name, seq_scan AS scans FROM pg_stat_user_tables')
+    return {r['name']: r['scans'] for r in indexes}, {r['name']: r['scans'] for r in tables}
+
+
+async def assert_index_scans(db, indexes: set[str], run):
+    index_scans, seq_scans = await scan_counts(db)
+    await run()
+
+    deadline = asyncio.get_running_loop().time() + STATS_TIMEOUT
+    while True:
+        index_scans_after, seq_scans_after = await scan_counts(db)
+        used = {i for i in indexes if index_scans_after.get(i, 0) > index_scans.get(i, 0)}
+        if used or asyncio.get_running_loop().time() > deadline:
+            break
+        await asyncio.sleep(0.1)
+
+    assert used, f'none of {indexes} was used'
+    scanned = {t for t in LARGE_TABLES if seq_scans_after.get(t, 0) > seq_scans.get(t, 0)}
+    assert not scanned, f'{scanned} scanned sequentially'
+
+
+async def get_plant_by_chip_id():
+    device_identities.clear()
+    await crud.get_plant_by_chip_id(PLANT, CHIP_ID)
+
+
+async def get_should_irrigate_now():
+    schedule_index.clear()
+    await crud.get_should_irrigate_now(PLANT, CHIP_ID)
+
+
+async def get_plant_schedule():
+    plant = await crud.get_plant_by_chip_id(PLANT, CHIP_ID)
+    schedule_index.clear()
+    await crud.get_plant_schedule(plant)
+
+
+async def iterate_plant_records(records: ExportRecords):
+    async for _ in crud.iterate_plant_records(PLANT, records, None, None):
+        pass
+
+
+PRISMA_CHECKS = [
+    ('get_plant_by_chip_id', {'Plant_pkey', 'Plant_chip_id_key'}, get_plant_by_chip_id),
+    ('get_plant_by_id', {'Plant_pkey'}, lambda: crud.get_plant_by_id(USER, PLANT)),
+    ('get_plants', {'Plant_user_id_idx'}, lambda: crud.get_plants(USER)),
+    ('get_current_moisture', {'MoisturePercentageRecord_plant_id_at_idx'}, lambda: crud.get_current_moisture(USER, PLANT)),
+    ('get_should_irrigate_now', {'Timestamp_plant_id_day_of_week_hour_minute_idx'}, get_should_irrigate_now),
+    ('get_plant_schedule', {'Timestamp_plant_id_day_of_week_hour_minute_idx'}, get_plant_schedule),
+    ('iterate_plant_records (moisture)', {'MoisturePercentageRecord_plant_id_at_idx'}, lambda: iterate_plant_records(ExportRecords.moisture_percentage)),
+    ('iterate_plant_records (irrigations)', {'IrrigationRecord_plant_id_at_idx'}, lambda: iterate_plant_records(ExportRecords.irrigations)),
+]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize('name, indexes, run', PRISMA_CHECKS, ids=[c[0] for c in PRISMA_CHECKS])
+async def test_prisma_query_plan(seeded, name, indexes, run):
+    await assert_index_scans(seeded, indexes, run)
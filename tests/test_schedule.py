@@ -0,0 +1,118 @@
+import datetime
+import pytest
+
+pytest.importorskip('prisma.enums', reason='The prisma client is not generated, run prisma generate')
+
+from prisma.enums import DayOfWeek
+from app.plants.schedule import PlantSchedule, ScheduleIndex, ScheduledStamp, weektime_to_minutes
+from app.plants.scheduler import TimerWheel
+
+
+# A monday
+MONDAY = datetime.datetime(2026, 10, 19)
+
+STAMPS = [
+    ScheduledStamp('tuesday-8', DayOfWeek.tuesday, 8, 0),
+    ScheduledStamp('monday-12', DayOfWeek.monday, 12, 0),
+    ScheduledStamp('everyday-23', DayOfWeek.everyday, 23, 59),
+    ScheduledStamp('monday-9', DayOfWeek.monday, 9, 0),
+]
+
+
+def test_schedule_sorts_stamps_and_expands_everyday():
+    schedule = PlantSchedule('time', STAMPS)
+
+    assert list(schedule.minutes) == sorted(schedule.minutes)
+    assert len(schedule.minutes) == 3 + 7
+    assert [s.id for s in schedule.stamps[:3]] == ['monday-9', 'monday-12', 'everyday-23']
+    assert schedule.minutes[0] == weektime_to_minutes(0, 9, 0)
+
+
+def test_schedule_today():
+    schedule = PlantSchedule('time', STAMPS)
+
+    assert [s.id for s in schedule.today(MONDAY.replace(hour=10))] == ['monday-12', 'everyday-23']
+    assert schedule.next_today(MONDAY.replace(hour=10)).id == 'monday-12'
+    # The stamp of the current minute is still due
+    assert schedule.next_today(MONDAY.replace(hour=12, second=30)).id == 'monday-12'
+    assert [s.id for s in schedule.today(MONDAY + datetime.timedelta(days=1))] == ['tuesday-8', 'everyday-23']
+
+
+def test_schedule_without_stamps_left_today():
+    schedule = PlantSchedule('time', STAMPS)
+    sunday = MONDAY + datetime.timedelta(days=6)
+
+    assert schedule.next_today(sunday.replace(hour=23, minute=59, second=59)).id == 'everyday-23'
+    assert PlantSchedule('time', [STAMPS[1], STAMPS[3]]).next_today(MONDAY.replace(hour=13)) is None
+    assert PlantSchedule('period', []).next_today(MONDAY) is None
+
+
+def test_index_keeps_schedules_loaded_at_the_current_version():
+    index = ScheduleIndex()
+    version = index.version('plant')
+
+    schedule = index.put('plant', version, 'time', STAMPS)
+    assert index.get('plant') is schedule
+
+
+def test_index_drops_schedules_loaded_before_an_invalidation():
+    index = ScheduleIndex()
+    invalidated = []
+    index.on_invalidate(invalidated.append)
+    version = index.version('plant')
+
+    index.invalidate('plant')
+    schedule = index.put('plant', version, 'time', STAMPS)
+
+    assert invalidated == ['plant']
+    assert index.version('plant') == version + 1
+    # The stale schedule is still returned to its caller, but not indexed
+    assert schedule.stamps
+    assert index.get('plant') is None
+
+
+def test_index_invalidate_drops_the_schedule():
+    index = ScheduleIndex()
+    index.put('plant', index.version('plant'), 'time', STAMPS)
+
+    index.invalidate('plant')
+    assert index.get('plant') is None
+
+
+def test_index_clear_bumps_versions_without_listeners():
+    index = ScheduleIndex()
+    invalidated = []
+    index.on_invalidate(invalidated.append)
+    version = index.version('plant')
+    index.put('plant', version, 'time', STAMPS)
+
+    index.clear()
+
+    assert index.get('plant') is None
+    assert index.version('plant') == version + 1
+    assert invalidated == []
+
+
+def test_timer_wheel():
+    wheel = TimerWheel()
+    wheel.set_plant('a', [10, 20, 20])
+    wheel.set_plant('b', [20])
+
+    assert len(wheel) == 2
+    assert wheel.due(10) == {'a'}
+    assert wheel.due(20) == {'a', 'b'}
+    assert wheel.due(30) == set()
+
+
+def test_timer_wheel_replaces_and_removes_plants():
+    wheel = TimerWheel()
+    wheel.set_plant('a', [10, 20])
+
+    wheel.set_plant('a', [30])
+    assert wheel.due(10) == set()
+    assert wheel.due(30) == {'a'}
+
+    wheel.remove_plant('a')
+    wheel.remove_plant('unknown')
+    assert wheel.due(30) == set()
+    assert len(wheel) == 0
@@ -0,0 +1,89 @@
+import datetime
+import orjson
+import pytest
+
+pytest.importorskip('prisma.enums', reason='The prisma client is not generated, run prisma generate')
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from prisma.enums import DayOfWeek, IrrigationType
+from prisma.models import Plant, Timestamp
+from app.plants import schemas
+from app.plants.schedule import ScheduledStamp
+from app.plants.routers import (
+    plant_small_serializer, plant_serializer, plant_overview_serializer, plant_stamps_serializer,
+    plant_timestamps_serializer, plant_periodstamps_serializer, timestamp_serializer
+)
+
+
+NOW = datetime.datetime(2026, 10, 19, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+
+
+def make_timestamp(i: int) -> Timestamp:
+    return Timestamp(id=f'timestamp-{i}', day_of_week=DayOfWeek.everyday, hour=i % 24, minute=i % 60, plant_id='plant-0')
+
+
+def make_plant(i: int, stamps: int = 0) -> Plant:
+    return Plant(
+        id=f'plant-{i}',
+        chip_id=f'{i:016x}',
+        name=f'Plant {i}',
+        water_amount=1000,
+        created_at=NOW,
+        updated_at=NOW,
+        auto_irrigation=True,
+        moisture_percentage_treshold=50,
+        moisture_deadband=2,
+        moisture_heartbeat_seconds=600,
+        moisture_version=0,
+        irrigation_type=IrrigationType.time,
+        periodstamp_times_a_week=0,
+        user_id='user-0',
+        timestamps=[make_timestamp(t) for t in range(stamps)],
+        periodstamps=[make_timestamp(t) for t in range(stamps)]
+    )
+
+
+def make_overview(i: int, readings: bool) -> dict:
+    plant = make_plant(i).dict()
+    return {
+        **plant,
+        'current_moisture': {'percentage': 40, 'at': NOW} if readings else None,
+        'last_irrigation': {'water_amount': 1000, 'at': NOW} if readings else None,
+        'next_irrigation_time': ScheduledStamp('timestamp-0', DayOfWeek.monday, 23, 59) if readings else None
+    }
+
+
+def response_model_body(model, content) -> bytes:
+    # What FastAPI does with the return value of a route declaring a response_model,
+    # the coroutine never suspends so it is driven without an event loop
+    field = create_response_field(name='Response', type_=model)
+    try:
+        serialize_response(field=field, response_content=content).send(None)
+    except StopIteration as result:
+        return JSONResponse(result.value).body
+
+
+CASES = [
+    ('plants', list[schemas.PlantResponseSmall], plant_small_serializer.response_many, [make_plant(i) for i in range(3)]),
+    ('plant', schemas.PlantResponse, plant_serializer.response, make_plant(0)),
+    ('timestamps', schemas.PlantWithTimeStampsResponse, plant_timestamps_serializer.response, make_plant(0, 5)),
+    ('periodstamps', schemas.PlantWithPeriodStampsResponse, plant_periodstamps_serializer.response, make_plant(0, 5)),
+    ('today times', list[schemas.TimeStamp], timestamp_serializer.response_many, [make_timestamp(i) for i in range(3)]),
+    ('next time', schemas.TimeStamp, timestamp_serializer.response, ScheduledStamp('timestamp-0', DayOfWeek.friday, 8, 5)),
+    ('overview', list[schemas.PlantOverviewResponse], plant_overview_serializer.response_many, [make_overview(0, True), make_overview(1, False)]),
+]
+
+
+@pytest.mark.parametrize('model, serialize, content', [c[1:] for c in CASES], ids=[c[0] for c in CASES])
+def test_serializer_matches_response_model(model, serialize, content):
+    assert orjson.loads(serialize(content).body) == orjson.loads(response_model_body(model, content))
+
+
+def test_stamps_serializer_matches_response_model():
+    plant = make_plant(0, 3)
+    stamps = plant.timestamps
+    expected = response_model_body(schemas.PlantWithIrrigationStampsResponse, {**plant.dict(), 'stamps': stamps})
+
+    assert orjson.loads(plant_stamps_serializer.response(plant, stamps=stamps).body) == orjson.loads(expected)